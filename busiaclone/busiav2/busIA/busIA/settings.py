@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,11 +44,17 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        # Las consultas por solicitud las resume monitoreo; DEBUG aquí imprime cada sentencia
         'django.db.backends': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': 'INFO',
             'propagate': True,
         },
+        'monitoreo': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'django.mail': {
             'handlers': ['console'],
             'level': 'DEBUG',
@@ -87,10 +94,13 @@ INSTALLED_APPS = [
     'usuarios',
     'bus_empresas',
     'pasajes',
+    'monitoreo',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'monitoreo.middleware.PerfiladoMiddleware',
+    'monitoreo.middleware.PresupuestoConsultasMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -131,6 +141,22 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Base de pruebas en archivo: las pruebas con hilos (reservas
+        # concurrentes, embudo de compra) esperan los bloqueos de SQLite en
+        # lugar de fallar con "database table is locked", como ocurre con la
+        # base en memoria de caché compartida
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'busia',
     }
 }
 
@@ -242,3 +268,73 @@ CSRF_TRUSTED_ORIGINS = ['http://localhost:8000']
 LOGIN_URL = 'usuarios:login'
 LOGIN_REDIRECT_URL = 'usuarios:dashboard'
 LOGOUT_REDIRECT_URL = 'usuarios:login'
+
+# Límite de envío de las notificaciones masivas (cancelaciones, retrasos), en mensajes por segundo
+NOTIFICACIONES_MAX_POR_SEGUNDO = 20
+
+# Configuración de pasajes
+# Tiempo que una reserva pendiente bloquea el asiento mientras se completa el pago
+RETENCION_ASIENTO = timedelta(minutes=10)
+
+# Cache de resultados del autocompletado de ciudades.
+# BACKEND: 'local' (LRU propia de cada proceso) o un alias de CACHES
+AUTOCOMPLETADO_CACHE = {
+    'BACKEND': 'local',
+    'MAX_ENTRADAS': 5000,
+    'TTL': 300,  # segundos
+}
+
+# Cache de resultados de búsqueda de viajes (pasajes.busquedas): alias de CACHES,
+# vencimiento de respaldo y espera máxima por el cálculo de otra solicitud.
+# En producción debe ser un backend compartido (check --deploy falla con locmem)
+BUSQUEDAS_CACHE = {
+    'BACKEND': 'default',
+    'TTL': 300,  # segundos
+    'ESPERA': 5,  # segundos
+}
+
+# Grafo en memoria de la búsqueda de conexiones (pasajes.conexiones): días
+# cargados por proceso y vencimiento para recoger cambios de otros procesos
+CONEXIONES = {
+    'MAX_DIAS': 8,
+    'TTL': 600,  # segundos
+}
+
+# Conteo de consultas por solicitud y detección de N+1 (monitoreo).
+# PRESUPUESTOS: consultas máximas por vista; en las pruebas exceder uno falla
+PRUEBAS = sys.argv[1:2] == ['test']
+MONITOREO_CONSULTAS = {
+    'ACTIVO': DEBUG or PRUEBAS,
+    'ESTRICTO': PRUEBAS,
+    'UMBRAL_REPETICIONES': 5,
+    'PRESUPUESTOS': {
+        'pasajes:comprar': 4,
+        'pasajes:buscar_ciudades': 4,
+        'pasajes:buscar_viajes': 6,
+        'pasajes:calendario_precios': 5,
+        'pasajes:buscar_conexiones': 9,
+        'pasajes:obtener_asientos': 8,
+        'pasajes:crear_reserva': 25,
+        'pasajes:confirmar_pago': 15,
+        'usuarios:cancelar_reserva': 16,
+    },
+}
+
+# Token para que Prometheus lea /monitoreo/metricas/ (Authorization: Bearer <token>);
+# sin token solo el staff puede consultarlas
+MONITOREO_METRICAS_TOKEN = os.environ.get('MONITOREO_METRICAS_TOKEN')
+# Endpoint que lee por defecto el comando volcar_metricas: las métricas viven
+# en el proceso del servidor, no en el del comando
+MONITOREO_METRICAS_URL = os.environ.get('MONITOREO_METRICAS_URL', 'http://localhost:8000/monitoreo/metricas/')
+
+
+# Perfilado de solicitudes con cProfile: cabecera X-Perfilar firmada
+# (manage.py token_perfilado), ?_perfilar para staff o TASA_MUESTREO.
+# Los perfiles se consultan en el admin
+MONITOREO_PERFILADO = {
+    'ACTIVO': True,
+    'TASA_MUESTREO': float(os.environ.get('MONITOREO_TASA_MUESTREO', 0)),
+    'APPS': ['pasajes', 'usuarios'],
+    'TOP_N': 30,
+    'MAX_PERFILES': 500,
+}
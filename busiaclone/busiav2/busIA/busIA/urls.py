@@ -23,5 +23,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('usuarios/', include('usuarios.urls')),  # Conecta las rutas de usuarios
     path('pasajes/', include('pasajes.urls')),  # Conecta las rutas de pasajes
+    path('monitoreo/', include('monitoreo.urls')),  # Métricas para Prometheus
     path('', include('landing.urls')),  # Conecta las rutas de la landingpage
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,38 @@
+from django.contrib import admin
+from django.utils.html import format_html, format_html_join
+
+from .models import PerfilSolicitud
+
+
+def _tabla(filas):
+    return format_html(
+        '<table><thead><tr><th>Función</th><th>Llamadas</th><th>Propio (ms)</th>'
+        '<th>Acumulado (ms)</th></tr></thead><tbody>{}</tbody></table>',
+        format_html_join('', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>', (
+            (fila['funcion'], fila['llamadas'], fila['propio_ms'], fila['acumulado_ms']) for fila in filas
+        )),
+    )
+
+
+@admin.register(PerfilSolicitud)
+class PerfilSolicitudAdmin(admin.ModelAdmin):
+    list_display = ('creado', 'metodo', 'vista', 'estado_http', 'duracion_ms', 'motivo', 'usuario')
+    list_filter = ('motivo', 'vista', 'metodo')
+    search_fields = ('ruta', 'vista')
+    date_hierarchy = 'creado'
+    readonly_fields = (
+        'creado', 'metodo', 'ruta', 'vista', 'estado_http', 'duracion_ms', 'motivo', 'usuario',
+        'total_llamadas', 'tabla_funciones', 'tabla_acumuladas',
+    )
+    exclude = ('funciones', 'acumuladas')
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description='Funciones con más tiempo propio')
+    def tabla_funciones(self, obj):
+        return _tabla(obj.funciones)
+
+    @admin.display(description='Funciones con más tiempo acumulado')
+    def tabla_acumuladas(self, obj):
+        return _tabla(obj.acumuladas)
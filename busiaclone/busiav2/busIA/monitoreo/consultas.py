@@ -0,0 +1,78 @@
+"""
+Conteo de consultas SQL por solicitud y detección de patrones N+1
+"""
+
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+CONFIGURACION_POR_DEFECTO = {
+    'ACTIVO': False,
+    # Consultas máximas por vista (nombre de la URL con su namespace)
+    'PRESUPUESTOS': {},
+    # Veces que debe repetirse una misma forma de SQL para considerarla N+1
+    'UMBRAL_REPETICIONES': 5,
+    # Si es True, exceder un presupuesto o detectar N+1 lanza una excepción
+    'ESTRICTO': False,
+}
+
+# Literales y listas de parámetros que no cambian la forma de una consulta
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTAS = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_ESPACIOS = re.compile(r'\s+')
+
+
+class PresupuestoConsultasExcedido(AssertionError):
+    """La vista hizo más consultas que su presupuesto o repitió una consulta en un bucle"""
+
+
+def configuracion() -> Dict:
+    return {**CONFIGURACION_POR_DEFECTO, **getattr(settings, 'MONITOREO_CONSULTAS', {})}
+
+
+def forma(sql: str) -> str:
+    """Normaliza el SQL para agrupar consultas que solo difieren en sus valores"""
+    sql = _LITERALES.sub('?', sql)
+    sql = _LISTAS.sub('(...)', sql)
+    return _ESPACIOS.sub(' ', sql).strip()
+
+
+class ContadorConsultas:
+    """
+    Cuenta las consultas y el tiempo de base de datos de todas las conexiones
+    mientras está activo; se usa como administrador de contexto
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.segundos = 0.0
+        self.formas = Counter()
+        self._pila = None
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.segundos += time.perf_counter() - inicio
+            self.total += 1
+            self.formas[forma(sql)] += 1
+
+    def __enter__(self):
+        self._pila = ExitStack()
+        for conexion in connections.all():
+            self._pila.enter_context(conexion.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc):
+        self._pila.close()
+        return False
+
+    def repetidas(self, umbral: int) -> List[Tuple[str, int]]:
+        """Formas de SQL ejecutadas al menos umbral veces, de la más repetida a la menos"""
+        return [(sql, veces) for sql, veces in self.formas.most_common() if veces >= umbral]
@@ -0,0 +1,18 @@
+"""
+Comando para generar el token de la cabecera X-Perfilar
+"""
+
+from django.core.management.base import BaseCommand
+
+from monitoreo import perfilado
+
+
+class Command(BaseCommand):
+    help = 'Genera un token firmado para perfilar solicitudes con la cabecera X-Perfilar'
+
+    def handle(self, *args, **options):
+        vigencia = perfilado.configuracion()['VIGENCIA_FIRMA']
+        self.stdout.write(perfilado.firmar())
+        self.stderr.write(self.style.SUCCESS(
+            f'Válido por {vigencia} segundos; envíelo como "{perfilado.CABECERA}: <token>"'
+        ))
@@ -0,0 +1,52 @@
+"""
+Comando para volcar las métricas de monitoreo
+"""
+
+import json
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Vuelca las métricas de un servidor en ejecución. El registro vive en el '
+            'proceso del servidor, así que siempre se leen desde su endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default=None,
+            help='URL del endpoint de métricas (por defecto MONITOREO_METRICAS_URL)',
+        )
+        parser.add_argument(
+            '--token',
+            default=None,
+            help='Token Bearer del endpoint (por defecto MONITOREO_METRICAS_TOKEN)',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Pide las métricas como JSON en lugar del formato de Prometheus',
+        )
+
+    def handle(self, *args, **options):
+        url = options['url'] or getattr(settings, 'MONITOREO_METRICAS_URL', None)
+        if not url:
+            raise CommandError('Indique --url o configure MONITOREO_METRICAS_URL')
+        token = options['token'] or getattr(settings, 'MONITOREO_METRICAS_TOKEN', None)
+        try:
+            respuesta = requests.get(
+                url,
+                params={'formato': 'json'} if options['json'] else None,
+                headers={'Authorization': f'Bearer {token}'} if token else {},
+                timeout=10,
+            )
+            respuesta.raise_for_status()
+        except requests.RequestException as e:
+            raise CommandError(f'No se pudieron leer las métricas de {url}: {e}')
+
+        if options['json']:
+            self.stdout.write(json.dumps(respuesta.json(), indent=2))
+        else:
+            self.stdout.write(respuesta.text, ending='')
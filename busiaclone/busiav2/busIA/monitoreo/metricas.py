@@ -0,0 +1,238 @@
+"""
+Registro de métricas en memoria (contadores e histogramas de buckets fijos)
+con exportación en el formato de texto de Prometheus.
+
+El registro es propio de cada proceso: con varios workers, Prometheus debe
+consultar cada uno (o sumar las series por instancia).
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Iterable, Tuple
+
+# Segundos; cubren desde una consulta a la cache hasta un envío SMTP lento
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _etiquetas_texto(nombres: Tuple[str, ...], valores: Tuple[str, ...], extra: str = '') -> str:
+    pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor: float) -> str:
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class Metrica:
+    tipo = ''
+
+    def __init__(self, nombre: str, descripcion: str, etiquetas: Iterable[str] = ()):
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.etiquetas = tuple(etiquetas)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _clave(self, etiquetas: Dict[str, str]) -> Tuple[str, ...]:
+        if len(etiquetas) != len(self.etiquetas):
+            raise ValueError(f'{self.nombre} espera las etiquetas {self.etiquetas}, recibió {tuple(etiquetas)}')
+        return tuple(str(etiquetas[nombre]) for nombre in self.etiquetas)
+
+    def reiniciar(self):
+        with self._lock:
+            self._series.clear()
+
+    def encabezado(self):
+        return [f'# HELP {self.nombre} {_escapar(self.descripcion)}', f'# TYPE {self.nombre} {self.tipo}']
+
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor: float = 1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._series[clave] = self._series.get(clave, 0) + valor
+
+    def valor(self, **etiquetas) -> float:
+        return self._series.get(self._clave(etiquetas), 0)
+
+    def prometheus(self):
+        lineas = self.encabezado()
+        with self._lock:
+            series = sorted(self._series.items())
+        for clave, valor in series:
+            lineas.append(f'{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {_numero(valor)}')
+        return lineas
+
+    def instantanea(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        return [{'etiquetas': dict(zip(self.etiquetas, clave)), 'valor': valor} for clave, valor in series]
+
+
+class Histograma(Metrica):
+    """
+    Histograma de buckets fijos: cada observación solo incrementa un bucket,
+    la suma y el total, así que registrar es O(log buckets) y sin memoria extra
+    """
+    tipo = 'histogram'
+
+    def __init__(self, nombre: str, descripcion: str, etiquetas: Iterable[str] = (),
+                 buckets: Iterable[float] = BUCKETS_LATENCIA):
+        super().__init__(nombre, descripcion, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+
+    def observar(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        indice = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                # Conteos por bucket (el último es +Inf), suma y total
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """Observa la duración del bloque; agrega resultado='error' si lanza una excepción"""
+        inicio = time.perf_counter()
+        resultado = 'ok'
+        try:
+            yield
+        except BaseException:
+            resultado = 'error'
+            raise
+        finally:
+            if 'resultado' in self.etiquetas:
+                etiquetas.setdefault('resultado', resultado)
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def _copia(self):
+        with self._lock:
+            return sorted((clave, (list(conteos), suma, total)) for clave, (conteos, suma, total) in self._series.items())
+
+    def prometheus(self):
+        lineas = self.encabezado()
+        for clave, (conteos, suma, total) in self._copia():
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float('inf'),), conteos):
+                acumulado += conteo
+                etiquetas = _etiquetas_texto(self.etiquetas, clave, f'le="{_numero(limite)}"')
+                lineas.append(f'{self.nombre}_bucket{etiquetas} {acumulado}')
+            etiquetas = _etiquetas_texto(self.etiquetas, clave)
+            lineas.append(f'{self.nombre}_sum{etiquetas} {_numero(suma)}')
+            lineas.append(f'{self.nombre}_count{etiquetas} {total}')
+        return lineas
+
+    def instantanea(self):
+        series = []
+        for clave, (conteos, suma, total) in self._copia():
+            acumulado, buckets = 0, {}
+            for limite, conteo in zip(self.buckets + (float('inf'),), conteos):
+                acumulado += conteo
+                buckets[_numero(limite)] = acumulado
+            series.append({
+                'etiquetas': dict(zip(self.etiquetas, clave)),
+                'buckets': buckets,
+                'suma': round(suma, 6),
+                'total': total,
+            })
+        return series
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, clase, nombre, *args, **kwargs):
+        with self._lock:
+            metrica = self._metricas.get(nombre)
+            if metrica is None:
+                metrica = self._metricas[nombre] = clase(nombre, *args, **kwargs)
+            elif not isinstance(metrica, clase):
+                raise ValueError(f'La métrica {nombre} ya está registrada como {metrica.tipo}')
+            return metrica
+
+    def contador(self, nombre: str, descripcion: str, etiquetas: Iterable[str] = ()) -> Contador:
+        return self._registrar(Contador, nombre, descripcion, etiquetas)
+
+    def histograma(self, nombre: str, descripcion: str, etiquetas: Iterable[str] = (),
+                   buckets: Iterable[float] = BUCKETS_LATENCIA) -> Histograma:
+        return self._registrar(Histograma, nombre, descripcion, etiquetas, buckets=buckets)
+
+    def prometheus(self) -> str:
+        """Todas las métricas en el formato de exposición de texto de Prometheus"""
+        lineas = []
+        for nombre in sorted(self._metricas):
+            lineas.extend(self._metricas[nombre].prometheus())
+        return '\n'.join(lineas) + '\n'
+
+    def instantanea(self) -> Dict:
+        return {
+            nombre: {'tipo': metrica.tipo, 'descripcion': metrica.descripcion, 'series': metrica.instantanea()}
+            for nombre, metrica in sorted(self._metricas.items())
+        }
+
+    def reiniciar(self):
+        """Vacía las series (las métricas siguen registradas); pensado para pruebas"""
+        for metrica in list(self._metricas.values()):
+            metrica.reiniciar()
+
+
+REGISTRO = Registro()
+
+OPERACIONES = REGISTRO.histograma(
+    'busia_operacion_duracion_segundos',
+    'Duración de las operaciones críticas (búsqueda, mapa de asientos, reserva, pago, email, login)',
+    etiquetas=('operacion', 'resultado'),
+)
+LOGINS = REGISTRO.contador('busia_login_total', 'Intentos de inicio de sesión por resultado', etiquetas=('resultado',))
+
+
+def _resultado_respuesta(response) -> str:
+    codigo = getattr(response, 'status_code', 200)
+    if codigo >= 500:
+        return 'error'
+    if codigo >= 400:
+        return 'rechazada'
+    return 'ok'
+
+
+def instrumentar(operacion: str):
+    """
+    Decorador de vistas: registra la duración en busia_operacion_duracion_segundos
+    con resultado ok (< 400), rechazada (4xx) o error (5xx o excepción)
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            inicio = time.perf_counter()
+            resultado = 'error'
+            try:
+                response = vista(request, *args, **kwargs)
+                resultado = _resultado_respuesta(response)
+                return response
+            finally:
+                OPERACIONES.observar(time.perf_counter() - inicio, operacion=operacion, resultado=resultado)
+        return envoltura
+    return decorador
+
+
+def medir(operacion: str):
+    """Administrador de contexto para medir un bloque como operación (p. ej. un envío de email)"""
+    return OPERACIONES.medir(operacion=operacion)
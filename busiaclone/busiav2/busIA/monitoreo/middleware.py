@@ -0,0 +1,103 @@
+"""
+Middleware de monitoreo: consultas SQL y perfilado de solicitudes
+"""
+
+import logging
+import time
+
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import perfilado
+from .consultas import ContadorConsultas, PresupuestoConsultasExcedido, configuracion
+
+logger = logging.getLogger('monitoreo.consultas')
+
+
+class PresupuestoConsultasMiddleware:
+    """
+    Cuenta las consultas y el tiempo de base de datos de cada solicitud y
+    agrupa las sentencias por forma para detectar patrones N+1. Agrega los
+    encabezados X-Consultas-SQL y Server-Timing, registra un resumen por vista
+    y, en modo estricto, falla si la vista excede su presupuesto.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = configuracion()
+        if not self.config['ACTIVO']:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        with ContadorConsultas() as contador:
+            response = self.get_response(request)
+
+        vista = request.resolver_match.view_name if request.resolver_match else request.path
+        response['X-Consultas-SQL'] = str(contador.total)
+        response['Server-Timing'] = f'db;dur={contador.segundos * 1000:.1f};desc="{contador.total} consultas"'
+
+        problemas = []
+        presupuesto = self.config['PRESUPUESTOS'].get(vista)
+        if presupuesto is not None and contador.total > presupuesto:
+            problemas.append(f'{contador.total} consultas superan el presupuesto de {presupuesto}')
+        for sql, veces in contador.repetidas(self.config['UMBRAL_REPETICIONES']):
+            problemas.append(f'posible N+1, {veces} veces: {sql[:300]}')
+
+        resumen = f'{request.method} {vista}: {contador.total} consultas en {contador.segundos * 1000:.1f} ms'
+        if not problemas:
+            logger.info(resumen)
+            return response
+
+        detalle = resumen + ''.join(f'\n  - {problema}' for problema in problemas)
+        logger.warning(detalle)
+        if self.config['ESTRICTO']:
+            raise PresupuestoConsultasExcedido(detalle)
+        return response
+
+
+class PerfiladoMiddleware:
+    """
+    Perfila con cProfile las vistas de las aplicaciones configuradas cuando la
+    solicitud trae un token firmado en X-Perfilar, un usuario staff agrega
+    ?_perfilar o cae en la tasa de muestreo. Guarda las funciones más costosas
+    en PerfilSolicitud y devuelve su id en el encabezado X-Perfil.
+
+    Va antes del middleware de consultas para que guardar el perfil no cuente
+    en el presupuesto de la vista.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = perfilado.configuracion()
+        if not self.config['ACTIVO']:
+            raise MiddlewareNotUsed
+        self.apps = set(self.config['APPS'])
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.resolver_match.app_name not in self.apps:
+            return None
+        razon = perfilado.motivo(request, self.config)
+        if razon is None:
+            return None
+        perfilador = perfilado.Perfilador()
+        if perfilador.iniciar():
+            request._perfilado = (perfilador, razon, time.perf_counter())
+        return None
+
+    def __call__(self, request):
+        request._perfilado = None
+        try:
+            response = self.get_response(request)
+        finally:
+            if request._perfilado:
+                request._perfilado[0].detener()
+        if not request._perfilado:
+            return response
+
+        perfilador, razon, inicio = request._perfilado
+        try:
+            perfil = perfilado.guardar(request, response, perfilador, razon, time.perf_counter() - inicio, self.config)
+        except Exception:
+            perfilado.logger.exception('No se pudo guardar el perfil de %s', request.path)
+        else:
+            response['X-Perfil'] = str(perfil.id)
+        return response
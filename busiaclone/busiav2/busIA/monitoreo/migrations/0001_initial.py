@@ -0,0 +1,39 @@
+# Generated by Django 5.0 on 2026-10-18 15:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerfilSolicitud',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('metodo', models.CharField(max_length=10)),
+                ('ruta', models.CharField(max_length=500)),
+                ('vista', models.CharField(db_index=True, max_length=200)),
+                ('estado_http', models.PositiveSmallIntegerField()),
+                ('duracion_ms', models.FloatField()),
+                ('motivo', models.CharField(choices=[('cabecera', 'Cabecera firmada'), ('staff', 'Parámetro de staff'), ('muestreo', 'Muestreo')], max_length=10)),
+                ('total_llamadas', models.PositiveIntegerField(default=0)),
+                ('funciones', models.JSONField(default=list)),
+                ('acumuladas', models.JSONField(default=list)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Perfil de solicitud',
+                'verbose_name_plural': 'Perfiles de solicitudes',
+                'ordering': ['-creado'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import models
+
+
+class PerfilSolicitud(models.Model):
+    """
+    Perfil de cProfile de una solicitud: las funciones con más tiempo propio
+    y con más tiempo acumulado, ya resumidas (no se guarda el volcado completo)
+    """
+    MOTIVOS = [
+        ('cabecera', 'Cabecera firmada'),
+        ('staff', 'Parámetro de staff'),
+        ('muestreo', 'Muestreo'),
+    ]
+
+    creado = models.DateTimeField(auto_now_add=True)
+    metodo = models.CharField(max_length=10)
+    ruta = models.CharField(max_length=500)
+    vista = models.CharField(max_length=200, db_index=True)
+    estado_http = models.PositiveSmallIntegerField()
+    duracion_ms = models.FloatField()
+    motivo = models.CharField(max_length=10, choices=MOTIVOS)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    total_llamadas = models.PositiveIntegerField(default=0)
+    # [{funcion, llamadas, propio_ms, acumulado_ms}] ordenadas por tiempo propio
+    funciones = models.JSONField(default=list)
+    # Las mismas columnas ordenadas por tiempo acumulado
+    acumuladas = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"{self.metodo} {self.vista} ({self.duracion_ms:.0f} ms, {self.creado:%Y-%m-%d %H:%M})"
+
+    class Meta:
+        verbose_name = 'Perfil de solicitud'
+        verbose_name_plural = 'Perfiles de solicitudes'
+        ordering = ['-creado']
@@ -0,0 +1,130 @@
+"""
+Perfilado de solicitudes reales bajo demanda con cProfile
+"""
+
+import cProfile
+import logging
+import pstats
+import random
+import threading
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger('monitoreo.perfilado')
+
+CONFIGURACION_POR_DEFECTO = {
+    'ACTIVO': False,
+    # Fracción de las solicitudes elegibles que se perfilan sin pedirlo (0 a 1)
+    'TASA_MUESTREO': 0.0,
+    # Solo se perfilan vistas de estas aplicaciones (namespace de la URL)
+    'APPS': ['pasajes', 'usuarios'],
+    'TOP_N': 30,
+    # Perfiles conservados; los más antiguos se eliminan
+    'MAX_PERFILES': 500,
+    # Segundos de validez de un token firmado para la cabecera X-Perfilar
+    'VIGENCIA_FIRMA': 3600,
+    # Parámetro de la query string que activa el perfilado para usuarios staff
+    'PARAMETRO': '_perfilar',
+}
+
+CABECERA = 'X-Perfilar'
+_SAL = 'monitoreo.perfilado'
+
+# cProfile no admite dos perfiladores activos a la vez en todas las versiones
+# de Python: si otra solicitud se está perfilando, esta se atiende sin perfil
+_en_uso = threading.Lock()
+
+
+def configuracion() -> Dict:
+    return {**CONFIGURACION_POR_DEFECTO, **getattr(settings, 'MONITOREO_PERFILADO', {})}
+
+
+def firmar() -> str:
+    """Token para la cabecera X-Perfilar; vence según VIGENCIA_FIRMA"""
+    return signing.TimestampSigner(salt=_SAL).sign('perfilar')
+
+
+def firma_valida(token: str, vigencia: int) -> bool:
+    try:
+        return signing.TimestampSigner(salt=_SAL).unsign(token, max_age=vigencia) == 'perfilar'
+    except signing.BadSignature:
+        return False
+
+
+def motivo(request, config: Dict) -> Optional[str]:
+    """Por qué se debe perfilar la solicitud, o None si no corresponde"""
+    token = request.headers.get(CABECERA)
+    if token and firma_valida(token, config['VIGENCIA_FIRMA']):
+        return 'cabecera'
+    if config['PARAMETRO'] in request.GET and request.user.is_authenticated and request.user.is_staff:
+        return 'staff'
+    if config['TASA_MUESTREO'] and random.random() < config['TASA_MUESTREO']:
+        return 'muestreo'
+    return None
+
+
+class Perfilador:
+    """Envuelve cProfile; iniciar() devuelve False si otro perfil está en curso"""
+
+    def __init__(self):
+        self.perfil = cProfile.Profile()
+        self._activo = False
+
+    def iniciar(self) -> bool:
+        if not _en_uso.acquire(blocking=False):
+            return False
+        try:
+            self.perfil.enable()
+        except ValueError:
+            _en_uso.release()
+            return False
+        self._activo = True
+        return True
+
+    def detener(self):
+        if self._activo:
+            self.perfil.disable()
+            self._activo = False
+            _en_uso.release()
+
+    def resumen(self, top_n: int) -> Dict:
+        estadisticas = pstats.Stats(self.perfil).stats
+        filas = [
+            {
+                'funcion': pstats.func_std_string(funcion),
+                'llamadas': llamadas,
+                'propio_ms': round(propio * 1000, 3),
+                'acumulado_ms': round(acumulado * 1000, 3),
+            }
+            for funcion, (_, llamadas, propio, acumulado, _) in estadisticas.items()
+        ]
+        return {
+            'total_llamadas': sum(fila['llamadas'] for fila in filas),
+            'funciones': _top(filas, 'propio_ms', top_n),
+            'acumuladas': _top(filas, 'acumulado_ms', top_n),
+        }
+
+
+def _top(filas: List[Dict], clave: str, top_n: int) -> List[Dict]:
+    return sorted(filas, key=lambda fila: -fila[clave])[:top_n]
+
+
+def guardar(request, response, perfilador: Perfilador, razon: str, segundos: float, config: Dict):
+    from .models import PerfilSolicitud
+
+    usuario = getattr(request, 'user', None)
+    perfil = PerfilSolicitud.objects.create(
+        metodo=request.method,
+        ruta=request.get_full_path()[:500],
+        vista=request.resolver_match.view_name,
+        estado_http=response.status_code,
+        duracion_ms=round(segundos * 1000, 3),
+        motivo=razon,
+        usuario=usuario if usuario is not None and usuario.is_authenticated else None,
+        **perfilador.resumen(config['TOP_N']),
+    )
+    # Poda por id: una sola consulta y sin contar filas
+    PerfilSolicitud.objects.filter(id__lte=perfil.id - config['MAX_PERFILES']).delete()
+    return perfil
@@ -0,0 +1,296 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import JsonResponse
+from django.test import TestCase, override_settings
+from django.urls import path, reverse
+from django.utils.html import escape
+
+from usuarios.models import Usuario
+from .consultas import ContadorConsultas, PresupuestoConsultasExcedido, forma
+from .metricas import LOGINS, OPERACIONES, REGISTRO, Registro
+from .models import PerfilSolicitud
+from .perfilado import CABECERA, firmar
+
+
+def vista_n_mas_uno(request):
+    ids = list(Usuario.objects.values_list('id', flat=True))
+    # Una consulta por usuario: el patrón que el middleware debe detectar
+    nombres = [Usuario.objects.get(id=usuario_id).nombre for usuario_id in ids]
+    return JsonResponse({'nombres': nombres})
+
+
+def vista_una_consulta(request):
+    return JsonResponse({'nombres': list(Usuario.objects.values_list('nombre', flat=True))})
+
+
+urlpatterns = [
+    path('n-mas-uno/', vista_n_mas_uno, name='n_mas_uno'),
+    path('una-consulta/', vista_una_consulta, name='una_consulta'),
+]
+
+
+def monitoreo(**config):
+    return {'ACTIVO': True, 'ESTRICTO': False, 'UMBRAL_REPETICIONES': 5, 'PRESUPUESTOS': {}, **config}
+
+
+@override_settings(ROOT_URLCONF='monitoreo.tests', MONITOREO_CONSULTAS=monitoreo())
+class PresupuestoConsultasMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(6):
+            Usuario.objects.create_user(email=f'usuario{i}@busia.test', password='clave-segura-123', nombre=f'Usuario {i}')
+
+    def test_informa_consultas_en_encabezados(self):
+        response = self.client.get('/una-consulta/')
+        self.assertEqual(response['X-Consultas-SQL'], '1')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="1 consultas"$')
+
+    def test_detecta_n_mas_uno_en_el_registro(self):
+        with self.assertLogs('monitoreo.consultas', 'WARNING') as registro:
+            response = self.client.get('/n-mas-uno/')
+        self.assertEqual(response['X-Consultas-SQL'], '7')
+        self.assertIn('n_mas_uno', registro.output[0])
+        self.assertIn('posible N+1, 6 veces', registro.output[0])
+
+    def test_vista_sin_problemas_registra_resumen_informativo(self):
+        with self.assertLogs('monitoreo.consultas', 'INFO') as registro:
+            self.client.get('/una-consulta/')
+        self.assertEqual(registro.records[0].levelname, 'INFO')
+        self.assertIn('GET una_consulta: 1 consultas', registro.output[0])
+
+    @override_settings(MONITOREO_CONSULTAS=monitoreo(ESTRICTO=True, PRESUPUESTOS={'una_consulta': 0}))
+    def test_modo_estricto_falla_al_exceder_el_presupuesto(self):
+        with self.assertLogs('monitoreo.consultas', 'WARNING'):
+            with self.assertRaisesMessage(PresupuestoConsultasExcedido, 'superan el presupuesto de 0'):
+                self.client.get('/una-consulta/')
+
+    @override_settings(MONITOREO_CONSULTAS=monitoreo(ESTRICTO=True, UMBRAL_REPETICIONES=10))
+    def test_modo_estricto_respeta_el_umbral_de_repeticiones(self):
+        response = self.client.get('/n-mas-uno/')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(MONITOREO_CONSULTAS=monitoreo(ACTIVO=False))
+    def test_inactivo_no_agrega_encabezados(self):
+        response = self.client.get('/una-consulta/')
+        self.assertNotIn('X-Consultas-SQL', response)
+
+
+class FormaConsultaTests(TestCase):
+    def test_agrupa_consultas_que_solo_difieren_en_valores(self):
+        self.assertEqual(
+            forma("SELECT * FROM t WHERE id = 15 AND nombre = 'Ana''s'"),
+            forma("SELECT  *\nFROM t WHERE id = 7 AND nombre = 'Luis'"),
+        )
+        self.assertEqual(
+            forma('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            forma('SELECT * FROM t WHERE id IN (%s, %s)'),
+        )
+
+    def test_contador_agrupa_por_forma(self):
+        with ContadorConsultas() as contador:
+            for i in range(3):
+                Usuario.objects.filter(id=i).exists()
+        self.assertEqual(contador.total, 3)
+        self.assertEqual(len(contador.repetidas(3)), 1)
+        self.assertEqual(contador.repetidas(4), [])
+
+
+class RegistroMetricasTests(TestCase):
+    def setUp(self):
+        self.registro = Registro()
+
+    def test_histograma_acumula_buckets_fijos(self):
+        histograma = self.registro.histograma('latencia', 'Latencia', etiquetas=('ruta',), buckets=(0.1, 1))
+        for valor in (0.05, 0.1, 0.5, 3):
+            histograma.observar(valor, ruta='/a')
+
+        texto = self.registro.prometheus()
+
+        self.assertIn('# TYPE latencia histogram', texto)
+        self.assertIn('latencia_bucket{ruta="/a",le="0.1"} 2', texto)
+        self.assertIn('latencia_bucket{ruta="/a",le="1"} 3', texto)
+        self.assertIn('latencia_bucket{ruta="/a",le="+Inf"} 4', texto)
+        self.assertIn('latencia_sum{ruta="/a"} 3.65', texto)
+        self.assertIn('latencia_count{ruta="/a"} 4', texto)
+
+    def test_contador_y_etiquetas_obligatorias(self):
+        contador = self.registro.contador('eventos_total', 'Eventos', etiquetas=('tipo',))
+        contador.inc(tipo='a')
+        contador.inc(2, tipo='a')
+        self.assertEqual(contador.valor(tipo='a'), 3)
+        self.assertIn('eventos_total{tipo="a"} 3', self.registro.prometheus())
+        with self.assertRaises(ValueError):
+            contador.inc()
+
+    def test_medir_registra_errores(self):
+        histograma = self.registro.histograma('tareas', 'Tareas', etiquetas=('resultado',))
+        with self.assertRaises(RuntimeError):
+            with histograma.medir():
+                raise RuntimeError
+        series = self.registro.instantanea()['tareas']['series']
+        self.assertEqual(series[0]['etiquetas'], {'resultado': 'error'})
+        self.assertEqual(series[0]['total'], 1)
+
+
+class MetricasEndpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Usuario.objects.create_user(
+            email='staff@busia.test', nombre='Staff', password='clave-segura-123', is_staff=True
+        )
+        cls.usuario = Usuario.objects.create_user(
+            email='pasajero@busia.test', nombre='Pasajero', password='clave-segura-123'
+        )
+
+    def setUp(self):
+        REGISTRO.reiniciar()
+
+    def test_requiere_staff_o_token(self):
+        url = reverse('monitoreo:metricas')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        with override_settings(MONITOREO_METRICAS_TOKEN='secreto'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer otro').status_code, 403)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secreto').status_code, 200)
+        self.client.force_login(self.staff)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+    def test_instrumenta_login_y_vistas_de_pasajes(self):
+        self.client.post(reverse('usuarios:login'), {'email': 'pasajero@busia.test', 'password': 'incorrecta'})
+        self.client.post(reverse('usuarios:login'), {'email': 'pasajero@busia.test', 'password': 'clave-segura-123'})
+        self.client.get(reverse('pasajes:buscar_viajes'))
+
+        self.assertEqual(LOGINS.valor(resultado='credenciales_invalidas'), 1)
+        self.assertEqual(LOGINS.valor(resultado='exito'), 1)
+        series = {
+            (serie['etiquetas']['operacion'], serie['etiquetas']['resultado']): serie['total']
+            for serie in OPERACIONES.instantanea()
+        }
+        self.assertEqual(series[('login', 'ok')], 2)
+        # Sin parámetros de búsqueda la vista responde 400
+        self.assertEqual(series[('busqueda_viajes', 'rechazada')], 1)
+
+        self.client.force_login(self.staff)
+        texto = self.client.get(reverse('monitoreo:metricas')).content.decode()
+        self.assertIn('busia_login_total{resultado="exito"} 1', texto)
+
+    def test_formato_json(self):
+        OPERACIONES.observar(0.2, operacion='reserva', resultado='ok')
+        self.client.force_login(self.staff)
+        datos = self.client.get(reverse('monitoreo:metricas'), {'formato': 'json'}).json()
+        serie = datos['busia_operacion_duracion_segundos']['series'][0]
+        self.assertEqual(serie['buckets']['0.25'], 1)
+        self.assertEqual(serie['buckets']['0.1'], 0)
+
+
+class ServidorMetricasFalso(BaseHTTPRequestHandler):
+    """Responde como el endpoint de métricas y guarda las solicitudes recibidas"""
+    solicitudes = []
+
+    def do_GET(self):
+        self.solicitudes.append((self.path, self.headers.get('Authorization')))
+        json_pedido = 'formato=json' in self.path
+        cuerpo = b'{"busia_login_total": {}}' if json_pedido else b'busia_login_total{resultado="exito"} 3\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json' if json_pedido else 'text/plain')
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class VolcarMetricasTests(TestCase):
+    def setUp(self):
+        ServidorMetricasFalso.solicitudes = []
+        servidor = ThreadingHTTPServer(('127.0.0.1', 0), ServidorMetricasFalso)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+        self.url = f'http://127.0.0.1:{servidor.server_port}/monitoreo/metricas/'
+
+    def test_lee_por_defecto_el_endpoint_del_servidor(self):
+        salida = StringIO()
+        with override_settings(MONITOREO_METRICAS_URL=self.url, MONITOREO_METRICAS_TOKEN='secreto'):
+            call_command('volcar_metricas', stdout=salida)
+        self.assertIn('busia_login_total{resultado="exito"} 3', salida.getvalue())
+        self.assertEqual(ServidorMetricasFalso.solicitudes, [('/monitoreo/metricas/', 'Bearer secreto')])
+
+    def test_json_desde_el_servidor(self):
+        salida = StringIO()
+        call_command('volcar_metricas', '--url', self.url, '--json', stdout=salida)
+        self.assertEqual(json.loads(salida.getvalue()), {'busia_login_total': {}})
+        self.assertEqual(ServidorMetricasFalso.solicitudes[0][0], '/monitoreo/metricas/?formato=json')
+
+    def test_falla_sin_url_o_sin_servidor(self):
+        with override_settings(MONITOREO_METRICAS_URL=None):
+            with self.assertRaises(CommandError):
+                call_command('volcar_metricas', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('volcar_metricas', '--url', 'http://127.0.0.1:9/', stdout=StringIO())
+
+
+def perfilado(**config):
+    return {'ACTIVO': True, 'TASA_MUESTREO': 0.0, 'APPS': ['pasajes', 'usuarios'], 'TOP_N': 5, **config}
+
+
+@override_settings(MONITOREO_PERFILADO=perfilado())
+class PerfiladoMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Usuario.objects.create_user(
+            email='staff@busia.test', nombre='Staff', password='clave-segura-123', is_staff=True, is_superuser=True
+        )
+        cls.usuario = Usuario.objects.create_user(
+            email='pasajero@busia.test', nombre='Pasajero', password='clave-segura-123'
+        )
+
+    def buscar_ciudades(self, **extra):
+        return self.client.get(reverse('pasajes:buscar_ciudades'), {'q': 'san'}, **extra)
+
+    def test_cabecera_firmada_guarda_las_funciones_mas_costosas(self):
+        response = self.buscar_ciudades(headers={CABECERA: firmar()})
+
+        perfil = PerfilSolicitud.objects.get()
+        self.assertEqual(response['X-Perfil'], str(perfil.id))
+        self.assertEqual((perfil.vista, perfil.motivo, perfil.estado_http), ('pasajes:buscar_ciudades', 'cabecera', 200))
+        self.assertEqual(len(perfil.funciones), 5)
+        self.assertGreater(perfil.total_llamadas, 0)
+        propios = [fila['propio_ms'] for fila in perfil.funciones]
+        self.assertEqual(propios, sorted(propios, reverse=True))
+        self.assertTrue(any('buscar_ciudades' in fila['funcion'] for fila in perfil.acumuladas))
+
+    def test_ignora_firmas_invalidas_y_otras_aplicaciones(self):
+        self.buscar_ciudades(headers={CABECERA: 'perfilar:falso'})
+        self.client.get(reverse('monitoreo:metricas'), headers={CABECERA: firmar()})
+        self.assertFalse(PerfilSolicitud.objects.exists())
+
+    def test_parametro_solo_para_staff(self):
+        self.client.force_login(self.usuario)
+        response = self.client.get(reverse('pasajes:comprar'), {'_perfilar': '1'})
+        self.assertNotIn('X-Perfil', response)
+
+        self.client.force_login(self.staff)
+        self.client.get(reverse('pasajes:comprar'), {'_perfilar': '1'})
+        perfil = PerfilSolicitud.objects.get()
+        self.assertEqual((perfil.motivo, perfil.usuario), ('staff', self.staff))
+
+    @override_settings(MONITOREO_PERFILADO=perfilado(TASA_MUESTREO=1.0, MAX_PERFILES=2))
+    def test_muestreo_conserva_solo_los_ultimos_perfiles(self):
+        for _ in range(3):
+            self.buscar_ciudades()
+        self.assertEqual(PerfilSolicitud.objects.count(), 2)
+        self.assertEqual(set(PerfilSolicitud.objects.values_list('motivo', flat=True)), {'muestreo'})
+
+    def test_admin_muestra_el_perfil(self):
+        self.buscar_ciudades(headers={CABECERA: firmar()})
+        perfil = PerfilSolicitud.objects.get()
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('admin:monitoreo_perfilsolicitud_change', args=[perfil.id]))
+        self.assertContains(response, escape(perfil.funciones[0]['funcion']))
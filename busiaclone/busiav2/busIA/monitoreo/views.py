@@ -0,0 +1,33 @@
+"""
+Vistas de monitoreo
+"""
+
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+
+from .metricas import REGISTRO
+
+
+def _autorizado(request) -> bool:
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = getattr(settings, 'MONITOREO_METRICAS_TOKEN', None)
+    encabezado = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(encabezado, f'Bearer {token}')
+
+
+@require_GET
+def metricas(request):
+    """
+    Métricas del proceso en el formato de texto de Prometheus (o como JSON
+    con ?formato=json). Accesible para staff o con el encabezado
+    Authorization: Bearer <MONITOREO_METRICAS_TOKEN>.
+    """
+    if not _autorizado(request):
+        return HttpResponse('No autorizado', status=403, content_type='text/plain')
+    if request.GET.get('formato') == 'json':
+        return JsonResponse(REGISTRO.instantanea())
+    return HttpResponse(REGISTRO.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Pais, Region, Ciudad, Linea, Bus, Asiento, Reserva
+from .models import (
+    Pais, Region, Ciudad, Linea, Bus, Asiento, Reserva, DisponibilidadViaje,
+    SincronizacionUbicaciones, PuntoControlPais, Horario,
+)
 
 # Register your models here.
 
@@ -16,8 +19,8 @@ class RegionAdmin(admin.ModelAdmin):
 
 @admin.register(Ciudad)
 class CiudadAdmin(admin.ModelAdmin):
-    list_display = ('nombre', 'region', 'latitud', 'longitud')
-    list_filter = ('region__pais', 'region')
+    list_display = ('nombre', 'region', 'poblacion', 'latitud', 'longitud', 'activa')
+    list_filter = ('activa', 'region__pais', 'region')
     search_fields = ('nombre', 'region__nombre', 'region__pais__nombre')
 
 @admin.register(Linea)
@@ -44,3 +47,26 @@ class ReservaAdmin(admin.ModelAdmin):
     list_filter = ('estado', 'fecha_viaje', 'asiento__bus__linea')
     search_fields = ('usuario__username', 'asiento__bus__numero', 'asiento__bus__linea__nombre')
     date_hierarchy = 'fecha_viaje'
+
+@admin.register(DisponibilidadViaje)
+class DisponibilidadViajeAdmin(admin.ModelAdmin):
+    list_display = ('viaje', 'asientos_libres', 'total_asientos', 'actualizado')
+    readonly_fields = ('viaje', 'total_asientos', 'asientos_libres', 'mapa_ocupacion', 'actualizado')
+
+@admin.register(SincronizacionUbicaciones)
+class SincronizacionUbicacionesAdmin(admin.ModelAdmin):
+    list_display = ('id', 'iniciada', 'finalizada')
+    readonly_fields = ('iniciada', 'finalizada', 'tiempos', 'resumen')
+
+@admin.register(PuntoControlPais)
+class PuntoControlPaisAdmin(admin.ModelAdmin):
+    list_display = ('pais', 'ciudades', 'hash_contenido', 'sincronizacion', 'actualizado')
+    search_fields = ('pais__nombre', 'pais__codigo')
+
+@admin.register(Horario)
+class HorarioAdmin(admin.ModelAdmin):
+    list_display = ('bus', 'dias_semana', 'hora_salida', 'vigente_desde', 'vigente_hasta', 'generado_hasta', 'activo')
+    list_filter = ('activo', 'bus__linea')
+    search_fields = ('bus__linea__nombre', 'bus__numero')
+    list_select_related = ('bus__linea',)
+    readonly_fields = ('generado_hasta',)
@@ -0,0 +1,137 @@
+"""
+Generación masiva de asientos a partir de plantillas de distribución
+"""
+
+import math
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, QuerySet
+
+from . import disponibilidad
+from .models import Asiento, Bus, Reserva, Viaje
+
+TAMANO_LOTE = 500
+
+# Forma de cada plantilla (ver Bus.PLANTILLAS_ASIENTOS). Las filas salen de
+# la capacidad del bus; filas_premium son rangos de filas (desde 1, inclusive).
+# Si la capacidad no completa la última fila, esa fila queda incompleta.
+PLANTILLAS = {
+    'estandar': {'columnas': 4, 'pasillo_despues_de': 2, 'filas_premium': [(1, 2)]},
+    'economico': {'columnas': 4, 'pasillo_despues_de': 2, 'filas_premium': []},
+    'cama': {'columnas': 3, 'pasillo_despues_de': 1, 'filas_premium': [(1, None)]},
+}
+
+
+def plantilla(nombre: str) -> Dict:
+    """Devuelve la plantilla indicada, o la estándar si no existe"""
+    return PLANTILLAS.get(nombre, PLANTILLAS['estandar'])
+
+
+def disenar(capacidad: int, nombre_plantilla: str) -> Dict[int, str]:
+    """
+    Calcula la distribución de un bus
+    Returns:
+        Dict: Tipo de asiento por número (1..capacidad)
+    """
+    forma = plantilla(nombre_plantilla)
+    columnas = forma['columnas']
+    filas = math.ceil(capacidad / columnas)
+    premium = set()
+    for desde, hasta in forma['filas_premium']:
+        premium.update(range(desde, (hasta or filas) + 1))
+    return {
+        numero: 'premium' if (numero - 1) // columnas + 1 in premium else 'normal'
+        for numero in range(1, capacidad + 1)
+    }
+
+
+def generar(buses=None, tamano_lote: int = TAMANO_LOTE, podar: bool = False) -> Dict[str, int]:
+    """
+    Deja los asientos de cada bus iguales a su plantilla y capacidad. Por
+    cada lote de buses se leen sus asientos en una consulta y se escriben
+    solo las diferencias: un bulk_create con los que faltan y un bulk_update
+    con los que cambiaron de tipo.
+    Args:
+        buses: QuerySet o IDs de buses (todos por defecto)
+        podar: Elimina los asientos que sobran (número mayor que la capacidad)
+            si no tienen reservas
+    Returns:
+        Dict: Cantidad de asientos creados, actualizados y eliminados
+    """
+    consulta = Bus.objects.all()
+    if buses is not None:
+        consulta = consulta.filter(id__in=buses if isinstance(buses, QuerySet) else list(buses))
+    consulta = consulta.order_by('id').values_list('id', 'capacidad', 'plantilla_asientos')
+
+    totales = {'creados': 0, 'actualizados': 0, 'eliminados': 0}
+    lote = []
+    for fila in consulta.iterator(chunk_size=tamano_lote):
+        lote.append(fila)
+        if len(lote) >= tamano_lote:
+            _sumar(totales, _generar_lote(lote, podar))
+            lote = []
+    if lote:
+        _sumar(totales, _generar_lote(lote, podar))
+    return totales
+
+
+def _sumar(totales: Dict[str, int], cambios: Dict[str, int]) -> None:
+    for clave, cantidad in cambios.items():
+        totales[clave] += cantidad
+
+
+def _generar_lote(buses: List[Tuple[int, int, str]], podar: bool) -> Dict[str, int]:
+    existentes = defaultdict(dict)
+    for asiento_id, bus_id, numero, tipo in Asiento.objects.filter(
+        bus_id__in=[bus_id for bus_id, _, _ in buses]
+    ).values_list('id', 'bus_id', 'numero', 'tipo'):
+        existentes[bus_id][numero] = (asiento_id, tipo)
+
+    crear = []
+    actualizar = []
+    sobrantes = []
+    cambiados = set()
+    for bus_id, capacidad, nombre_plantilla in buses:
+        deseados = disenar(capacidad, nombre_plantilla)
+        del_bus = existentes.get(bus_id, {})
+        for numero, tipo in deseados.items():
+            existente = del_bus.get(numero)
+            if existente is None:
+                crear.append(Asiento(bus_id=bus_id, numero=numero, tipo=tipo))
+                cambiados.add(bus_id)
+            elif existente[1] != tipo:
+                actualizar.append(Asiento(id=existente[0], tipo=tipo))
+        if podar:
+            sobrantes.extend(
+                asiento_id for numero, (asiento_id, _) in del_bus.items() if numero not in deseados
+            )
+
+    if not (crear or actualizar or sobrantes):
+        return {'creados': 0, 'actualizados': 0, 'eliminados': 0}
+
+    with transaction.atomic():
+        Asiento.objects.bulk_create(crear, batch_size=TAMANO_LOTE)
+        Asiento.objects.bulk_update(actualizar, ['tipo'], batch_size=TAMANO_LOTE)
+        eliminados = 0
+        if sobrantes:
+            sin_reservas = Asiento.objects.filter(id__in=sobrantes).exclude(
+                Exists(Reserva.objects.filter(asiento=OuterRef('pk')))
+            )
+            cambiados.update(sin_reservas.values_list('bus_id', flat=True))
+            eliminados, _ = sin_reservas.delete()
+
+        # El total de asientos de los viajes ya programados cambia con el bus
+        if cambiados:
+            viajes = Viaje.objects.filter(bus_id__in=cambiados)
+            if viajes.exists():
+                disponibilidad.reconstruir(viajes)
+
+    return {'creados': len(crear), 'actualizados': len(actualizar), 'eliminados': eliminados}
+
+
+def forma_mapa(nombre_plantilla: str) -> Dict[str, int]:
+    """Columnas y posición del pasillo de una plantilla, para el mapa de asientos"""
+    forma = plantilla(nombre_plantilla)
+    return {'columnas': forma['columnas'], 'pasillo_despues_de': forma['pasillo_despues_de']}
@@ -0,0 +1,294 @@
+"""
+Índice de autocompletado de ciudades: búsqueda por prefijo y por trigramas
+sobre claves normalizadas (minúsculas y sin acentos)
+"""
+
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Q, QuerySet
+
+from .models import Ciudad, CiudadBusqueda, TrigramaCiudad
+
+TAMANO_LOTE = 1000
+LIMITE_RESULTADOS = 10
+# Proporción mínima de trigramas de la consulta que debe tener una ciudad
+SIMILITUD_MINIMA = 0.6
+# Límite superior de las búsquedas por rango de prefijo
+FIN_PREFIJO = '\U0010ffff'
+
+
+class CacheLocal:
+    """
+    Cache LRU con vencimiento por TTL, propia de cada proceso y segura entre hilos
+    """
+
+    def __init__(self, max_entradas: int, ttl: float):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: str) -> Tuple[bool, Any]:
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return False, None
+            vence, valor = entrada
+            if vence <= time.monotonic():
+                del self._entradas[clave]
+                return False, None
+            self._entradas.move_to_end(clave)
+            return True, valor
+
+    def guardar(self, clave: str, valor: Any) -> None:
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+class CacheDjango:
+    """
+    Cache sobre el framework de cache de Django (p. ej. locmem o archivos),
+    compartible entre procesos según el backend. Como no se pueden listar
+    las claves, la invalidación incrementa una generación que forma parte
+    de cada clave.
+    """
+
+    CLAVE_GENERACION = 'autocompletado:generacion'
+
+    def __init__(self, alias: str, ttl: float):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _clave(self, clave: str) -> str:
+        generacion = self.cache.get_or_set(self.CLAVE_GENERACION, 1, timeout=None)
+        return f'autocompletado:{generacion}:{clave}'
+
+    def obtener(self, clave: str) -> Tuple[bool, Any]:
+        valor = self.cache.get(self._clave(clave))
+        return valor is not None, valor
+
+    def guardar(self, clave: str, valor: Any) -> None:
+        self.cache.set(self._clave(clave), valor, timeout=self.ttl)
+
+    def limpiar(self) -> None:
+        try:
+            self.cache.incr(self.CLAVE_GENERACION)
+        except ValueError:
+            self.cache.set(self.CLAVE_GENERACION, 1, timeout=None)
+
+    def __len__(self):
+        return 0
+
+
+def _crear_cache():
+    configuracion = getattr(settings, 'AUTOCOMPLETADO_CACHE', {})
+    backend = configuracion.get('BACKEND', 'local')
+    ttl = configuracion.get('TTL', 300)
+    if backend == 'local':
+        return CacheLocal(configuracion.get('MAX_ENTRADAS', 5000), ttl)
+    return CacheDjango(backend, ttl)
+
+
+_cache = None
+_contadores = {'aciertos': 0, 'fallos': 0}
+_contadores_lock = threading.Lock()
+
+
+def _obtener_cache():
+    global _cache
+    if _cache is None:
+        _cache = _crear_cache()
+    return _cache
+
+
+def invalidar_cache() -> None:
+    """Descarta los resultados guardados; se llama al modificar ciudades, regiones o países"""
+    _obtener_cache().limpiar()
+
+
+def reiniciar_cache() -> None:
+    """Vuelve a crear la cache según la configuración actual y reinicia los contadores"""
+    global _cache
+    _cache = None
+    with _contadores_lock:
+        _contadores.update(aciertos=0, fallos=0)
+
+
+def estadisticas_cache() -> Dict[str, Any]:
+    """Aciertos, fallos y tamaño de la cache de resultados de este proceso"""
+    with _contadores_lock:
+        aciertos, fallos = _contadores['aciertos'], _contadores['fallos']
+    total = aciertos + fallos
+    return {
+        'aciertos': aciertos,
+        'fallos': fallos,
+        'tasa_aciertos': aciertos / total if total else 0.0,
+        'entradas': len(_obtener_cache()),
+    }
+
+
+def normalizar(texto: str) -> str:
+    """Pasa a minúsculas, elimina acentos y deja solo letras, dígitos y espacios simples"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return ' '.join(re.findall(r'\w+', texto))
+
+
+def trigramas(texto: str, completo: bool = True) -> Set[str]:
+    """
+    Trigramas de cada palabra, con dos espacios al inicio y uno al final.
+    Con completo=False la última palabra no se cierra, porque en el
+    autocompletado el usuario todavía la está escribiendo.
+    """
+    palabras = normalizar(texto).split()
+    resultado = set()
+    for i, palabra in enumerate(palabras):
+        cerrada = completo or i < len(palabras) - 1
+        relleno = f'  {palabra} ' if cerrada else f'  {palabra}'
+        resultado.update(relleno[j:j + 3] for j in range(len(relleno) - 2))
+    return resultado
+
+
+def indexar(ciudades: Optional[Iterable[int]] = None, tamano_lote: int = TAMANO_LOTE) -> int:
+    """
+    Construye o actualiza el índice de las ciudades indicadas (todas por defecto).
+    Las ciudades inactivas se quitan del índice.
+    Returns:
+        int: Cantidad de ciudades indexadas
+    """
+    consulta = Ciudad.objects.all()
+    if ciudades is not None:
+        # Un QuerySet se usa como subconsulta para no enviar miles de parámetros
+        consulta = consulta.filter(id__in=ciudades if isinstance(ciudades, QuerySet) else list(ciudades))
+
+    inactivas = consulta.filter(activa=False).values('id')
+    with transaction.atomic():
+        transaction.on_commit(invalidar_cache)
+        TrigramaCiudad.objects.filter(ciudad__in=inactivas).delete()
+        CiudadBusqueda.objects.filter(ciudad__in=inactivas).delete()
+
+    consulta = consulta.filter(activa=True).annotate(
+        lineas=Count('lineas_origen', filter=Q(lineas_origen__activa=True), distinct=True)
+        + Count('lineas_destino', filter=Q(lineas_destino__activa=True), distinct=True)
+    ).values_list('id', 'nombre', 'region__nombre', 'region__pais__nombre', 'poblacion', 'lineas').order_by('id')
+
+    indexadas = 0
+    lote = []
+    for fila in consulta.iterator(chunk_size=tamano_lote):
+        lote.append(fila)
+        if len(lote) >= tamano_lote:
+            indexadas += _guardar(lote)
+            lote = []
+    if lote:
+        indexadas += _guardar(lote)
+    return indexadas
+
+
+def _guardar(filas) -> int:
+    entradas = []
+    trigramas_lote = []
+    for ciudad_id, nombre, region, pais, poblacion, lineas in filas:
+        texto = f'{nombre}, {region}, {pais}'
+        entradas.append(CiudadBusqueda(
+            ciudad_id=ciudad_id,
+            clave=normalizar(nombre),
+            texto=texto,
+            poblacion=poblacion or 0,
+            popularidad=lineas,
+        ))
+        trigramas_lote.extend(
+            TrigramaCiudad(ciudad_id=ciudad_id, trigrama=trigrama)
+            for trigrama in sorted(trigramas(f'{nombre} {region} {pais}'))
+        )
+
+    with transaction.atomic():
+        transaction.on_commit(invalidar_cache)
+        CiudadBusqueda.objects.bulk_create(
+            entradas,
+            update_conflicts=True,
+            unique_fields=['ciudad'],
+            update_fields=['clave', 'texto', 'poblacion', 'popularidad'],
+        )
+        TrigramaCiudad.objects.filter(ciudad_id__in=[entrada.ciudad_id for entrada in entradas]).delete()
+        TrigramaCiudad.objects.bulk_create(trigramas_lote, batch_size=TAMANO_LOTE)
+    return len(entradas)
+
+
+def buscar(consulta: str, limite: int = LIMITE_RESULTADOS) -> List[Dict[str, Any]]:
+    """
+    Busca ciudades para el autocompletado, pasando por la cache de
+    resultados (la clave es la consulta normalizada)
+    Returns:
+        List[Dict]: Resultados con 'id' y 'text'
+    """
+    clave = normalizar(consulta)
+    if len(clave) < 2:
+        return []
+
+    cache = _obtener_cache()
+    clave_cache = f'{limite}:{clave}'
+    encontrado, resultados = cache.obtener(clave_cache)
+    with _contadores_lock:
+        _contadores['aciertos' if encontrado else 'fallos'] += 1
+    if not encontrado:
+        resultados = buscar_sin_cache(clave, limite)
+        cache.guardar(clave_cache, resultados)
+    return resultados
+
+
+def buscar_sin_cache(consulta: str, limite: int = LIMITE_RESULTADOS) -> List[Dict[str, Any]]:
+    """
+    Busca ciudades en el índice. Primero las que empiezan con el texto
+    buscado y luego las similares por trigramas; dentro de cada grupo se
+    ordena por popularidad y población.
+    """
+    clave = normalizar(consulta)
+    if len(clave) < 2:
+        return []
+
+    orden = ('-popularidad', '-poblacion', 'clave')
+    resultados = list(
+        CiudadBusqueda.objects.filter(
+            clave__gte=clave, clave__lt=clave + FIN_PREFIJO
+        ).order_by(*orden).values_list('ciudad_id', 'texto')[:limite]
+    )
+
+    faltantes = limite - len(resultados)
+    if faltantes > 0:
+        buscados = trigramas(clave, completo=False)
+        minimo = max(1, math.ceil(len(buscados) * SIMILITUD_MINIMA))
+        similares = CiudadBusqueda.objects.filter(
+            ciudad__trigramas__trigrama__in=buscados
+        ).exclude(
+            ciudad_id__in=[ciudad_id for ciudad_id, _ in resultados]
+        ).annotate(
+            coincidencias=Count('ciudad__trigramas')
+        ).filter(
+            coincidencias__gte=minimo
+        ).order_by('-coincidencias', *orden).values_list('ciudad_id', 'texto')[:faltantes]
+        resultados.extend(similares)
+
+    return [{'id': ciudad_id, 'text': texto} for ciudad_id, texto in resultados]
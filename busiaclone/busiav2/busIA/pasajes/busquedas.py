@@ -0,0 +1,206 @@
+"""
+Cache de resultados de la búsqueda de viajes por ruta y día, sobre el
+framework de cache de Django. Cada (origen, destino, fecha) tiene una
+versión en la cache que se renueva al guardar un viaje o su disponibilidad;
+la huella de una búsqueda combina esas versiones, así que sirve de clave y
+de ETag sin consultar la base de datos. Las versiones solo llegan a todos
+los procesos si el backend es compartido (ver checks.py).
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+PREFIJO = 'busquedas'
+CLAVE_GENERACION = f'{PREFIJO}:generacion'
+# Ventanas más largas no tienen huella; el servicio de búsqueda las rechaza
+DIAS_MAXIMOS = 31
+# Intervalo con que una solicitud consulta el resultado que calcula otra
+INTERVALO_ESPERA = 0.02
+
+_contadores = {'aciertos': 0, 'fallos': 0, 'esperas': 0}
+_contadores_lock = threading.Lock()
+
+
+def _configuracion() -> Dict[str, Any]:
+    configuracion = {'BACKEND': 'default', 'TTL': 300, 'ESPERA': 5}
+    configuracion.update(getattr(settings, 'BUSQUEDAS_CACHE', {}))
+    return configuracion
+
+
+def _cache():
+    return caches[_configuracion()['BACKEND']]
+
+
+def _contar(evento: str) -> None:
+    with _contadores_lock:
+        _contadores[evento] += 1
+
+
+def _clave_ruta(origen_id: int, destino_id: int, fecha: date) -> str:
+    return f'{PREFIJO}:ruta:{origen_id}:{destino_id}:{fecha.isoformat()}'
+
+
+def _nueva_version() -> str:
+    # Un valor único, y no un contador, para que una clave desalojada o
+    # vencida nunca vuelva a una versión que ya tuvo
+    return uuid.uuid4().hex
+
+
+def _versiones(cache, claves: List[str]) -> List[str]:
+    versiones = cache.get_many(claves)
+    for clave in claves:
+        if clave not in versiones:
+            nueva = _nueva_version()
+            versiones[clave] = nueva if cache.add(clave, nueva, timeout=None) else cache.get(clave, nueva)
+    return [versiones[clave] for clave in claves]
+
+
+def huella(consulta: str, parametros: Dict[str, Any]) -> Optional[str]:
+    """
+    Identifica el resultado de una búsqueda con una sola lectura de la cache:
+    la consulta (parámetros, orden y cursor) más la versión de cada día de la
+    ruta buscada. Cambia con cualquier cambio de esos días, así que también
+    sirve de ETag.
+    Args:
+        consulta: Texto de la consulta, p. ej. request.GET.urlencode()
+        parametros: Parámetros de ViajeService.buscar_viajes
+    Returns:
+        str | None: None si la ventana de fechas no es válida
+    """
+    desde = parametros['fecha_desde']
+    hasta = parametros.get('fecha_hasta') or desde
+    if not 0 <= (hasta - desde).days < DIAS_MAXIMOS:
+        return None
+    fechas = [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)]
+    versiones = _versiones(_cache(), [CLAVE_GENERACION] + [
+        _clave_ruta(parametros['origen_id'], parametros['destino_id'], fecha) for fecha in fechas
+    ])
+    resumen = hashlib.sha1(repr((versiones, consulta)).encode())
+    return f'viajes-{resumen.hexdigest()}'
+
+
+def _clave_resultado(huella: str, parametros: Dict[str, Any]) -> str:
+    resumen = hashlib.sha1(repr((huella, sorted(parametros.items()))).encode())
+    return f'{PREFIJO}:resultado:{resumen.hexdigest()}'
+
+
+def obtener(huella: Optional[str], parametros: Dict[str, Any], calcular: Callable[[], Any]) -> Any:
+    """
+    Devuelve el resultado guardado de la búsqueda o lo calcula y lo guarda.
+    Ante varios fallos simultáneos solo una solicitud (la que consigue el
+    bloqueo) ejecuta calcular; las demás esperan su resultado hasta ESPERA
+    segundos y solo entonces calculan por su cuenta.
+    Args:
+        huella: Resultado de huella(), leído antes de la búsqueda; con None no se guarda
+        parametros: Parámetros de ViajeService.buscar_viajes
+        calcular: Función que hace la búsqueda; sus excepciones se propagan
+    """
+    if huella is None:
+        return calcular()
+
+    configuracion = _configuracion()
+    cache = _cache()
+    # Las versiones se leen antes que la base de datos: si un cambio se
+    # confirma mientras tanto, el resultado queda guardado con la versión vieja
+    clave = _clave_resultado(huella, parametros)
+    resultado = cache.get(clave)
+    if resultado is not None:
+        _contar('aciertos')
+        return resultado
+
+    bloqueo = f'{clave}:bloqueo'
+    if not cache.add(bloqueo, 1, timeout=configuracion['ESPERA']):
+        limite = time.monotonic() + configuracion['ESPERA']
+        while time.monotonic() < limite:
+            time.sleep(INTERVALO_ESPERA)
+            resultado = cache.get(clave)
+            if resultado is not None:
+                _contar('esperas')
+                return resultado
+            if cache.get(bloqueo) is None:
+                # El cálculo terminó sin guardar nada (p. ej. con un error)
+                break
+        _contar('fallos')
+        return calcular()
+
+    try:
+        _contar('fallos')
+        resultado = calcular()
+        cache.set(clave, resultado, timeout=configuracion['TTL'])
+        return resultado
+    finally:
+        cache.delete(bloqueo)
+
+
+def _renovar(rutas: Iterable[Tuple[int, int, date]]) -> None:
+    _cache().set_many({
+        _clave_ruta(origen_id, destino_id, fecha): _nueva_version()
+        for origen_id, destino_id, fecha in rutas
+    }, timeout=None)
+
+
+def invalidar(rutas: Iterable[Tuple[int, int, date]]) -> None:
+    """
+    Descarta los resultados guardados de cada (origen, destino, fecha).
+    La versión cambia en el momento y otra vez al confirmar la transacción:
+    una búsqueda concurrente que alcance a leer los datos anteriores queda
+    guardada con una versión que ya no se usa.
+    """
+    rutas = set(rutas)
+    if not rutas:
+        return
+    _renovar(rutas)
+    transaction.on_commit(lambda: _renovar(rutas))
+
+
+def invalidar_viajes(viajes) -> None:
+    """Descarta los resultados de las rutas y días de un QuerySet de viajes"""
+    invalidar(
+        viajes.annotate(fecha=TruncDate('fecha_salida'))
+        .order_by().values_list('origen_id', 'destino_id', 'fecha').distinct()
+    )
+
+
+def ruta_del_viaje(viaje) -> Tuple[int, int, date]:
+    """Ruta y día local de salida de un viaje, como se usan en la clave"""
+    return viaje.origen_id, viaje.destino_id, timezone.localtime(viaje.fecha_salida).date()
+
+
+def _renovar_generacion() -> None:
+    _cache().set(CLAVE_GENERACION, _nueva_version(), timeout=None)
+
+
+def descartar() -> None:
+    """
+    Descarta todos los resultados (en el momento y al confirmar, como
+    invalidar); se usa cuando cambian muchas rutas a la vez o los nombres
+    de ciudades, regiones o países
+    """
+    _renovar_generacion()
+    transaction.on_commit(_renovar_generacion)
+
+
+def reiniciar() -> None:
+    """Descarta los resultados y reinicia los contadores"""
+    descartar()
+    with _contadores_lock:
+        _contadores.update(aciertos=0, fallos=0, esperas=0)
+
+
+def estadisticas() -> Dict[str, Any]:
+    """Aciertos, fallos y esperas por el cálculo de otra solicitud en este proceso"""
+    with _contadores_lock:
+        contadores = dict(_contadores)
+    total = sum(contadores.values())
+    contadores['tasa_aciertos'] = (contadores['aciertos'] + contadores['esperas']) / total if total else 0.0
+    return contadores
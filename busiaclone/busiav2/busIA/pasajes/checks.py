@@ -0,0 +1,30 @@
+"""
+Comprobaciones de configuración de la aplicación de pasajes
+"""
+
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends cuyo contenido es propio de cada proceso
+BACKENDS_LOCALES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+}
+
+
+@register(Tags.caches, deploy=True)
+def revisar_cache_busquedas(app_configs, **kwargs):
+    """
+    Las versiones por ruta y día de pasajes.busquedas se renuevan en el
+    proceso que guarda el cambio. Con un backend local los demás procesos no
+    se enteran y siguen sirviendo resultados y ETags viejos, así que en
+    producción el backend debe ser compartido.
+    """
+    alias = getattr(settings, 'BUSQUEDAS_CACHE', {}).get('BACKEND', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend in BACKENDS_LOCALES:
+        return [Error(
+            f"BUSQUEDAS_CACHE usa el backend local '{alias}' ({backend})",
+            hint='Use un backend compartido (Redis, Memcached o base de datos).',
+            id='pasajes.E001',
+        )]
+    return []
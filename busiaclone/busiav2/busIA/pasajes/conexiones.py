@@ -0,0 +1,365 @@
+"""
+Búsqueda de conexiones: itinerarios de uno o más tramos entre dos ciudades
+sobre un grafo en memoria de las salidas programadas de cada día
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, NamedTuple, Set, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Ciudad, Viaje
+
+TRAMOS_MAXIMOS = 3
+CONEXION_MINIMA = timedelta(minutes=30)
+ESPERA_MAXIMA = timedelta(hours=6)
+LIMITE_RESULTADOS = 10
+ORDENES = ('llegada', 'precio')
+# Tope de etiquetas que puede sacar de la cola una búsqueda
+EXPANSIONES_MAXIMAS = 50000
+# Rondas de búsqueda descartando tramos sin asientos libres
+RONDAS_DISPONIBILIDAD = 3
+
+
+class Tramo(NamedTuple):
+    viaje_id: int
+    origen_id: int
+    destino_id: int
+    salida: datetime
+    llegada: datetime
+    precio: Decimal
+    empresa: str
+
+    @property
+    def clave(self) -> Tuple[datetime, int]:
+        return self.salida, self.viaje_id
+
+
+CAMPOS_TRAMO = ('id', 'origen_id', 'destino_id', 'fecha_salida', 'fecha_llegada', 'precio', 'nombre_empresa')
+
+
+class GrafoDia:
+    """
+    Salidas programadas de un día local, agrupadas por ciudad de origen y
+    ordenadas por hora de salida. Las listas y conjuntos de cada ciudad se
+    reemplazan en lugar de modificarse, así una búsqueda en curso no ve
+    cambios a medias.
+    """
+
+    def __init__(self, fecha: date, tramos: Iterable[Tramo]):
+        self.fecha = fecha
+        self.cargado = time.monotonic()
+        self.viajes: Dict[int, Tramo] = {}
+        salidas = defaultdict(list)
+        # Cantidad de tramos por par (origen, destino), para saber desde
+        # qué ciudades se llega a cada destino
+        self._pares = defaultdict(int)
+        self.entrantes: Dict[int, Set[int]] = defaultdict(set)
+        for tramo in tramos:
+            self.viajes[tramo.viaje_id] = tramo
+            salidas[tramo.origen_id].append(tramo)
+            self._pares[tramo.origen_id, tramo.destino_id] += 1
+            self.entrantes[tramo.destino_id].add(tramo.origen_id)
+        self.salidas: Dict[int, List[Tramo]] = {}
+        self.claves: Dict[int, List[Tuple[datetime, int]]] = {}
+        for ciudad_id, lista in salidas.items():
+            lista.sort(key=lambda tramo: tramo.clave)
+            self.salidas[ciudad_id] = lista
+            self.claves[ciudad_id] = [tramo.clave for tramo in lista]
+
+    def __len__(self):
+        return len(self.viajes)
+
+    def agregar(self, tramo: Tramo) -> None:
+        self.quitar(tramo.viaje_id)
+        lista = list(self.salidas.get(tramo.origen_id, ()))
+        claves = list(self.claves.get(tramo.origen_id, ()))
+        posicion = bisect_left(claves, tramo.clave)
+        lista.insert(posicion, tramo)
+        claves.insert(posicion, tramo.clave)
+        self.salidas[tramo.origen_id], self.claves[tramo.origen_id] = lista, claves
+        self.viajes[tramo.viaje_id] = tramo
+        self._pares[tramo.origen_id, tramo.destino_id] += 1
+        self.entrantes[tramo.destino_id] = self.entrantes.get(tramo.destino_id, set()) | {tramo.origen_id}
+
+    def quitar(self, viaje_id: int) -> None:
+        tramo = self.viajes.pop(viaje_id, None)
+        if tramo is None:
+            return
+        posicion = bisect_left(self.claves[tramo.origen_id], tramo.clave)
+        lista = list(self.salidas[tramo.origen_id])
+        claves = list(self.claves[tramo.origen_id])
+        del lista[posicion], claves[posicion]
+        self.salidas[tramo.origen_id], self.claves[tramo.origen_id] = lista, claves
+        par = tramo.origen_id, tramo.destino_id
+        self._pares[par] -= 1
+        if not self._pares[par]:
+            del self._pares[par]
+            self.entrantes[tramo.destino_id] = self.entrantes[tramo.destino_id] - {tramo.origen_id}
+
+    def desde(self, ciudad_id: int, inicio: datetime, fin: datetime) -> List[Tramo]:
+        """Tramos que salen de la ciudad entre inicio y fin, ambos inclusive"""
+        claves = self.claves.get(ciudad_id)
+        if not claves:
+            return []
+        desde = bisect_left(claves, (inicio, 0))
+        hasta = bisect_left(claves, (fin, float('inf')), lo=desde)
+        return self.salidas[ciudad_id][desde:hasta]
+
+
+def _tramo(fila) -> Tramo:
+    return Tramo(*fila)
+
+
+def cargar_dia(fecha: date) -> GrafoDia:
+    """Construye el grafo de un día con una sola consulta"""
+    filas = Viaje.objects.filter(estado='programado').salen_entre(fecha).order_by().values_list(*CAMPOS_TRAMO)
+    return GrafoDia(fecha, (_tramo(fila) for fila in filas.iterator(chunk_size=5000)))
+
+
+class GrafoConexiones:
+    """
+    Grafos por día de este proceso: se cargan al primer uso, se conservan los
+    max_dias más recientes y vencen tras ttl segundos para recoger los cambios
+    hechos por otros procesos. Los cambios de este proceso se aplican al
+    momento con actualizar y quitar.
+    """
+
+    def __init__(self, max_dias: int, ttl: float):
+        self.max_dias = max_dias
+        self.ttl = ttl
+        self._dias = OrderedDict()
+        self._lock = threading.Lock()
+
+    def dia(self, fecha: date) -> GrafoDia:
+        # La carga ocurre con el lock tomado: solicitudes simultáneas del
+        # mismo día esperan una única carga en lugar de repetirla
+        with self._lock:
+            grafo = self._dias.get(fecha)
+            if grafo is None or grafo.cargado + self.ttl <= time.monotonic():
+                grafo = self._dias[fecha] = cargar_dia(fecha)
+            self._dias.move_to_end(fecha)
+            while len(self._dias) > self.max_dias:
+                self._dias.popitem(last=False)
+            return grafo
+
+    def actualizar(self, viajes: Iterable[Viaje]) -> None:
+        """Aplica viajes creados o modificados a los días cargados"""
+        with self._lock:
+            for viaje in viajes:
+                for grafo in self._dias.values():
+                    grafo.quitar(viaje.id)
+                grafo = self._dias.get(timezone.localdate(viaje.fecha_salida))
+                if grafo is not None and viaje.estado == 'programado':
+                    grafo.agregar(_tramo(getattr(viaje, campo) for campo in CAMPOS_TRAMO))
+
+    def quitar(self, viaje_ids: Iterable[int]) -> None:
+        with self._lock:
+            for viaje_id in viaje_ids:
+                for grafo in self._dias.values():
+                    grafo.quitar(viaje_id)
+
+    def descartar(self) -> None:
+        """Olvida los días cargados; se vuelven a cargar en la próxima búsqueda"""
+        with self._lock:
+            self._dias.clear()
+
+    def __len__(self):
+        return len(self._dias)
+
+
+_grafo = None
+
+
+def obtener_grafo() -> GrafoConexiones:
+    global _grafo
+    if _grafo is None:
+        configuracion = getattr(settings, 'CONEXIONES', {})
+        _grafo = GrafoConexiones(configuracion.get('MAX_DIAS', 8), configuracion.get('TTL', 600))
+    return _grafo
+
+
+def reiniciar() -> None:
+    """Vuelve a crear el grafo según la configuración actual"""
+    global _grafo
+    _grafo = None
+
+
+def viaje_guardado(viaje: Viaje) -> None:
+    if _grafo is not None:
+        _grafo.actualizar([viaje])
+
+
+def viaje_eliminado(viaje_id: int) -> None:
+    if _grafo is not None:
+        _grafo.quitar([viaje_id])
+
+
+def descartar() -> None:
+    if _grafo is not None:
+        _grafo.descartar()
+
+
+def _saltos_hasta(destino_id: int, dias: List[GrafoDia], maximo: int) -> Dict[int, int]:
+    """Mínima cantidad de tramos desde cada ciudad hasta el destino, hasta maximo"""
+    saltos = {destino_id: 0}
+    frontera = [destino_id]
+    for distancia in range(1, maximo + 1):
+        siguiente = []
+        for ciudad_id in frontera:
+            for dia in dias:
+                for anterior in dia.entrantes.get(ciudad_id, ()):
+                    if anterior not in saltos:
+                        saltos[anterior] = distancia
+                        siguiente.append(anterior)
+        frontera = siguiente
+    return saltos
+
+
+def itinerarios(dias: List[GrafoDia], origen_id: int, destino_id: int, orden: str = 'llegada',
+                tramos_maximos: int = 2, conexion_minima: timedelta = CONEXION_MINIMA,
+                espera_maxima: timedelta = ESPERA_MAXIMA, limite: int = LIMITE_RESULTADOS,
+                excluir: Set[int] = frozenset()) -> List[Tuple[Tramo, ...]]:
+    """
+    Búsqueda acotada de caminos dependientes del tiempo: el primer tramo sale
+    el primer día de dias y cada tramo siguiente sale de la ciudad de llegada
+    entre conexion_minima y espera_maxima después. Los caminos parciales se
+    expanden en orden de llegada (o de precio total), así que los
+    itinerarios salen ya ordenados; ambas claves solo crecen al agregar
+    tramos. Se descartan ciudades repetidas y tramos desde los que el destino
+    queda a más tramos de los permitidos, y cada ciudad se expande a lo sumo
+    limite veces, como en la búsqueda de los k caminos más cortos.
+    """
+    if origen_id == destino_id:
+        return []
+    saltos = _saltos_hasta(destino_id, dias, tramos_maximos - 1)
+
+    def clave(llegada, precio):
+        return (llegada, precio) if orden == 'llegada' else (precio, llegada)
+
+    def admisible(tramo, usados, tramos):
+        restantes = saltos.get(tramo.destino_id)
+        return (
+            restantes is not None and tramos + 1 + restantes <= tramos_maximos
+            and tramo.viaje_id not in excluir and tramo.destino_id not in usados
+        )
+
+    cola = []
+    contador = 0
+    for tramo in dias[0].salidas.get(origen_id, ()):
+        if admisible(tramo, (origen_id,), 0):
+            heapq.heappush(cola, (clave(tramo.llegada, tramo.precio), contador, (tramo,)))
+            contador += 1
+
+    resultados = []
+    expansiones = defaultdict(int)
+    sacadas = 0
+    while cola and len(resultados) < limite and sacadas < EXPANSIONES_MAXIMAS:
+        _, _, camino = heapq.heappop(cola)
+        sacadas += 1
+        ultimo = camino[-1]
+        if ultimo.destino_id == destino_id:
+            resultados.append(camino)
+            continue
+        expansiones[ultimo.destino_id] += 1
+        if expansiones[ultimo.destino_id] > limite:
+            continue
+
+        usados = {origen_id, *(tramo.destino_id for tramo in camino)}
+        precio = sum(tramo.precio for tramo in camino)
+        inicio, fin = ultimo.llegada + conexion_minima, ultimo.llegada + espera_maxima
+        for dia in dias:
+            for tramo in dia.desde(ultimo.destino_id, inicio, fin):
+                if admisible(tramo, usados, len(camino)):
+                    heapq.heappush(cola, (clave(tramo.llegada, precio + tramo.precio), contador, camino + (tramo,)))
+                    contador += 1
+    return resultados
+
+
+def buscar(origen_id: int, destino_id: int, fecha: date, orden: str = 'llegada', tramos_maximos: int = 2,
+           conexion_minima: timedelta = CONEXION_MINIMA, espera_maxima: timedelta = ESPERA_MAXIMA,
+           limite: int = LIMITE_RESULTADOS) -> List[Dict[str, Any]]:
+    """
+    Busca itinerarios con asientos libres en todos sus tramos que salen del
+    origen el día indicado
+    Args:
+        orden: 'llegada' (más temprana primero) o 'precio' (total más bajo primero)
+        tramos_maximos: 1 solo viajes directos, 2 hasta una escala, ...
+    Returns:
+        List[Dict]: Itinerarios con sus tramos, precio total, escalas y horarios
+    Raises:
+        ValueError: Si algún parámetro no es válido
+    """
+    if orden not in ORDENES:
+        raise ValueError(f'Orden no válido: {orden}')
+    if not 1 <= tramos_maximos <= TRAMOS_MAXIMOS:
+        raise ValueError(f'La cantidad de tramos debe estar entre 1 y {TRAMOS_MAXIMOS}')
+    if conexion_minima < timedelta(0) or espera_maxima < conexion_minima:
+        raise ValueError('La espera máxima debe ser mayor o igual a la conexión mínima')
+    if origen_id == destino_id:
+        raise ValueError('El origen y el destino deben ser distintos')
+    limite = max(1, min(int(limite), LIMITE_RESULTADOS * 5))
+
+    grafo = obtener_grafo()
+    # Las conexiones pueden salir pasada la medianoche
+    dias = [grafo.dia(fecha)]
+    if tramos_maximos > 1:
+        dias.append(grafo.dia(fecha + timedelta(days=1)))
+
+    # Se busca sobre los horarios y luego se revisa la disponibilidad de los
+    # tramos encontrados; si alguno está lleno se repite sin él
+    llenos, libres = set(), {}
+    for _ in range(RONDAS_DISPONIBILIDAD):
+        encontrados = itinerarios(
+            dias, origen_id, destino_id, orden, tramos_maximos, conexion_minima, espera_maxima, limite, llenos
+        )
+        pendientes = {tramo.viaje_id for camino in encontrados for tramo in camino} - libres.keys()
+        if not pendientes:
+            break
+        libres.update(
+            Viaje.objects.filter(id__in=pendientes).con_asientos_libres().values_list('id', 'asientos_libres')
+        )
+        nuevos_llenos = {viaje_id for viaje_id in pendientes if not libres.get(viaje_id)}
+        if not nuevos_llenos:
+            break
+        llenos |= nuevos_llenos
+    encontrados = [camino for camino in encontrados if all(libres.get(tramo.viaje_id) for tramo in camino)]
+
+    ciudades = {tramo.origen_id for camino in encontrados for tramo in camino} | {destino_id}
+    nombres = {
+        ciudad.id: str(ciudad)
+        for ciudad in Ciudad.objects.filter(id__in=ciudades).select_related('region__pais')
+    }
+    return [serializar(camino, nombres, libres) for camino in encontrados]
+
+
+def serializar(camino: Tuple[Tramo, ...], nombres: Dict[int, str], libres: Dict[int, int]) -> Dict[str, Any]:
+    salida, llegada = camino[0].salida, camino[-1].llegada
+    return {
+        'salida': timezone.localtime(salida).isoformat(),
+        'llegada': timezone.localtime(llegada).isoformat(),
+        'duracion': str(llegada - salida),
+        'escalas': len(camino) - 1,
+        'precio_total': float(sum(tramo.precio for tramo in camino)),
+        'asientos_disponibles': min(libres[tramo.viaje_id] for tramo in camino),
+        'tramos': [
+            {
+                'viaje_id': tramo.viaje_id,
+                'empresa': tramo.empresa,
+                'origen': nombres[tramo.origen_id],
+                'destino': nombres[tramo.destino_id],
+                'salida': timezone.localtime(tramo.salida).isoformat(),
+                'llegada': timezone.localtime(tramo.llegada).isoformat(),
+                'precio': float(tramo.precio),
+                'asientos_disponibles': libres[tramo.viaje_id],
+            }
+            for tramo in camino
+        ],
+    }
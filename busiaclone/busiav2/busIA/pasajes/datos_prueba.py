@@ -0,0 +1,316 @@
+"""
+Generador de datos sintéticos a escala para pruebas de rendimiento
+"""
+
+import math
+import random
+import time
+from array import array
+from bisect import bisect
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from itertools import accumulate
+from typing import Any, Dict, List, Optional
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth import get_user_model
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from . import asientos, autocompletado, disponibilidad
+from .models import Pais, Region, Ciudad, Linea, Bus, Asiento, Viaje, Reserva
+
+# Escalas con nombre. Las reservas caben holgadamente en la capacidad
+# (lineas * buses_por_linea * dias * capacidad) aunque se concentren en
+# los corredores y fechas con más demanda.
+ESCALAS = {
+    'pequena': {
+        'paises': 2, 'regiones_por_pais': 3, 'ciudades': 60, 'lineas': 120,
+        'buses_por_linea': 2, 'capacidad': 40, 'dias': 30, 'usuarios': 1000, 'reservas': 10000,
+    },
+    '1m': {
+        'paises': 5, 'regiones_por_pais': 10, 'ciudades': 2000, 'lineas': 3000,
+        'buses_por_linea': 2, 'capacidad': 40, 'dias': 90, 'usuarios': 200000, 'reservas': 1000000,
+    },
+    '10m': {
+        'paises': 10, 'regiones_por_pais': 15, 'ciudades': 10000, 'lineas': 20000,
+        'buses_por_linea': 2, 'capacidad': 40, 'dias': 120, 'usuarios': 1000000, 'reservas': 10000000,
+    },
+}
+
+TAMANO_LOTE = 5000
+
+# Proporción de los días del rango que ya pasaron (viajes con historial)
+PROPORCION_PASADO = 0.3
+# Días de alta demanda (mes, día) y su peso relativo; los viernes y domingos pesan más
+FERIADOS = {(1, 1), (5, 1), (9, 18), (9, 19), (12, 24), (12, 25), (12, 31)}
+PESO_FERIADO = 4.0
+PESO_FIN_DE_SEMANA = 1.5
+# Reparto de estados de las reservas
+PROPORCION_CANCELADAS = 0.05
+PROPORCION_PENDIENTES = 0.05
+
+
+class GeneradorDatos:
+    """
+    Crea países, ciudades, líneas, buses, asientos, viajes, usuarios y
+    reservas con inserciones masivas. Con la misma semilla y fecha base
+    genera siempre los mismos datos. La demanda se concentra en los
+    corredores entre ciudades grandes (población con distribución de Zipf)
+    y en fines de semana y feriados.
+    """
+
+    def __init__(self, semilla: int = 42, fecha_base: Optional[date] = None,
+                 tamano_lote: int = TAMANO_LOTE, **parametros):
+        self.semilla = semilla
+        self.azar = random.Random(semilla)
+        self.fecha_base = fecha_base or timezone.localdate()
+        self.tamano_lote = tamano_lote
+        self.parametros = {**ESCALAS['pequena'], **parametros}
+        self.tiempos = {}
+        self.contador = {}
+
+    @classmethod
+    def desde_escala(cls, escala: str, **opciones) -> 'GeneradorDatos':
+        parametros = {**ESCALAS[escala]}
+        parametros.update({clave: valor for clave, valor in opciones.items() if valor is not None})
+        return cls(**parametros)
+
+    @property
+    def prefijo_email(self) -> str:
+        return f'datos{self.semilla}-'
+
+    def _etapa(self, nombre: str, funcion) -> None:
+        inicio = time.monotonic()
+        self.contador[nombre] = funcion()
+        self.tiempos[nombre] = round(time.monotonic() - inicio, 3)
+
+    def generar(self) -> Dict[str, Any]:
+        """
+        Genera todos los datos
+        Returns:
+            Dict: Cantidad creada y segundos de cada etapa
+        """
+        self._etapa('ciudades', self.crear_ciudades)
+        self._etapa('lineas', self.crear_lineas)
+        self._etapa('buses', self.crear_buses)
+        self._etapa('asientos', lambda: asientos.generar(self.consulta_buses, tamano_lote=self.tamano_lote)['creados'])
+        self._etapa('viajes', self.crear_viajes)
+        self._etapa('usuarios', self.crear_usuarios)
+        self._etapa('reservas', self.crear_reservas)
+        self._etapa('disponibilidad', lambda: disponibilidad.reconstruir(
+            Viaje.objects.filter(bus__in=self.consulta_buses), tamano_lote=self.tamano_lote
+        ))
+        self._etapa('indice_ciudades', lambda: autocompletado.indexar(
+            Ciudad.objects.filter(id__in=self.ciudades).values_list('id', flat=True), tamano_lote=self.tamano_lote
+        ))
+        return {'cantidades': self.contador, 'tiempos': self.tiempos}
+
+    def crear_ciudades(self) -> int:
+        p = self.parametros
+        paises = Pais.objects.bulk_create(
+            [Pais(codigo=f'X{indice:01X}' if indice < 16 else f'Y{indice - 16:01X}',
+                  nombre=f'País sintético {indice + 1}') for indice in range(p['paises'])],
+            update_conflicts=True, unique_fields=['codigo'], update_fields=['nombre'],
+        )
+        ids_paises = list(Pais.objects.filter(codigo__in=[pais.codigo for pais in paises]).values_list('id', flat=True))
+        Region.objects.bulk_create(
+            [Region(pais_id=pais_id, nombre=f'Región {indice + 1}')
+             for pais_id in ids_paises for indice in range(p['regiones_por_pais'])],
+            ignore_conflicts=True,
+        )
+        regiones = list(Region.objects.filter(pais_id__in=ids_paises).order_by('id').values_list('id', flat=True))
+
+        # Población de Zipf: la ciudad de rango r tiene ~ 5M / r habitantes
+        Ciudad.objects.bulk_create(
+            [
+                Ciudad(
+                    region_id=regiones[rango % len(regiones)],
+                    nombre=f'Ciudad {rango + 1:05d}',
+                    latitud=Decimal(self.azar.uniform(-55, 12)).quantize(Decimal('0.000001')),
+                    longitud=Decimal(self.azar.uniform(-80, -35)).quantize(Decimal('0.000001')),
+                    poblacion=int(5_000_000 / (rango + 1)),
+                )
+                for rango in range(p['ciudades'])
+            ],
+            update_conflicts=True, unique_fields=['region', 'nombre'],
+            update_fields=['latitud', 'longitud', 'poblacion'], batch_size=self.tamano_lote,
+        )
+        filas = list(Ciudad.objects.filter(region_id__in=regiones).order_by('-poblacion', 'id')
+                     .values_list('id', 'poblacion')[:p['ciudades']])
+        self.ciudades = [ciudad_id for ciudad_id, _ in filas]
+        self.poblacion = dict(filas)
+        return len(self.ciudades)
+
+    def crear_lineas(self) -> int:
+        p = self.parametros
+        pesos = list(accumulate(self.poblacion[ciudad_id] for ciudad_id in self.ciudades))
+        lineas = []
+        for indice in range(p['lineas']):
+            origen = self.ciudades[bisect(pesos, self.azar.random() * pesos[-1])]
+            destino = origen
+            while destino == origen:
+                destino = self.ciudades[bisect(pesos, self.azar.random() * pesos[-1])]
+            horas = self.azar.randint(1, 14)
+            lineas.append(Linea(
+                nombre=f'Línea sintética {self.semilla}-{indice + 1}',
+                nombre_empresa=f'Empresa {self.azar.randint(1, 25)}',
+                origen_id=origen,
+                destino_id=destino,
+                duracion=timedelta(hours=horas),
+                precio_base=Decimal(2000 + horas * 1500),
+            ))
+        creadas = Linea.objects.bulk_create(lineas, batch_size=self.tamano_lote)
+        self.rutas = {linea.id: linea for linea in creadas}
+        # Demanda de cada corredor: media geométrica de la población de sus extremos
+        self.lineas = [
+            (linea.id, math.sqrt(self.poblacion[linea.origen_id] * self.poblacion[linea.destino_id]), linea.precio_base)
+            for linea in creadas
+        ]
+        return len(self.lineas)
+
+    def crear_buses(self) -> int:
+        p = self.parametros
+        creados = Bus.objects.bulk_create(
+            [
+                Bus(linea_id=linea_id, numero=f'{numero + 1:03d}', capacidad=p['capacidad'],
+                    plantilla_asientos=self.azar.choice(['estandar', 'estandar', 'economico', 'cama']))
+                for linea_id, _, _ in self.lineas
+                for numero in range(p['buses_por_linea'])
+            ],
+            batch_size=self.tamano_lote,
+        )
+        self.buses = [bus.id for bus in creados]
+        # Los buses de una misma carga quedan con IDs consecutivos; el rango
+        # evita enviar decenas de miles de parámetros en cada filtro
+        self.consulta_buses = Bus.objects.filter(id__range=(min(self.buses), max(self.buses)))
+        self.buses_por_linea = {}
+        for bus in creados:
+            self.buses_por_linea.setdefault(bus.linea_id, []).append(bus.id)
+        return len(self.buses)
+
+    def fechas(self) -> List[date]:
+        dias = self.parametros['dias']
+        inicio = self.fecha_base - timedelta(days=int(dias * PROPORCION_PASADO))
+        return [inicio + timedelta(days=dia) for dia in range(dias)]
+
+    def crear_viajes(self) -> int:
+        """Un viaje por bus y día; la hora de salida es fija para cada bus"""
+        precios = {linea_id: precio for linea_id, _, precio in self.lineas}
+        creados = 0
+        lote = []
+        for linea_id, buses in self.buses_por_linea.items():
+            for bus_id in buses:
+                hora = self.azar.randint(6, 23)
+                for fecha in self.fechas():
+                    lote.append(Viaje(
+                        bus_id=bus_id,
+                        fecha_salida=timezone.make_aware(datetime.combine(fecha, datetime.min.time()).replace(hour=hora)),
+                        precio=precios[linea_id],
+                        estado='completado' if fecha < self.fecha_base else 'programado',
+                    ).copiar_ruta(self.rutas[linea_id]))
+                if len(lote) >= self.tamano_lote:
+                    Viaje.objects.bulk_create(lote, batch_size=self.tamano_lote)
+                    creados += len(lote)
+                    lote = []
+        Viaje.objects.bulk_create(lote, batch_size=self.tamano_lote)
+        return creados + len(lote)
+
+    def crear_usuarios(self) -> int:
+        Usuario = get_user_model()
+        # Contraseña no utilizable, calculada una vez para todos
+        clave = make_password(None)
+        self.usuarios = array('q')
+        total = self.parametros['usuarios']
+        for desde in range(0, total, self.tamano_lote):
+            creados = Usuario.objects.bulk_create([
+                Usuario(email=f'{self.prefijo_email}{indice}@busia.test', nombre=f'Usuario {indice}',
+                        password=clave, is_verified=True, email_verificado=True)
+                for indice in range(desde, min(desde + self.tamano_lote, total))
+            ])
+            self.usuarios.extend(usuario.id for usuario in creados)
+        return len(self.usuarios)
+
+    def _asientos_por_bus(self) -> Dict[int, Any]:
+        """
+        ID base de los asientos de cada bus (id = base + numero) cuando son
+        correlativos, como los crea el motor de asientos; si no, la lista de IDs
+        """
+        resultado = {}
+        irregulares = []
+        for bus_id, minimo, maximo, total in Asiento.objects.filter(bus__in=self.consulta_buses).order_by().values(
+            'bus'
+        ).annotate(minimo=Min('id'), maximo=Max('id'), total=Count('id')).values_list('bus', 'minimo', 'maximo', 'total'):
+            if maximo - minimo + 1 == total:
+                resultado[bus_id] = minimo - 1
+            else:
+                irregulares.append(bus_id)
+        for bus_id, asiento_id, numero in Asiento.objects.filter(bus_id__in=irregulares).values_list('bus', 'id', 'numero'):
+            resultado.setdefault(bus_id, {})[numero] = asiento_id
+        return resultado
+
+    def crear_reservas(self) -> int:
+        """
+        Reparte las reservas por corredor (según su demanda) y fecha (según
+        feriados y fines de semana). Cada par bus-fecha asigna sus asientos
+        en una permutación fija, lo que evita repetir asientos activos sin
+        guardar en memoria los asientos ocupados.
+        """
+        p = self.parametros
+        capacidad = p['capacidad']
+        ids_asientos = self._asientos_por_bus()
+        fechas = self.fechas()
+        pesos_fechas = list(accumulate(
+            PESO_FERIADO if (fecha.month, fecha.day) in FERIADOS
+            else PESO_FIN_DE_SEMANA if fecha.isoweekday() in (5, 7) else 1.0
+            for fecha in fechas
+        ))
+        pesos_lineas = list(accumulate(peso for _, peso, _ in self.lineas))
+        # Paso coprimo con la capacidad para recorrer todos los asientos
+        paso = next(n for n in range(7, capacidad + 8) if math.gcd(n, capacidad) == 1)
+        # El primer asiento de cada bus depende de su posición, no de su ID
+        desfases = {bus_id: indice for indice, bus_id in enumerate(self.buses)}
+        ocupados = {}
+        ahora = timezone.now()
+
+        creadas = 0
+        intentos = 0
+        lote = []
+        while creadas + len(lote) < p['reservas']:
+            intentos += 1
+            if intentos > p['reservas'] * 20:
+                break
+            linea_id, _, precio = self.lineas[bisect(pesos_lineas, self.azar.random() * pesos_lineas[-1])]
+            bus_id = self.azar.choice(self.buses_por_linea[linea_id])
+            fecha = fechas[bisect(pesos_fechas, self.azar.random() * pesos_fechas[-1])]
+
+            azar = self.azar.random()
+            if azar < PROPORCION_CANCELADAS:
+                estado = 'cancelada'
+                numero = self.azar.randint(1, capacidad)
+            else:
+                usados = ocupados.get((bus_id, fecha), 0)
+                if usados >= capacidad:
+                    continue
+                ocupados[bus_id, fecha] = usados + 1
+                numero = (desfases[bus_id] + usados * paso) % capacidad + 1
+                estado = 'pendiente' if (
+                    fecha >= self.fecha_base and azar < PROPORCION_CANCELADAS + PROPORCION_PENDIENTES
+                ) else 'confirmada'
+
+            base = ids_asientos[bus_id]
+            usuario = self.usuarios[int(self.azar.random() ** 2 * len(self.usuarios))]
+            lote.append(Reserva(
+                usuario_id=usuario,
+                asiento_id=base[numero] if isinstance(base, dict) else base + numero,
+                fecha_viaje=fecha,
+                estado=estado,
+                precio=precio,
+                expira_en=ahora + timedelta(days=1) if estado == 'pendiente' else None,
+            ))
+            if len(lote) >= self.tamano_lote:
+                Reserva.objects.bulk_create(lote)
+                creadas += len(lote)
+                lote = []
+        Reserva.objects.bulk_create(lote)
+        return creadas + len(lote)
@@ -0,0 +1,258 @@
+"""
+Mantenimiento de la disponibilidad materializada de asientos por viaje
+"""
+
+import base64
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+
+from . import busquedas
+from .models import Asiento, DisponibilidadViaje, Reserva, Viaje
+
+TAMANO_LOTE = 500
+
+# Distribución por defecto del mapa: columnas por fila y posición del pasillo
+COLUMNAS = 4
+PASILLO_DESPUES_DE = 2
+
+
+def codificar_mapa(numeros_ocupados: Iterable[int]) -> bytes:
+    """
+    Codifica los números de asiento ocupados como mapa de bits
+    (el asiento n corresponde al bit n-1, del menos significativo al más)
+    """
+    mapa = bytearray()
+    for numero in numeros_ocupados:
+        indice = numero - 1
+        byte = indice // 8
+        if byte >= len(mapa):
+            mapa.extend(b'\x00' * (byte + 1 - len(mapa)))
+        mapa[byte] |= 1 << (indice % 8)
+    return bytes(mapa)
+
+
+def asiento_ocupado(mapa: bytes, numero: int) -> bool:
+    """Indica si el asiento está marcado como ocupado en el mapa de bits"""
+    indice = numero - 1
+    byte = indice // 8
+    return byte < len(mapa) and bool(mapa[byte] & (1 << (indice % 8)))
+
+
+def mapa_compacto(asientos: List[Tuple[int, int, str]], mapa_ocupacion: bytes,
+                  columnas: int = COLUMNAS, pasillo_despues_de: int = PASILLO_DESPUES_DE) -> Dict:
+    """
+    Arma la respuesta compacta del mapa de asientos
+    Args:
+        asientos: Tuplas (id, numero, tipo) de los asientos del bus
+        mapa_ocupacion: Mapa de bits de ocupación del viaje
+        columnas, pasillo_despues_de: Distribución de la plantilla del bus
+    Returns:
+        Dict: Distribución y mapas de bits (base64) de asientos existentes,
+        ocupados y premium, indexados por número de asiento. Los IDs se
+        envían como id_base (id = id_base + numero) cuando son correlativos.
+    """
+    numeros = sorted(numero for _, numero, _ in asientos)
+    ids = {numero: asiento_id for asiento_id, numero, _ in asientos}
+    ultimo = numeros[-1] if numeros else 0
+    id_base = ids[numeros[0]] - numeros[0] if numeros else 0
+
+    distribucion = {
+        'columnas': columnas,
+        'pasillo_despues_de': pasillo_despues_de,
+        'ultimo_numero': ultimo,
+    }
+    if all(ids[numero] == id_base + numero for numero in numeros):
+        distribucion['id_base'] = id_base
+    else:
+        distribucion['ids'] = [ids.get(numero) for numero in range(1, ultimo + 1)]
+
+    def b64(mapa):
+        return base64.b64encode(mapa).decode()
+
+    return {
+        'distribucion': distribucion,
+        'existentes': b64(codificar_mapa(numeros)),
+        'ocupados': b64(bytes(mapa_ocupacion)),
+        'premium': b64(codificar_mapa(numero for _, numero, tipo in asientos if tipo == 'premium')),
+    }
+
+
+def calcular(viajes: Iterable[Tuple[int, int, date]]) -> Dict[int, DisponibilidadViaje]:
+    """
+    Calcula la disponibilidad desde Asiento y Reserva para un conjunto de viajes
+    Args:
+        viajes: Tuplas (viaje_id, bus_id, fecha del viaje)
+    Returns:
+        Dict: Disponibilidad (sin guardar) por ID de viaje
+    """
+    viajes = list(viajes)
+    buses = {bus_id for _, bus_id, _ in viajes}
+    fechas = {fecha for _, _, fecha in viajes}
+
+    totales = dict(
+        Asiento.objects.filter(bus_id__in=buses)
+        .order_by().values('bus').annotate(total=Count('id')).values_list('bus', 'total')
+    )
+    ocupados = defaultdict(set)
+    # Filtrar por los asientos (y no por asiento__bus_id) deja usar el índice
+    # (asiento, fecha_viaje, estado) en lugar de recorrer las reservas activas
+    reservas = Reserva.objects.filter(
+        asiento__in=Asiento.objects.filter(bus_id__in=buses).values('id'),
+        fecha_viaje__in=fechas,
+        estado__in=Reserva.ESTADOS_ACTIVOS
+    ).values_list('asiento__bus_id', 'fecha_viaje', 'asiento__numero')
+    for bus_id, fecha, numero in reservas:
+        ocupados[bus_id, fecha].add(numero)
+
+    resultado = {}
+    for viaje_id, bus_id, fecha in viajes:
+        numeros = ocupados.get((bus_id, fecha), set())
+        total = totales.get(bus_id, 0)
+        resultado[viaje_id] = DisponibilidadViaje(
+            viaje_id=viaje_id,
+            total_asientos=total,
+            asientos_libres=max(total - len(numeros), 0),
+            mapa_ocupacion=codificar_mapa(sorted(numeros)),
+        )
+    return resultado
+
+
+def _viajes_con_fecha(viajes):
+    return viajes.annotate(fecha=TruncDate('fecha_salida')).values_list('id', 'bus_id', 'fecha')
+
+
+def reconstruir(viajes=None, tamano_lote: int = TAMANO_LOTE) -> int:
+    """
+    Recalcula y guarda la disponibilidad de los viajes indicados (todos por defecto)
+    Returns:
+        int: Cantidad de registros escritos
+    """
+    viajes = _viajes_con_fecha(viajes if viajes is not None else Viaje.objects.all()).order_by('id')
+    escritos = 0
+    lote = []
+    for fila in viajes.iterator(chunk_size=tamano_lote):
+        lote.append(fila)
+        if len(lote) >= tamano_lote:
+            escritos += _guardar(calcular(lote).values())
+            lote = []
+    if lote:
+        escritos += _guardar(calcular(lote).values())
+    return escritos
+
+
+def _guardar(registros) -> int:
+    registros = list(registros)
+    ids = [registro.viaje_id for registro in registros]
+    DisponibilidadViaje.objects.bulk_create(
+        registros,
+        update_conflicts=True,
+        unique_fields=['viaje'],
+        update_fields=['total_asientos', 'asientos_libres', 'mapa_ocupacion', 'actualizado'],
+    )
+    DisponibilidadViaje.objects.filter(viaje_id__in=ids).update(version=F('version') + 1)
+    busquedas.invalidar_viajes(Viaje.objects.filter(id__in=ids))
+    return len(registros)
+
+
+def verificar(viajes=None, tamano_lote: int = TAMANO_LOTE) -> List[Tuple[int, Optional[DisponibilidadViaje], DisponibilidadViaje]]:
+    """
+    Compara la disponibilidad guardada con la calculada desde cero
+    Returns:
+        List: Tuplas (viaje_id, guardada o None, esperada) para cada diferencia
+    """
+    viajes = _viajes_con_fecha(viajes if viajes is not None else Viaje.objects.all()).order_by('id')
+    diferencias = []
+    lote = []
+
+    def comparar(lote):
+        esperadas = calcular(lote)
+        guardadas = DisponibilidadViaje.objects.in_bulk(esperadas.keys(), field_name='viaje_id')
+        for viaje_id, esperada in esperadas.items():
+            guardada = guardadas.get(viaje_id)
+            if guardada is None or (
+                guardada.total_asientos != esperada.total_asientos
+                or guardada.asientos_libres != esperada.asientos_libres
+                or bytes(guardada.mapa_ocupacion).rstrip(b'\x00') != esperada.mapa_ocupacion
+            ):
+                diferencias.append((viaje_id, guardada, esperada))
+
+    for fila in viajes.iterator(chunk_size=tamano_lote):
+        lote.append(fila)
+        if len(lote) >= tamano_lote:
+            comparar(lote)
+            lote = []
+    if lote:
+        comparar(lote)
+    return diferencias
+
+
+def sincronizar_asiento(asiento: Asiento, fecha: date) -> None:
+    """
+    Actualiza el bit del asiento y el conteo de libres en los viajes de su bus
+    para la fecha indicada. Debe llamarse dentro de la misma transacción que
+    modifica la reserva; las filas de disponibilidad se bloquean mientras tanto.
+    """
+    with transaction.atomic():
+        ocupado = Reserva.objects.filter(
+            asiento=asiento,
+            fecha_viaje=fecha,
+            estado__in=Reserva.ESTADOS_ACTIVOS
+        ).exists()
+        viajes = Viaje.objects.filter(bus_id=asiento.bus_id).salen_entre(fecha)
+        registros = {
+            registro.viaje_id: registro
+            for registro in DisponibilidadViaje.objects.select_for_update().filter(viaje__in=viajes)
+        }
+
+        faltantes = viajes.exclude(id__in=registros.keys())
+        if faltantes.exists():
+            reconstruir(faltantes)
+
+        for registro in registros.values():
+            # La versión cambia siempre (p. ej. al confirmar), aunque el bit no cambie
+            registro.version = F('version') + 1
+            mapa = bytearray(registro.mapa_ocupacion)
+            if asiento_ocupado(mapa, asiento.numero) != ocupado:
+                indice = asiento.numero - 1
+                if indice // 8 >= len(mapa):
+                    mapa.extend(b'\x00' * (indice // 8 + 1 - len(mapa)))
+                mapa[indice // 8] ^= 1 << (indice % 8)
+                registro.mapa_ocupacion = bytes(mapa)
+                registro.asientos_libres = max(registro.asientos_libres + (-1 if ocupado else 1), 0)
+            registro.save(update_fields=['mapa_ocupacion', 'asientos_libres', 'version', 'actualizado'])
+        if registros:
+            busquedas.invalidar_viajes(viajes)
+
+
+def recalcular_buses(pares: Iterable[Tuple[int, date]]) -> int:
+    """
+    Recalcula la disponibilidad de los viajes de cada par (bus, fecha),
+    bloqueando sus filas para no pisar actualizaciones concurrentes
+    """
+    pares = set(pares)
+    if not pares:
+        return 0
+    candidatos = Viaje.objects.filter(
+        bus_id__in={bus_id for bus_id, _ in pares}
+    ).salen_en(fecha for _, fecha in pares)
+    ids = [
+        viaje_id for viaje_id, bus_id, fecha in _viajes_con_fecha(candidatos)
+        if (bus_id, fecha) in pares
+    ]
+    with transaction.atomic():
+        list(DisponibilidadViaje.objects.select_for_update().filter(viaje_id__in=ids).values_list('id'))
+        return reconstruir(Viaje.objects.filter(id__in=ids))
+
+
+def obtener(viaje: Viaje) -> DisponibilidadViaje:
+    """Devuelve la disponibilidad del viaje, calculándola si aún no existe"""
+    try:
+        return DisponibilidadViaje.objects.get(viaje=viaje)
+    except DisponibilidadViaje.DoesNotExist:
+        reconstruir(Viaje.objects.filter(id=viaje.id))
+        return DisponibilidadViaje.objects.get(viaje=viaje)
@@ -0,0 +1,108 @@
+"""
+Materialización de los horarios recurrentes en viajes
+"""
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from . import conexiones, disponibilidad
+from .models import Horario, Viaje
+
+TAMANO_LOTE = 500
+HORIZONTE_DIAS = 90
+
+
+def precio(horario: Horario, fecha: date, precio_base: Decimal) -> Decimal:
+    """Precio del viaje según las reglas del horario para la fecha indicada"""
+    valor = horario.precio if horario.precio is not None else precio_base
+    if fecha.isoweekday() >= 6 and horario.recargo_fin_de_semana:
+        valor = valor * (1 + horario.recargo_fin_de_semana / 100)
+    return valor.quantize(Decimal('0.01'))
+
+
+def viajes_del_horario(horario: Horario, desde: date, hasta: date, precio_base: Decimal) -> List[Viaje]:
+    """Viajes (sin guardar, con la ruta de la línea copiada) del horario entre dos fechas, ambas inclusive"""
+    dias = {int(dia) for dia in horario.dias_semana}
+    viajes = []
+    fecha = desde
+    while fecha <= hasta:
+        if fecha.isoweekday() in dias:
+            viajes.append(Viaje(
+                bus_id=horario.bus_id,
+                horario_id=horario.id,
+                fecha_salida=timezone.make_aware(datetime.combine(fecha, horario.hora_salida)),
+                precio=precio(horario, fecha, precio_base),
+            ).copiar_ruta(horario.bus.linea))
+        fecha += timedelta(days=1)
+    return viajes
+
+
+def generar(dias: int = HORIZONTE_DIAS, horarios=None, hoy: Optional[date] = None,
+            completo: bool = False, tamano_lote: int = TAMANO_LOTE) -> Dict[str, int]:
+    """
+    Genera los viajes de los horarios activos hasta hoy + dias - 1. Cada
+    horario continúa desde el día siguiente a generado_hasta, así que una
+    ejecución diaria solo escribe el día nuevo del horizonte. Los viajes se
+    insertan con bulk_create ignorando los que ya existen (mismo bus y
+    salida), por lo que repetir una ejecución no duplica nada.
+    Args:
+        horarios: QuerySet o IDs de horarios (todos los activos por defecto)
+        completo: Vuelve a recorrer el horizonte desde hoy, p. ej. tras
+            agregar días de la semana a un horario
+    Returns:
+        Dict: Horarios procesados y viajes creados
+    """
+    hoy = hoy or timezone.localdate()
+    limite = hoy + timedelta(days=dias - 1)
+
+    consulta = Horario.objects.filter(activo=True, vigente_desde__lte=limite).filter(
+        Q(vigente_hasta__isnull=True) | Q(vigente_hasta__gte=hoy)
+    )
+    if not completo:
+        consulta = consulta.filter(Q(generado_hasta__isnull=True) | Q(generado_hasta__lt=limite))
+    if horarios is not None:
+        consulta = consulta.filter(id__in=horarios if isinstance(horarios, QuerySet) else list(horarios))
+    consulta = consulta.select_related('bus__linea').order_by('id')
+
+    totales = {'horarios': 0, 'viajes': 0}
+    lote = []
+    for horario in consulta.iterator(chunk_size=tamano_lote):
+        lote.append(horario)
+        if len(lote) >= tamano_lote:
+            totales['viajes'] += _generar_lote(lote, hoy, limite, completo)
+            totales['horarios'] += len(lote)
+            lote = []
+    if lote:
+        totales['viajes'] += _generar_lote(lote, hoy, limite, completo)
+        totales['horarios'] += len(lote)
+    return totales
+
+
+def _generar_lote(horarios: List[Horario], hoy: date, limite: date, completo: bool) -> int:
+    viajes = []
+    for horario in horarios:
+        desde = max(hoy, horario.vigente_desde)
+        if horario.generado_hasta and not completo:
+            desde = max(desde, horario.generado_hasta + timedelta(days=1))
+        hasta = min(limite, horario.vigente_hasta or limite)
+        # La ruta y el precio base salen de la misma línea: la del bus
+        viajes.extend(viajes_del_horario(horario, desde, hasta, horario.bus.linea.precio_base))
+        horario.generado_hasta = max(hasta, horario.generado_hasta or hasta)
+
+    ids = [horario.id for horario in horarios]
+    with transaction.atomic():
+        antes = Viaje.objects.filter(horario_id__in=ids).count()
+        Viaje.objects.bulk_create(viajes, batch_size=TAMANO_LOTE, ignore_conflicts=True)
+        creados = Viaje.objects.filter(horario_id__in=ids).count() - antes
+        Horario.objects.bulk_update(horarios, ['generado_hasta'], batch_size=TAMANO_LOTE)
+        if creados:
+            # Los viajes nuevos nacen con su disponibilidad materializada
+            disponibilidad.reconstruir(Viaje.objects.filter(horario_id__in=ids, disponibilidad__isnull=True))
+            # bulk_create no emite señales: el grafo de conexiones se recarga
+            transaction.on_commit(conexiones.descartar)
+    return creados
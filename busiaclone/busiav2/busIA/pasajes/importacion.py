@@ -0,0 +1,479 @@
+"""
+Importación masiva y concurrente de países, regiones y ciudades desde APIs externas
+"""
+
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import autocompletado, busquedas
+from .models import Pais, Region, Ciudad, PuntoControlPais, SincronizacionUbicaciones
+
+logger = logging.getLogger(__name__)
+
+URL_PAISES = 'https://restcountries.com/v3.1/all'
+URL_CIUDADES = 'https://wft-geo-db.p.rapidapi.com/v1/geo/cities'
+HOST_CIUDADES = 'wft-geo-db.p.rapidapi.com'
+
+# Precisión de las coordenadas guardadas (Ciudad.latitud/longitud)
+PRECISION_COORDENADAS = Decimal('0.000001')
+
+# Respuestas que se reintentan: límite de tasa y errores transitorios del servidor
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+
+class LimiteTasa:
+    """Espacia las solicitudes para no superar una cantidad por segundo entre todos los hilos"""
+
+    def __init__(self, por_segundo: Optional[float]):
+        self.intervalo = 1.0 / por_segundo if por_segundo else 0.0
+        self._siguiente = 0.0
+        self._lock = threading.Lock()
+
+    def esperar(self) -> None:
+        if not self.intervalo:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self._siguiente)
+            self._siguiente = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+
+def _coordenada(valor) -> Optional[Decimal]:
+    return None if valor is None else Decimal(str(valor)).quantize(PRECISION_COORDENADAS)
+
+
+def normalizar_ciudades(ciudades: List[Dict[str, Any]]) -> Dict[Tuple[str, str], Tuple]:
+    """
+    Deja las ciudades de la API como (region, nombre) -> (latitud, longitud, poblacion),
+    con las coordenadas en la precisión de la base de datos. Si una ciudad
+    viene repetida gana la última.
+    """
+    return {
+        (ciudad['region'], ciudad['nombre']): (
+            _coordenada(ciudad['latitud']), _coordenada(ciudad['longitud']), ciudad['poblacion']
+        )
+        for ciudad in ciudades
+    }
+
+
+def hash_ciudades(filas: Dict[Tuple[str, str], Tuple]) -> str:
+    """Hash del contenido normalizado, independiente del orden de la respuesta"""
+    contenido = json.dumps(
+        sorted([region, nombre, *[None if v is None else str(v) for v in valores]]
+               for (region, nombre), valores in filas.items()),
+        ensure_ascii=False, separators=(',', ':'),
+    )
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+
+class ImportadorUbicaciones:
+    """
+    Descarga las ciudades de cada país en paralelo (un pool acotado de hilos
+    que comparten una sesión HTTP con conexiones reutilizables) y las guarda
+    con upserts masivos por lotes. Las escrituras se hacen desde el hilo
+    principal a medida que llegan las respuestas.
+    """
+
+    def __init__(self, url_paises: str = URL_PAISES, url_ciudades: str = URL_CIUDADES,
+                 api_key: Optional[str] = None, hilos: int = 8, reintentos: int = 5,
+                 espera_base: float = 1.0, max_por_segundo: Optional[float] = None,
+                 tamano_lote: int = 1000, timeout: float = 30):
+        self.url_paises = url_paises
+        self.url_ciudades = url_ciudades
+        self.api_key = api_key if api_key is not None else getattr(settings, 'GEODB_API_KEY', '')
+        self.hilos = hilos
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.tamano_lote = tamano_lote
+        self.timeout = timeout
+        self.limite = LimiteTasa(max_por_segundo)
+        self._tiempos_lock = threading.Lock()
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=hilos, pool_maxsize=hilos)
+        self.sesion.mount('http://', adaptador)
+        self.sesion.mount('https://', adaptador)
+
+    def _espera(self, respuesta: Optional[requests.Response], intento: int) -> float:
+        """Usa Retry-After si el servidor lo informa; si no, espera exponencial con variación"""
+        if respuesta is not None and respuesta.headers.get('Retry-After'):
+            valor = respuesta.headers['Retry-After']
+            try:
+                return max(float(valor), 0.0)
+            except ValueError:
+                try:
+                    return max((parsedate_to_datetime(valor) - timezone.now()).total_seconds(), 0.0)
+                except (TypeError, ValueError):
+                    pass
+        return self.espera_base * (2 ** intento) * random.uniform(0.5, 1.5)
+
+    def _get(self, url: str, **kwargs) -> Any:
+        for intento in range(self.reintentos + 1):
+            self.limite.esperar()
+            respuesta = None
+            try:
+                respuesta = self.sesion.get(url, timeout=self.timeout, **kwargs)
+                if respuesta.status_code not in ESTADOS_REINTENTABLES:
+                    respuesta.raise_for_status()
+                    return respuesta.json()
+            except (requests.ConnectionError, requests.Timeout):
+                if intento == self.reintentos:
+                    raise
+            if intento == self.reintentos:
+                respuesta.raise_for_status()
+            time.sleep(self._espera(respuesta, intento))
+
+    def obtener_paises(self) -> List[Dict[str, Any]]:
+        """
+        Obtiene la lista de países desde la API de RestCountries
+        Returns:
+            List[Dict]: Países con 'nombre' y 'codigo'
+        """
+        paises = [
+            {'nombre': pais['name']['common'], 'codigo': pais['cca2']}
+            for pais in self._get(self.url_paises)
+            if 'name' in pais and 'cca2' in pais
+        ]
+        return sorted(paises, key=lambda x: x['nombre'])
+
+    def obtener_ciudades(self, pais_codigo: str) -> List[Dict[str, Any]]:
+        """
+        Obtiene las ciudades de un país usando la API de GeoDB Cities
+        Args:
+            pais_codigo: Código ISO del país
+        Returns:
+            List[Dict]: Ciudades con nombre, región, coordenadas y población
+        """
+        headers = {
+            'X-RapidAPI-Key': self.api_key,
+            'X-RapidAPI-Host': HOST_CIUDADES,
+        }
+        params = {
+            'countryIds': pais_codigo,
+            'minPopulation': 100000,  # Solo ciudades con más de 100,000 habitantes
+            'types': 'CITY',
+            'sort': '-population',  # Ordenar por población descendente
+        }
+        return [
+            {
+                'nombre': ciudad['city'],
+                'region': ciudad['region'],
+                'latitud': ciudad['latitude'],
+                'longitud': ciudad['longitude'],
+                'poblacion': ciudad.get('population'),
+            }
+            for ciudad in self._get(self.url_ciudades, headers=headers, params=params)['data']
+        ]
+
+    def guardar_paises(self, paises: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Inserta o actualiza los países
+        Returns:
+            Dict: ID de cada país por código
+        """
+        Pais.objects.bulk_create(
+            [Pais(codigo=pais['codigo'], nombre=pais['nombre']) for pais in paises],
+            update_conflicts=True,
+            unique_fields=['codigo'],
+            update_fields=['nombre'],
+            batch_size=self.tamano_lote,
+        )
+        # Los upserts masivos no emiten señales: los nombres salen en las búsquedas guardadas
+        busquedas.descartar()
+        return dict(Pais.objects.filter(
+            codigo__in=[pais['codigo'] for pais in paises]
+        ).values_list('codigo', 'id'))
+
+    def guardar_ciudades(self, pais_id: int, ciudades: List[Dict[str, Any]],
+                         regiones: Dict[Tuple[int, str], int]) -> Tuple[int, int]:
+        """
+        Inserta o actualiza las ciudades de un país en una transacción
+        Args:
+            regiones: Mapa en memoria (pais_id, nombre) -> region_id; se completa con las nuevas
+        Returns:
+            Tuple: (regiones creadas, ciudades guardadas)
+        """
+        with transaction.atomic():
+            nuevas = sorted({
+                ciudad['region'] for ciudad in ciudades
+                if (pais_id, ciudad['region']) not in regiones
+            })
+            if nuevas:
+                Region.objects.bulk_create(
+                    [Region(pais_id=pais_id, nombre=nombre) for nombre in nuevas],
+                    ignore_conflicts=True,
+                    batch_size=self.tamano_lote,
+                )
+                regiones.update(
+                    ((pais_id, nombre), region_id)
+                    for nombre, region_id in Region.objects.filter(
+                        pais_id=pais_id, nombre__in=nuevas
+                    ).values_list('nombre', 'id')
+                )
+
+            # Una misma ciudad puede venir repetida en la respuesta; gana la última
+            filas = {
+                (regiones[pais_id, ciudad['region']], ciudad['nombre']): ciudad
+                for ciudad in ciudades
+            }
+            Ciudad.objects.bulk_create(
+                [
+                    Ciudad(
+                        region_id=region_id,
+                        nombre=nombre,
+                        latitud=ciudad['latitud'],
+                        longitud=ciudad['longitud'],
+                        poblacion=ciudad['poblacion'],
+                    )
+                    for (region_id, nombre), ciudad in filas.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['region', 'nombre'],
+                update_fields=['latitud', 'longitud', 'poblacion'],
+                batch_size=self.tamano_lote,
+            )
+            busquedas.descartar()
+        return len(nuevas), len(filas)
+
+    def importar(self, codigos: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Importa países y ciudades
+        Args:
+            codigos: Limita la descarga de ciudades a estos países
+        Returns:
+            Dict: Contadores de países, regiones y ciudades, y países con error
+        """
+        contador = {'paises': 0, 'regiones': 0, 'ciudades': 0, 'errores': []}
+
+        paises = self.obtener_paises()
+        ids_paises = self.guardar_paises(paises)
+        contador['paises'] = len(ids_paises)
+        if codigos is not None:
+            codigos = set(codigos)
+            ids_paises = {codigo: pais_id for codigo, pais_id in ids_paises.items() if codigo in codigos}
+
+        regiones = {
+            (pais_id, nombre): region_id
+            for region_id, pais_id, nombre in Region.objects.filter(
+                pais_id__in=ids_paises.values()
+            ).values_list('id', 'pais_id', 'nombre')
+        }
+
+        with ThreadPoolExecutor(max_workers=self.hilos) as pool:
+            futuros = {pool.submit(self.obtener_ciudades, codigo): codigo for codigo in ids_paises}
+            for futuro in as_completed(futuros):
+                codigo = futuros[futuro]
+                try:
+                    creadas, guardadas = self.guardar_ciudades(ids_paises[codigo], futuro.result(), regiones)
+                except Exception as e:
+                    logger.error(f"Error al importar ciudades de {codigo}: {str(e)}")
+                    contador['errores'].append(codigo)
+                    continue
+                contador['regiones'] += creadas
+                contador['ciudades'] += guardadas
+
+        # Los upserts masivos no emiten señales: el índice de autocompletado se actualiza aquí
+        autocompletado.indexar(
+            Ciudad.objects.filter(region__pais_id__in=ids_paises.values()).values_list('id', flat=True)
+        )
+        autocompletado.invalidar_cache()
+        return contador
+
+    def aplicar_diferencias(self, pais_id: int, filas: Dict[Tuple[str, str], Tuple],
+                            regiones: Dict[Tuple[int, str], int]) -> Dict[str, int]:
+        """
+        Escribe solo lo que cambió respecto de la base de datos: inserta las
+        ciudades nuevas, actualiza las modificadas (o reactivadas) y desactiva
+        las que ya no vienen en la API. Debe llamarse dentro de una transacción.
+        Returns:
+            Dict: Cantidad de ciudades insertadas, actualizadas y desactivadas
+        """
+        nuevas = sorted({region for region, _ in filas if (pais_id, region) not in regiones})
+        if nuevas:
+            Region.objects.bulk_create(
+                [Region(pais_id=pais_id, nombre=nombre) for nombre in nuevas],
+                ignore_conflicts=True,
+                batch_size=self.tamano_lote,
+            )
+            regiones.update(
+                ((pais_id, nombre), region_id)
+                for nombre, region_id in Region.objects.filter(
+                    pais_id=pais_id, nombre__in=nuevas
+                ).values_list('nombre', 'id')
+            )
+
+        existentes = {
+            (region, nombre): (ciudad_id, (latitud, longitud, poblacion), activa)
+            for ciudad_id, region, nombre, latitud, longitud, poblacion, activa
+            in Ciudad.objects.filter(region__pais_id=pais_id).values_list(
+                'id', 'region__nombre', 'nombre', 'latitud', 'longitud', 'poblacion', 'activa'
+            )
+        }
+
+        insertar = []
+        actualizar = []
+        for clave, valores in filas.items():
+            latitud, longitud, poblacion = valores
+            existente = existentes.get(clave)
+            if existente is None:
+                insertar.append(Ciudad(
+                    region_id=regiones[pais_id, clave[0]], nombre=clave[1],
+                    latitud=latitud, longitud=longitud, poblacion=poblacion,
+                ))
+            elif existente[1] != valores or not existente[2]:
+                actualizar.append(Ciudad(
+                    id=existente[0], latitud=latitud, longitud=longitud,
+                    poblacion=poblacion, activa=True,
+                ))
+        desactivar = [
+            ciudad_id for clave, (ciudad_id, _, activa) in existentes.items()
+            if activa and clave not in filas
+        ]
+
+        Ciudad.objects.bulk_create(insertar, batch_size=self.tamano_lote)
+        Ciudad.objects.bulk_update(
+            actualizar, ['latitud', 'longitud', 'poblacion', 'activa'], batch_size=self.tamano_lote
+        )
+        for i in range(0, len(desactivar), self.tamano_lote):
+            Ciudad.objects.filter(id__in=desactivar[i:i + self.tamano_lote]).update(activa=False)
+        if insertar or actualizar or desactivar:
+            busquedas.descartar()
+        return {'insertadas': len(insertar), 'actualizadas': len(actualizar), 'desactivadas': len(desactivar)}
+
+    def _descargar(self, codigo: str, tiempos: Dict[str, float]) -> List[Dict[str, Any]]:
+        inicio = time.monotonic()
+        try:
+            return self.obtener_ciudades(codigo)
+        finally:
+            with self._tiempos_lock:
+                tiempos['descarga'] += time.monotonic() - inicio
+
+    def sincronizar(self, codigos: Optional[Iterable[str]] = None, reanudar: bool = False,
+                    forzar: bool = False) -> SincronizacionUbicaciones:
+        """
+        Sincroniza las ciudades de forma incremental. Cada país se confirma en
+        su propia transacción junto con su punto de control, así que una
+        interrupción solo pierde los países en curso y los bloqueos duran lo
+        que tarda un país. Los países cuyo contenido no cambió (mismo hash)
+        no se escriben.
+        Args:
+            codigos: Limita la sincronización a estos países
+            reanudar: Retoma la última ejecución sin terminar, saltando los
+                países que ya tienen punto de control en ella
+            forzar: Aplica las diferencias aunque el hash no haya cambiado
+        Returns:
+            SincronizacionUbicaciones: Ejecución con su resumen y tiempos por etapa
+        """
+        inicio_total = time.monotonic()
+        sincronizacion = None
+        if reanudar:
+            sincronizacion = SincronizacionUbicaciones.objects.filter(finalizada__isnull=True).first()
+        if sincronizacion is None:
+            sincronizacion = SincronizacionUbicaciones.objects.create()
+
+        # Al reanudar se acumulan los tiempos y contadores de la parte ya hecha
+        tiempos = defaultdict(float, sincronizacion.tiempos)
+        resumen = {'paises': 0, 'reanudados': 0, 'errores': []}
+        resumen.update({
+            clave: sincronizacion.resumen.get(clave, 0)
+            for clave in ('sin_cambios', 'insertadas', 'actualizadas', 'desactivadas')
+        })
+
+        inicio = time.monotonic()
+        ids_paises = self.guardar_paises(self.obtener_paises())
+        tiempos['paises'] += time.monotonic() - inicio
+        if codigos is not None:
+            codigos = set(codigos)
+            ids_paises = {codigo: pais_id for codigo, pais_id in ids_paises.items() if codigo in codigos}
+        resumen['paises'] = len(ids_paises)
+
+        puntos = {
+            punto.pais_id: punto
+            for punto in PuntoControlPais.objects.filter(pais_id__in=ids_paises.values())
+        }
+        if reanudar:
+            hechos = {pais_id for pais_id, punto in puntos.items() if punto.sincronizacion_id == sincronizacion.id}
+            pendientes = {codigo: pais_id for codigo, pais_id in ids_paises.items() if pais_id not in hechos}
+            resumen['reanudados'] = len(ids_paises) - len(pendientes)
+            ids_paises = pendientes
+
+        regiones = {
+            (pais_id, nombre): region_id
+            for region_id, pais_id, nombre in Region.objects.filter(
+                pais_id__in=ids_paises.values()
+            ).values_list('id', 'pais_id', 'nombre')
+        }
+        modificados = []
+
+        with ThreadPoolExecutor(max_workers=self.hilos) as pool:
+            futuros = {pool.submit(self._descargar, codigo, tiempos): codigo for codigo in ids_paises}
+            for futuro in as_completed(futuros):
+                codigo = futuros[futuro]
+                pais_id = ids_paises[codigo]
+                try:
+                    inicio = time.monotonic()
+                    filas = normalizar_ciudades(futuro.result())
+                    hash_contenido = hash_ciudades(filas)
+                    punto = puntos.get(pais_id)
+                    sin_cambios = not forzar and punto is not None and punto.hash_contenido == hash_contenido
+                    tiempos['comparacion'] += time.monotonic() - inicio
+
+                    inicio = time.monotonic()
+                    with transaction.atomic():
+                        if not sin_cambios:
+                            cambios = self.aplicar_diferencias(pais_id, filas, regiones)
+                        PuntoControlPais.objects.update_or_create(
+                            pais_id=pais_id,
+                            defaults={
+                                'sincronizacion': sincronizacion,
+                                'hash_contenido': hash_contenido,
+                                'ciudades': len(filas),
+                            },
+                        )
+                    tiempos['escritura'] += time.monotonic() - inicio
+                except Exception as e:
+                    logger.error(f"Error al sincronizar ciudades de {codigo}: {str(e)}")
+                    resumen['errores'].append(codigo)
+                    continue
+
+                if sin_cambios:
+                    resumen['sin_cambios'] += 1
+                    continue
+                for clave, cantidad in cambios.items():
+                    resumen[clave] += cantidad
+                if any(cambios.values()):
+                    modificados.append(pais_id)
+
+        inicio = time.monotonic()
+        if modificados:
+            # Los cambios masivos no emiten señales: el índice se actualiza aquí
+            autocompletado.indexar(
+                Ciudad.objects.filter(region__pais_id__in=modificados).values_list('id', flat=True)
+            )
+            autocompletado.invalidar_cache()
+        tiempos['indexacion'] += time.monotonic() - inicio
+        tiempos['total'] += time.monotonic() - inicio_total
+
+        sincronizacion.tiempos = {etapa: round(segundos, 3) for etapa, segundos in tiempos.items()}
+        sincronizacion.resumen = resumen
+        # Con errores queda abierta para que --resume reintente los países que fallaron
+        if not resumen['errores']:
+            sincronizacion.finalizada = timezone.now()
+        sincronizacion.save()
+        return sincronizacion
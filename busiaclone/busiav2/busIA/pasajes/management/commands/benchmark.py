@@ -0,0 +1,275 @@
+"""
+Comando para medir el rendimiento de operaciones masivas sobre datos sintéticos
+"""
+
+import json
+import random
+import time
+from datetime import datetime, time as hora, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from pasajes import asientos, conexiones, horarios
+from pasajes.rendimiento import EmbudoCompra, percentil
+from pasajes.models import Pais, Region, Ciudad, Linea, Bus, Asiento, Horario, Viaje
+
+
+class Command(BaseCommand):
+    help = 'Mide escenarios de rendimiento; los datos creados se descartan al terminar'
+
+    ESCENARIOS = ['asientos', 'horarios', 'embudo', 'conexiones']
+
+    def add_arguments(self, parser):
+        parser.add_argument('escenario', choices=self.ESCENARIOS, help='Escenario a medir')
+        parser.add_argument('--buses', type=int, default=10000,
+                            help='Buses a generar en el escenario de asientos')
+        parser.add_argument('--capacidad', type=int, default=40,
+                            help='Capacidad de cada bus')
+        parser.add_argument('--muestra-anterior', type=int, default=100,
+                            help='Buses medidos con el método anterior (get_or_create por asiento); 0 lo omite')
+        parser.add_argument('--lineas', type=int, default=2000,
+                            help='Líneas con horario en el escenario de horarios')
+        parser.add_argument('--dias', type=int, default=horarios.HORIZONTE_DIAS,
+                            help='Horizonte de días en el escenario de horarios')
+        parser.add_argument('--ciudades', type=int, default=5000,
+                            help='Ciudades de la red en el escenario de conexiones')
+        parser.add_argument('--centros', type=int, default=50,
+                            help='Ciudades que hacen de centro de conexión en el escenario de conexiones')
+        parser.add_argument('--salidas', type=int, default=4,
+                            help='Salidas diarias por línea en el escenario de conexiones')
+        parser.add_argument('--busquedas', type=int, default=200,
+                            help='Búsquedas medidas en el escenario de conexiones')
+        parser.add_argument('--usuarios-virtuales', type=int, default=8,
+                            help='Usuarios concurrentes en el escenario del embudo')
+        parser.add_argument('--iteraciones', type=int, default=20,
+                            help='Recorridos del embudo por usuario virtual')
+        parser.add_argument('--url', default=None,
+                            help='URL de un servidor local para el embudo (por defecto, cliente de pruebas de Django)')
+        parser.add_argument('--conservar', action='store_true',
+                            help='No elimina las reservas creadas por el embudo')
+        parser.add_argument('--salida', default=None,
+                            help='Archivo donde guardar los resultados en JSON')
+        parser.add_argument('--json', action='store_true',
+                            help='Imprime los resultados como JSON')
+
+    def handle(self, *args, **options):
+        if options['escenario'] == 'embudo':
+            # Usa varias conexiones (o un servidor aparte): los datos deben estar confirmados
+            resultados = self.escenario_embudo(**options)
+        else:
+            with transaction.atomic():
+                resultados = getattr(self, f'escenario_{options["escenario"]}')(**options)
+                transaction.set_rollback(True)
+
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                json.dump(resultados, archivo, indent=2)
+            self.stdout.write(f'Resultados guardados en {options["salida"]}')
+        if options['json']:
+            self.stdout.write(json.dumps(resultados, indent=2))
+            return
+        for nombre, valor in resultados.items():
+            if isinstance(valor, dict):
+                self.stdout.write(f'{nombre}:')
+                for clave, detalle in valor.items():
+                    self.stdout.write(f'  {clave}: {detalle}')
+            else:
+                self.stdout.write(f'{nombre}: {valor}')
+
+    def medir(self, funcion):
+        """Ejecuta la función y devuelve (resultado, segundos, consultas)"""
+        consultas = 0
+
+        def contar(execute, sql, params, many, context):
+            nonlocal consultas
+            consultas += 1
+            return execute(sql, params, many, context)
+
+        # Un execute_wrapper cuenta sin guardar ni registrar cada sentencia
+        with connection.execute_wrapper(contar):
+            inicio = time.perf_counter()
+            resultado = funcion()
+            segundos = time.perf_counter() - inicio
+        return resultado, round(segundos, 3), consultas
+
+    def linea_sintetica(self):
+        pais, _ = Pais.objects.get_or_create(codigo='ZZ', defaults={'nombre': 'Benchmark'})
+        region, _ = Region.objects.get_or_create(pais=pais, nombre='Benchmark')
+        origen, _ = Ciudad.objects.get_or_create(region=region, nombre='Origen benchmark')
+        destino, _ = Ciudad.objects.get_or_create(region=region, nombre='Destino benchmark')
+        return Linea.objects.create(
+            nombre='Benchmark', nombre_empresa='Benchmark', origen=origen, destino=destino,
+            duracion=timedelta(hours=1), precio_base=Decimal('1000.00'),
+        )
+
+    def crear_buses(self, linea, cantidad, capacidad, prefijo):
+        # bulk_create no emite post_save: los buses quedan sin asientos
+        return [bus.id for bus in Bus.objects.bulk_create(
+            [Bus(linea=linea, numero=f'{prefijo}{i:06d}', capacidad=capacidad) for i in range(cantidad)],
+            batch_size=1000,
+        )]
+
+    def escenario_asientos(self, buses, capacidad, muestra_anterior, **kwargs):
+        linea = self.linea_sintetica()
+        ids = self.crear_buses(linea, buses, capacidad, 'B')
+
+        resultado, segundos, consultas = self.medir(lambda: asientos.generar(ids))
+        _, segundos_sin_cambios, consultas_sin_cambios = self.medir(lambda: asientos.generar(ids))
+        resultados = {
+            'buses': buses,
+            'asientos_creados': resultado['creados'],
+            'segundos': segundos,
+            'consultas': consultas,
+            'asientos_por_segundo': round(resultado['creados'] / segundos) if segundos else None,
+            'segundos_sin_cambios': segundos_sin_cambios,
+            'consultas_sin_cambios': consultas_sin_cambios,
+        }
+
+        if muestra_anterior:
+            muestra = self.crear_buses(linea, muestra_anterior, capacidad, 'A')
+
+            def anterior():
+                for bus in Bus.objects.filter(id__in=muestra):
+                    for numero, tipo in asientos.disenar(capacidad, 'estandar').items():
+                        Asiento.objects.get_or_create(bus=bus, numero=numero, defaults={'tipo': tipo})
+
+            _, segundos_anterior, consultas_anterior = self.medir(anterior)
+            factor = buses / muestra_anterior
+            resultados.update({
+                'anterior_buses_medidos': muestra_anterior,
+                'anterior_segundos_estimados': round(segundos_anterior * factor, 3),
+                'anterior_consultas_estimadas': round(consultas_anterior * factor),
+            })
+        return resultados
+
+    def escenario_horarios(self, lineas, dias, **kwargs):
+        base = self.linea_sintetica()
+        nuevas = Linea.objects.bulk_create([
+            Linea(nombre=f'Benchmark {i}', nombre_empresa='Benchmark', origen_id=base.origen_id,
+                  destino_id=base.destino_id, duracion=base.duracion, precio_base=base.precio_base)
+            for i in range(lineas)
+        ], batch_size=1000)
+        # Un bus por hora de salida: un bus hace un solo viaje por día
+        horas = [hora(7), hora(12), hora(17), hora(22)]
+        buses = Bus.objects.bulk_create([
+            Bus(linea=linea, numero=f'H{i}', capacidad=40) for linea in nuevas for i in range(len(horas))
+        ], batch_size=1000)
+        hoy = timezone.localdate()
+        ids = [horario.id for horario in Horario.objects.bulk_create([
+            Horario(bus=bus, hora_salida=horas[i % len(horas)],
+                    recargo_fin_de_semana=10, vigente_desde=hoy)
+            for i, bus in enumerate(buses)
+        ], batch_size=1000)]
+
+        inicial, segundos, consultas = self.medir(lambda: horarios.generar(dias=dias, horarios=ids, hoy=hoy))
+        siguiente, segundos_siguiente, consultas_siguiente = self.medir(
+            lambda: horarios.generar(dias=dias, horarios=ids, hoy=hoy + timedelta(days=1))
+        )
+        return {
+            'horarios': len(ids),
+            'dias': dias,
+            'viajes_iniciales': inicial['viajes'],
+            'segundos': segundos,
+            'consultas': consultas,
+            'viajes_por_segundo': round(inicial['viajes'] / segundos) if segundos else None,
+            'viajes_dia_siguiente': siguiente['viajes'],
+            'segundos_dia_siguiente': segundos_siguiente,
+            'consultas_dia_siguiente': consultas_siguiente,
+        }
+
+    def escenario_conexiones(self, ciudades, centros, salidas, busquedas, **kwargs):
+        """
+        Red de ciudades en estrella: cada ciudad tiene ida y vuelta a dos
+        centros, los centros se conectan entre sí y algunas ciudades tienen
+        líneas directas. Mide la carga del grafo del día, las búsquedas entre
+        pares al azar y las actualizaciones incrementales.
+        """
+        azar = random.Random(42)
+        pais, _ = Pais.objects.get_or_create(codigo='ZZ', defaults={'nombre': 'Benchmark'})
+        region, _ = Region.objects.get_or_create(pais=pais, nombre='Benchmark')
+        # bulk_create no emite post_save: las ciudades no se indexan
+        ids = [ciudad.id for ciudad in Ciudad.objects.bulk_create(
+            [Ciudad(region=region, nombre=f'Conexiones {i:05d}') for i in range(ciudades)], batch_size=1000
+        )]
+        hubs, resto = ids[:centros], ids[centros:]
+        pares = {(a, b) for a in hubs for b in hubs if a != b}
+        for ciudad_id in resto:
+            for hub in azar.sample(hubs, 2):
+                pares.update({(ciudad_id, hub), (hub, ciudad_id)})
+        for _ in range(len(resto) // 2):
+            pares.add(tuple(azar.sample(resto, 2)))
+
+        lineas = Linea.objects.bulk_create([
+            Linea(nombre=f'Conexiones {origen}-{destino}', nombre_empresa=f'Empresa {azar.randint(1, 25)}',
+                  origen_id=origen, destino_id=destino, duracion=timedelta(minutes=azar.randint(45, 360)),
+                  precio_base=Decimal(azar.randint(2, 30) * 500))
+            for origen, destino in sorted(pares)
+        ], batch_size=1000)
+        # Un bus por salida: un bus hace un solo viaje por día
+        buses = Bus.objects.bulk_create([
+            Bus(linea=linea, numero=f'C{i}', capacidad=4, plantilla_asientos='economico')
+            for linea in lineas for i in range(salidas)
+        ], batch_size=1000)
+        # Sin asientos los viajes figurarían llenos
+        asientos.generar([bus.id for bus in buses])
+
+        fecha = timezone.localdate() + timedelta(days=1)
+        viajes = []
+        for indice, linea in enumerate(lineas):
+            minutos = sorted(azar.sample(range(5 * 60, 23 * 60), salidas))
+            for bus, minuto in zip(buses[indice * salidas:(indice + 1) * salidas], minutos):
+                salida = timezone.make_aware(datetime.combine(fecha, hora(minuto // 60, minuto % 60)))
+                viajes.append(Viaje(bus=bus, fecha_salida=salida, precio=linea.precio_base).copiar_ruta(linea))
+        Viaje.objects.bulk_create(viajes, batch_size=1000)
+
+        conexiones.reiniciar()
+        grafo = conexiones.obtener_grafo()
+        _, segundos_carga, consultas_carga = self.medir(
+            lambda: (grafo.dia(fecha), grafo.dia(fecha + timedelta(days=1)))
+        )
+
+        # Dos ciudades que no comparten centro necesitan tres tramos
+        tiempos, encontrados, consultas = [], 0, 0
+        for _ in range(busquedas):
+            origen, destino = azar.sample(resto, 2)
+            inicio = time.perf_counter()
+            resultado, _, consultas_busqueda = self.medir(lambda: conexiones.buscar(
+                origen, destino, fecha, orden=azar.choice(conexiones.ORDENES), tramos_maximos=3
+            ))
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            encontrados += bool(resultado)
+            consultas += consultas_busqueda
+        tiempos.sort()
+
+        muestra = azar.sample(viajes, min(1000, len(viajes)))
+        inicio = time.perf_counter()
+        grafo.actualizar(muestra)
+        segundos_actualizacion = time.perf_counter() - inicio
+        return {
+            'ciudades': ciudades,
+            'lineas': len(lineas),
+            'viajes_del_dia': len(viajes),
+            'segundos_carga_grafo': segundos_carga,
+            'consultas_carga_grafo': consultas_carga,
+            'busquedas': busquedas,
+            'busquedas_con_resultados': encontrados,
+            'p50_ms': round(percentil(tiempos, 50), 2),
+            'p95_ms': round(percentil(tiempos, 95), 2),
+            'p99_ms': round(percentil(tiempos, 99), 2),
+            'consultas_por_busqueda': round(consultas / busquedas, 1),
+            'microsegundos_por_actualizacion': round(segundos_actualizacion / len(muestra) * 1e6, 1),
+        }
+
+    def escenario_embudo(self, usuarios_virtuales, iteraciones, url, conservar, **kwargs):
+        embudo = EmbudoCompra(usuarios_virtuales=usuarios_virtuales, iteraciones=iteraciones, url_base=url)
+        try:
+            resultados = embudo.ejecutar()
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if not conservar:
+                embudo.limpiar()
+        return resultados
@@ -8,18 +8,79 @@ from pasajes.services import UbicacionService
 class Command(BaseCommand):
     help = 'Carga países, regiones y ciudades desde APIs externas'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=8,
+                            help='Solicitudes de ciudades en paralelo')
+        parser.add_argument('--lote', type=int, default=1000,
+                            help='Filas por sentencia en los upserts masivos')
+        parser.add_argument('--max-por-segundo', type=float, default=None,
+                            help='Límite de solicitudes por segundo a la API de ciudades')
+        parser.add_argument('--pais', action='append', dest='paises', default=None,
+                            help='Código ISO de un país a importar (se puede repetir)')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Escribe solo las diferencias y guarda un punto de control por país')
+        parser.add_argument('--resume', '--reanudar', action='store_true', dest='reanudar',
+                            help='Retoma la última sincronización incremental interrumpida')
+        parser.add_argument('--forzar', action='store_true',
+                            help='En modo incremental, compara también los países sin cambios de hash')
+
     def handle(self, *args, **kwargs):
+        if kwargs['incremental'] or kwargs['reanudar']:
+            return self.sincronizar(**kwargs)
+
         self.stdout.write('Iniciando carga de ubicaciones...')
         
         try:
-            contador = UbicacionService.actualizar_ubicaciones()
+            contador = UbicacionService.actualizar_ubicaciones(
+                hilos=kwargs['hilos'],
+                tamano_lote=kwargs['lote'],
+                max_por_segundo=kwargs['max_por_segundo'],
+                codigos=kwargs['paises'],
+            )
             
             self.stdout.write(self.style.SUCCESS(
                 f'Carga completada exitosamente:\n'
                 f'- Países creados/actualizados: {contador["paises"]}\n'
-                f'- Regiones creadas/actualizadas: {contador["regiones"]}\n'
+                f'- Regiones creadas: {contador["regiones"]}\n'
                 f'- Ciudades creadas/actualizadas: {contador["ciudades"]}'
             ))
+            if contador['errores']:
+                self.stdout.write(self.style.WARNING(
+                    f'Países con error: {", ".join(sorted(contador["errores"]))}'
+                ))
             
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error durante la carga: {str(e)}'))
+
+    def sincronizar(self, **kwargs):
+        self.stdout.write('Iniciando sincronización incremental de ubicaciones...')
+
+        try:
+            sincronizacion = UbicacionService.sincronizar_ubicaciones(
+                codigos=kwargs['paises'],
+                reanudar=kwargs['reanudar'],
+                forzar=kwargs['forzar'],
+                hilos=kwargs['hilos'],
+                tamano_lote=kwargs['lote'],
+                max_por_segundo=kwargs['max_por_segundo'],
+            )
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error durante la sincronización: {str(e)}'))
+            return
+
+        resumen = sincronizacion.resumen
+        tiempos = ', '.join(f'{etapa} {segundos:.2f}s' for etapa, segundos in sincronizacion.tiempos.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Sincronización {sincronizacion.id}:\n'
+            f'- Países procesados: {resumen["paises"]} '
+            f'(sin cambios: {resumen["sin_cambios"]}, ya hechos: {resumen["reanudados"]})\n'
+            f'- Ciudades insertadas: {resumen["insertadas"]}\n'
+            f'- Ciudades actualizadas: {resumen["actualizadas"]}\n'
+            f'- Ciudades desactivadas: {resumen["desactivadas"]}\n'
+            f'- Tiempos: {tiempos}'
+        ))
+        if resumen['errores']:
+            self.stdout.write(self.style.WARNING(
+                f'Países con error: {", ".join(sorted(resumen["errores"]))}. '
+                f'Use --resume para reintentarlos.'
+            ))
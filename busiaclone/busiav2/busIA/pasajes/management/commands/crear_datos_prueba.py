@@ -1,43 +1,47 @@
-from django.core.management.base import BaseCommand
+"""
+Comando para generar datos sintéticos a escala (ver pasajes.datos_prueba)
+"""
+
+from datetime import date
+
 from django.contrib.auth import get_user_model
-from pasajes.models import Linea, Bus, Asiento
-from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from pasajes.datos_prueba import ESCALAS, TAMANO_LOTE, GeneradorDatos
 
 class Command(BaseCommand):
-    help = 'Crea datos de prueba para el sistema de pasajes'
+    help = 'Crea datos de prueba para el sistema de pasajes en la escala indicada'
+
+    PARAMETROS = ['paises', 'regiones_por_pais', 'ciudades', 'lineas', 'buses_por_linea',
+                  'capacidad', 'dias', 'usuarios', 'reservas']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escala', choices=list(ESCALAS), default='pequena',
+                            help='Escala con nombre: pequena, 1m (1 millón de reservas) o 10m')
+        parser.add_argument('--semilla', type=int, default=42,
+                            help='Semilla del generador; la misma semilla produce los mismos datos')
+        parser.add_argument('--fecha-base', type=date.fromisoformat, default=None,
+                            help='Fecha que se toma como hoy (AAAA-MM-DD); por defecto la actual')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE,
+                            help='Filas por inserción masiva')
+        for parametro in self.PARAMETROS:
+            parser.add_argument(f'--{parametro.replace("_", "-")}', type=int, dest=parametro,
+                                help='Reemplaza el valor de la escala')
+
+    def handle(self, *args, **options):
+        generador = GeneradorDatos.desde_escala(
+            options['escala'],
+            semilla=options['semilla'],
+            fecha_base=options['fecha_base'],
+            tamano_lote=options['lote'],
+            **{parametro: options[parametro] for parametro in self.PARAMETROS},
+        )
+        if get_user_model().objects.filter(email__startswith=generador.prefijo_email).exists():
+            raise CommandError(
+                f'Ya existen datos generados con la semilla {options["semilla"]}; use otra semilla'
+            )
 
-    def handle(self, *args, **kwargs):
-        User = get_user_model()
-        
-        # Crear líneas
-        lineas = [
-            {'nombre': 'Buenos Aires - Córdoba', 'descripcion': 'Servicio directo'},
-            {'nombre': 'Buenos Aires - Rosario', 'descripcion': 'Servicio semi-cama'},
-            {'nombre': 'Buenos Aires - Mar del Plata', 'descripcion': 'Servicio ejecutivo'},
-        ]
-        
-        for linea_data in lineas:
-            linea = Linea.objects.create(**linea_data)
-            self.stdout.write(f'Creada línea: {linea.nombre}')
-            
-            # Crear buses para cada línea
-            for i in range(1, 4):
-                bus = Bus.objects.create(
-                    linea=linea,
-                    numero=f'{i:03d}',
-                    capacidad=20
-                )
-                self.stdout.write(f'Creado bus: {bus.numero} para línea {linea.nombre}')
-                
-                # Crear asientos para cada bus
-                for j in range(1, 21):
-                    precio = Decimal('1500.00') if j <= 10 else Decimal('1200.00')
-                    Asiento.objects.create(
-                        bus=bus,
-                        numero=j,
-                        estado='disponible',
-                        precio=precio
-                    )
-                self.stdout.write(f'Creados 20 asientos para bus {bus.numero}')
-        
+        self.stdout.write(f'Generando datos de prueba (escala {options["escala"]}, semilla {options["semilla"]})...')
+        resultado = generador.generar()
+        for etapa, cantidad in resultado['cantidades'].items():
+            self.stdout.write(f'- {etapa}: {cantidad} en {resultado["tiempos"][etapa]:.2f}s')
         self.stdout.write(self.style.SUCCESS('Datos de prueba creados exitosamente'))
@@ -0,0 +1,50 @@
+"""
+Comando para generar los viajes de los horarios recurrentes
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from pasajes import horarios
+
+class Command(BaseCommand):
+    help = 'Genera los viajes de los horarios activos hasta el horizonte de venta'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=horarios.HORIZONTE_DIAS,
+            help='Días desde hoy que deben quedar con viajes generados',
+        )
+        parser.add_argument(
+            '--horario',
+            type=int,
+            action='append',
+            dest='horarios',
+            help='Limita la generación al horario indicado (se puede repetir)',
+        )
+        parser.add_argument(
+            '--completo',
+            action='store_true',
+            help='Recorre todo el horizonte, no solo los días nuevos (p. ej. tras editar un horario)',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=horarios.TAMANO_LOTE,
+            help='Cantidad de horarios procesados por lote',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        resultado = horarios.generar(
+            dias=options['dias'],
+            horarios=options['horarios'],
+            completo=options['completo'],
+            tamano_lote=options['lote'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Se generaron {resultado["viajes"]} viajes de {resultado["horarios"]} horarios '
+            f'en {time.monotonic() - inicio:.2f}s'
+        ))
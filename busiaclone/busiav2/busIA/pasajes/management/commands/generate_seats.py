@@ -1,24 +1,24 @@
 from django.core.management.base import BaseCommand
-from pasajes.models import Bus, Asiento
+from pasajes import asientos
+from pasajes.models import Bus
 
 class Command(BaseCommand):
-    help = 'Genera asientos para todos los buses'
+    help = 'Genera los asientos de los buses según su capacidad y plantilla'
 
-    def handle(self, *args, **kwargs):
-        buses = Bus.objects.all()
-        asientos_creados = 0
+    def add_arguments(self, parser):
+        parser.add_argument('--bus', type=int, action='append', dest='buses',
+                            help='ID de un bus a procesar (se puede repetir)')
+        parser.add_argument('--lote', type=int, default=asientos.TAMANO_LOTE,
+                            help='Buses por lote')
+        parser.add_argument('--podar', action='store_true',
+                            help='Elimina los asientos sobrantes que no tienen reservas')
 
-        for bus in buses:
-            # Crear 40 asientos por bus (10 filas de 4 asientos)
-            for i in range(1, 41):
-                tipo = 'premium' if i <= 8 else 'normal'  # Primeros 8 asientos son premium
-                Asiento.objects.get_or_create(
-                    bus=bus,
-                    numero=i,
-                    defaults={'tipo': tipo}
-                )
-                asientos_creados += 1
+    def handle(self, *args, **kwargs):
+        buses = Bus.objects.filter(id__in=kwargs['buses']) if kwargs['buses'] else None
+        resultado = asientos.generar(buses, tamano_lote=kwargs['lote'], podar=kwargs['podar'])
 
-        self.stdout.write(
-            self.style.SUCCESS(f'Se crearon {asientos_creados} asientos exitosamente')
-        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Asientos creados: {resultado["creados"]}, '
+            f'actualizados: {resultado["actualizados"]}, '
+            f'eliminados: {resultado["eliminados"]}'
+        ))
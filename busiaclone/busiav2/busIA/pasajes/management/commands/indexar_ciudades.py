@@ -0,0 +1,39 @@
+"""
+Comando para construir el índice de autocompletado de ciudades
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from pasajes import autocompletado
+from pasajes.models import CiudadBusqueda, TrigramaCiudad
+
+class Command(BaseCommand):
+    help = 'Construye o actualiza el índice de autocompletado de ciudades (prefijos y trigramas)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=autocompletado.TAMANO_LOTE,
+            help='Cantidad de ciudades indexadas por transacción',
+        )
+        parser.add_argument(
+            '--limpiar',
+            action='store_true',
+            help='Elimina el índice actual antes de construirlo',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        if options['limpiar']:
+            # Los trigramas también: si no, los de ciudades renombradas o quitadas quedarían huérfanos
+            with transaction.atomic():
+                transaction.on_commit(autocompletado.invalidar_cache)
+                TrigramaCiudad.objects.all().delete()
+                CiudadBusqueda.objects.all().delete()
+        indexadas = autocompletado.indexar(tamano_lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Se indexaron {indexadas} ciudades en {time.monotonic() - inicio:.1f} s'
+        ))
@@ -0,0 +1,56 @@
+"""
+Comando para liberar los asientos retenidos por reservas pendientes vencidas
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from pasajes.services import ReservaService
+
+class Command(BaseCommand):
+    help = 'Cancela en lotes las reservas pendientes cuya retención venció'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=500,
+            help='Cantidad de reservas liberadas por transacción',
+        )
+        parser.add_argument(
+            '--max-lotes',
+            type=int,
+            default=None,
+            help='Cantidad máxima de lotes por pasada',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Se mantiene en ejecución repitiendo el barrido cada cierto intervalo',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=30,
+            help='Segundos de espera entre pasadas en modo --loop',
+        )
+
+    def handle(self, *args, **options):
+        pasada = 0
+        try:
+            while True:
+                pasada += 1
+                metricas = ReservaService.liberar_retenciones_vencidas(
+                    tamano_lote=options['lote'],
+                    max_lotes=options['max_lotes']
+                )
+                self.stdout.write(
+                    f'Pasada {pasada}: {metricas["liberadas"]} reservas liberadas en '
+                    f'{metricas["lotes"]} lotes, {metricas["segundos"]:.3f} s '
+                    f'({metricas["por_segundo"]:.1f} reservas/s)'
+                )
+                if not options['loop']:
+                    break
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Barrido detenido'))
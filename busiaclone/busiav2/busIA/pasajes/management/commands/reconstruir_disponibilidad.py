@@ -0,0 +1,51 @@
+"""
+Comando para reconstruir y verificar la disponibilidad materializada de los viajes
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from pasajes import disponibilidad
+from pasajes.models import Viaje
+
+class Command(BaseCommand):
+    help = 'Reconstruye desde cero la disponibilidad de asientos por viaje y verifica su consistencia'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo compara la disponibilidad guardada con la calculada, sin escribir',
+        )
+        parser.add_argument(
+            '--viaje',
+            type=int,
+            action='append',
+            dest='viajes',
+            help='Limita la operación al viaje indicado (se puede repetir)',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=disponibilidad.TAMANO_LOTE,
+            help='Cantidad de viajes procesados por lote',
+        )
+
+    def handle(self, *args, **options):
+        viajes = Viaje.objects.all()
+        if options['viajes']:
+            viajes = viajes.filter(id__in=options['viajes'])
+
+        if not options['verificar']:
+            escritos = disponibilidad.reconstruir(viajes, tamano_lote=options['lote'])
+            self.stdout.write(f'Se reconstruyó la disponibilidad de {escritos} viajes')
+
+        diferencias = disponibilidad.verificar(viajes, tamano_lote=options['lote'])
+        for viaje_id, guardada, esperada in diferencias:
+            actual = f'{guardada.asientos_libres}/{guardada.total_asientos}' if guardada else 'sin registro'
+            self.stdout.write(self.style.WARNING(
+                f'- Viaje {viaje_id}: guardado {actual}, '
+                f'esperado {esperada.asientos_libres}/{esperada.total_asientos}'
+            ))
+
+        if diferencias:
+            raise CommandError(f'Se encontraron {len(diferencias)} viajes con disponibilidad inconsistente')
+        self.stdout.write(self.style.SUCCESS('La disponibilidad es consistente'))
@@ -0,0 +1,44 @@
+"""
+Comando para verificar y corregir la copia de la ruta guardada en los viajes
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from pasajes import busquedas
+from pasajes.models import Viaje
+
+class Command(BaseCommand):
+    help = ('Copia en los viajes el origen, destino, empresa y duración de la línea de su bus '
+            'cuando no coinciden (p. ej. tras editar líneas con update() o SQL directo)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo informa cuántos viajes están desactualizados, sin escribir',
+        )
+        parser.add_argument(
+            '--bus',
+            type=int,
+            action='append',
+            dest='buses',
+            help='Limita la operación a los viajes del bus indicado (se puede repetir)',
+        )
+
+    def handle(self, *args, **options):
+        viajes = Viaje.objects.all()
+        if options['buses']:
+            viajes = viajes.filter(bus_id__in=options['buses'])
+        desactualizados = viajes.ruta_desactualizada()
+
+        if options['verificar']:
+            cantidad = desactualizados.count()
+            if cantidad:
+                raise CommandError(f'Se encontraron {cantidad} viajes con la ruta desactualizada')
+            self.stdout.write(self.style.SUCCESS('La ruta de los viajes es consistente'))
+            return
+
+        actualizados = desactualizados.sincronizar_ruta()
+        if actualizados:
+            # update() no emite señales: los viajes pudieron cambiar de ruta
+            busquedas.descartar()
+        self.stdout.write(self.style.SUCCESS(f'Se actualizó la ruta de {actualizados} viajes'))
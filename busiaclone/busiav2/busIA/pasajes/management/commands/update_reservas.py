@@ -1,17 +1,14 @@
 from django.core.management.base import BaseCommand
-from pasajes.models import Reserva
+from pasajes.services import ReservaService
 
 class Command(BaseCommand):
-    help = 'Actualiza todas las reservas pendientes a confirmadas'
+    help = ('Libera las reservas pendientes cuya retención venció; las vigentes se '
+            'confirman solo al pagar (confirmar_pago)')
 
     def handle(self, *args, **options):
-        # Obtener todas las reservas pendientes
-        reservas = Reserva.objects.filter(estado='pendiente')
-        count = reservas.count()
-        
-        # Actualizar a confirmadas
-        reservas.update(estado='confirmada')
-        
+        # Pasa por el servicio para que la disponibilidad y su versión queden al día
+        metricas = ReservaService.liberar_retenciones_vencidas()
+
         self.stdout.write(
-            self.style.SUCCESS(f'Se actualizaron {count} reservas a estado confirmada')
+            self.style.SUCCESS(f'Se liberaron {metricas["liberadas"]} reservas con la retención vencida')
         )
@@ -0,0 +1,29 @@
+# Generated by Django 5.0 on 2026-10-18 14:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0005_alter_linea_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DisponibilidadViaje',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_asientos', models.PositiveIntegerField(default=0)),
+                ('asientos_libres', models.PositiveIntegerField(default=0)),
+                ('mapa_ocupacion', models.BinaryField(default=b'')),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('viaje', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='disponibilidad', to='pasajes.viaje')),
+            ],
+            options={
+                'verbose_name': 'Disponibilidad de viaje',
+                'verbose_name_plural': 'Disponibilidad de viajes',
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0 on 2026-10-18 14:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def cancelar_reservas_duplicadas(apps, schema_editor):
+    """Deja solo la reserva activa más antigua de cada asiento y fecha."""
+    Reserva = apps.get_model('pasajes', 'Reserva')
+    vistos = set()
+    duplicadas = []
+    activas = Reserva.objects.filter(
+        estado__in=['pendiente', 'confirmada']
+    ).order_by('fecha_reserva', 'id').values_list('id', 'asiento_id', 'fecha_viaje')
+    for reserva_id, asiento_id, fecha_viaje in activas.iterator():
+        if (asiento_id, fecha_viaje) in vistos:
+            duplicadas.append(reserva_id)
+        else:
+            vistos.add((asiento_id, fecha_viaje))
+    Reserva.objects.filter(id__in=duplicadas).update(estado='cancelada')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0006_disponibilidadviaje'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(cancelar_reservas_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reserva',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado__in', ['pendiente', 'confirmada'])), fields=('asiento', 'fecha_viaje'), name='reserva_asiento_fecha_activa_unica'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0 on 2026-10-18 14:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0007_reserva_asiento_fecha_activa_unica'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reserva',
+            name='expira_en',
+            field=models.DateTimeField(blank=True, help_text='Vencimiento de la retención de una reserva pendiente de pago', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['estado', 'expira_en'], name='reserva_estado_expira_idx'),
+        ),
+    ]
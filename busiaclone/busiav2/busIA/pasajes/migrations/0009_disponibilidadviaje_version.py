@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0008_reserva_expira_en'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='disponibilidadviaje',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
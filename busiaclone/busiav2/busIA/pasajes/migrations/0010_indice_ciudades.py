@@ -0,0 +1,47 @@
+# Generated by Django 5.0 on 2026-10-18 14:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0009_disponibilidadviaje_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ciudad',
+            name='poblacion',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='CiudadBusqueda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(db_index=True, max_length=100)),
+                ('texto', models.CharField(max_length=310)),
+                ('poblacion', models.PositiveIntegerField(default=0)),
+                ('popularidad', models.PositiveIntegerField(default=0, help_text='Cantidad de líneas activas que pasan por la ciudad')),
+                ('ciudad', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='busqueda', to='pasajes.ciudad')),
+            ],
+            options={
+                'verbose_name': 'Índice de ciudad',
+                'verbose_name_plural': 'Índice de ciudades',
+            },
+        ),
+        migrations.CreateModel(
+            name='TrigramaCiudad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigrama', models.CharField(max_length=3)),
+                ('ciudad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigramas', to='pasajes.ciudad')),
+            ],
+            options={
+                'verbose_name': 'Trigrama de ciudad',
+                'verbose_name_plural': 'Trigramas de ciudades',
+                'indexes': [models.Index(fields=['trigrama', 'ciudad'], name='trigrama_ciudad_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0010_indice_ciudades'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='ciudad',
+            constraint=models.UniqueConstraint(fields=('region', 'nombre'), name='ciudad_region_nombre_unica'),
+        ),
+        migrations.AddConstraint(
+            model_name='region',
+            constraint=models.UniqueConstraint(fields=('pais', 'nombre'), name='region_pais_nombre_unica'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0 on 2026-10-18 14:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0011_ubicaciones_unicas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SincronizacionUbicaciones',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('iniciada', models.DateTimeField(auto_now_add=True)),
+                ('finalizada', models.DateTimeField(blank=True, null=True)),
+                ('tiempos', models.JSONField(default=dict)),
+                ('resumen', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'Sincronización de ubicaciones',
+                'verbose_name_plural': 'Sincronizaciones de ubicaciones',
+                'ordering': ['-iniciada'],
+            },
+        ),
+        migrations.AddField(
+            model_name='ciudad',
+            name='activa',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.CreateModel(
+            name='PuntoControlPais',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash_contenido', models.CharField(max_length=64)),
+                ('ciudades', models.PositiveIntegerField(default=0)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('pais', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='punto_control', to='pasajes.pais')),
+                ('sincronizacion', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='puntos_control', to='pasajes.sincronizacionubicaciones')),
+            ],
+            options={
+                'verbose_name': 'Punto de control de país',
+                'verbose_name_plural': 'Puntos de control de países',
+            },
+        ),
+    ]
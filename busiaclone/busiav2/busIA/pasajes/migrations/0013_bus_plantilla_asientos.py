@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 14:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0012_sincronizacion_ubicaciones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='plantilla_asientos',
+            field=models.CharField(choices=[('estandar', 'Estándar'), ('economico', 'Económico'), ('cama', 'Cama')], default='estandar', max_length=20),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0 on 2026-10-18 14:48
+
+import django.core.validators
+import django.db.models.deletion
+import pasajes.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0013_bus_plantilla_asientos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Horario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dias_semana', models.CharField(default='1234567', max_length=7, validators=[pasajes.models.validar_dias_semana])),
+                ('hora_salida', models.TimeField(help_text='Hora local de salida')),
+                ('precio', models.DecimalField(blank=True, decimal_places=2, help_text='Si se deja vacío se usa el precio base de la línea', max_digits=10, null=True, validators=[django.core.validators.MinValueValidator(0)])),
+                ('recargo_fin_de_semana', models.DecimalField(decimal_places=2, default=0, help_text='Porcentaje sobre el precio los sábados y domingos', max_digits=5, validators=[django.core.validators.MinValueValidator(0)])),
+                ('vigente_desde', models.DateField()),
+                ('vigente_hasta', models.DateField(blank=True, null=True)),
+                ('activo', models.BooleanField(default=True)),
+                ('generado_hasta', models.DateField(blank=True, editable=False, null=True)),
+                ('bus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='horarios', to='pasajes.bus')),
+            ],
+            options={
+                'verbose_name': 'Horario',
+                'verbose_name_plural': 'Horarios',
+                'ordering': ['bus', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='viaje',
+            name='horario',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='viajes', to='pasajes.horario'),
+        ),
+        migrations.AddConstraint(
+            model_name='viaje',
+            constraint=models.UniqueConstraint(fields=('bus', 'fecha_salida'), name='viaje_bus_salida_unica'),
+        ),
+    ]
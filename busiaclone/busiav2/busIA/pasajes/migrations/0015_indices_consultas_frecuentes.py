@@ -0,0 +1,27 @@
+# Generated by Django 5.0 on 2026-10-18 15:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0014_horarios'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='linea',
+            index=models.Index(fields=['origen', 'destino'], name='linea_origen_destino_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['asiento', 'fecha_viaje', 'estado'], name='reserva_asiento_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['usuario', 'estado', 'fecha_viaje'], name='reserva_usuario_estado_idx'),
+        ),
+    ]
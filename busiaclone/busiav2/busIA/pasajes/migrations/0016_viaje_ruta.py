@@ -0,0 +1,85 @@
+# Generated by Django 5.0 on 2026-10-18 16:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import DateTimeField, ExpressionWrapper, F, OuterRef, Subquery
+
+
+def copiar_rutas(apps, schema_editor):
+    """Copia en cada viaje la ruta de la línea de su bus."""
+    Linea = apps.get_model('pasajes', 'Linea')
+    Viaje = apps.get_model('pasajes', 'Viaje')
+    linea = Linea.objects.filter(bus=OuterRef('bus')).order_by()
+    duracion = Subquery(linea.values('duracion')[:1])
+    Viaje.objects.update(
+        origen_id=Subquery(linea.values('origen_id')[:1]),
+        destino_id=Subquery(linea.values('destino_id')[:1]),
+        nombre_empresa=Subquery(linea.values('nombre_empresa')[:1]),
+        duracion=duracion,
+        fecha_llegada=ExpressionWrapper(F('fecha_salida') + duracion, output_field=DateTimeField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pasajes', '0015_indices_consultas_frecuentes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='viaje',
+            name='origen',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='viajes_origen', to='pasajes.ciudad'),
+        ),
+        migrations.AddField(
+            model_name='viaje',
+            name='destino',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='viajes_destino', to='pasajes.ciudad'),
+        ),
+        migrations.AddField(
+            model_name='viaje',
+            name='nombre_empresa',
+            field=models.CharField(editable=False, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='viaje',
+            name='duracion',
+            field=models.DurationField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='viaje',
+            name='fecha_llegada',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(copiar_rutas, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='viaje',
+            name='origen',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='viajes_origen', to='pasajes.ciudad'),
+        ),
+        migrations.AlterField(
+            model_name='viaje',
+            name='destino',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='viajes_destino', to='pasajes.ciudad'),
+        ),
+        migrations.AlterField(
+            model_name='viaje',
+            name='nombre_empresa',
+            field=models.CharField(editable=False, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='viaje',
+            name='duracion',
+            field=models.DurationField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='viaje',
+            name='fecha_llegada',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='viaje',
+            index=models.Index(fields=['origen', 'destino', 'fecha_salida'], name='viaje_ruta_salida_idx'),
+        ),
+    ]
@@ -1,5 +1,12 @@
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional, Tuple
+
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Count, DateTimeField, ExpressionWrapper, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, TruncDate
 from django.conf import settings
+from django.utils import timezone
 from django.core.validators import MinValueValidator
 
 class Pais(models.Model):
@@ -25,12 +32,19 @@ class Region(models.Model):
         verbose_name = 'Región'
         verbose_name_plural = 'Regiones'
         ordering = ['pais', 'nombre']
+        constraints = [
+            models.UniqueConstraint(fields=['pais', 'nombre'], name='region_pais_nombre_unica'),
+        ]
 
 class Ciudad(models.Model):
     nombre = models.CharField(max_length=100)
     region = models.ForeignKey(Region, on_delete=models.CASCADE)
     latitud = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitud = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    poblacion = models.PositiveIntegerField(null=True, blank=True)
+    # La sincronización desactiva las ciudades que dejan de venir en la API
+    # en lugar de borrarlas, porque pueden tener líneas asociadas
+    activa = models.BooleanField(default=True)
     
     def __str__(self):
         return f"{self.nombre}, {self.region}"
@@ -39,6 +53,79 @@ class Ciudad(models.Model):
         verbose_name = 'Ciudad'
         verbose_name_plural = 'Ciudades'
         ordering = ['region', 'nombre']
+        constraints = [
+            models.UniqueConstraint(fields=['region', 'nombre'], name='ciudad_region_nombre_unica'),
+        ]
+
+class SincronizacionUbicaciones(models.Model):
+    """
+    Ejecución de la sincronización incremental de ubicaciones. Queda sin
+    fecha de fin si se interrumpe; --resume la retoma saltando los países
+    que ya tienen punto de control en ella.
+    """
+    iniciada = models.DateTimeField(auto_now_add=True)
+    finalizada = models.DateTimeField(null=True, blank=True)
+    # Segundos acumulados por etapa (descarga, comparacion, escritura, indexacion)
+    tiempos = models.JSONField(default=dict)
+    resumen = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"Sincronización {self.id} ({self.iniciada:%Y-%m-%d %H:%M})"
+
+    class Meta:
+        verbose_name = 'Sincronización de ubicaciones'
+        verbose_name_plural = 'Sincronizaciones de ubicaciones'
+        ordering = ['-iniciada']
+
+class PuntoControlPais(models.Model):
+    """
+    Último estado sincronizado de las ciudades de un país: hash del contenido
+    recibido de la API y ejecución que lo procesó
+    """
+    pais = models.OneToOneField(Pais, on_delete=models.CASCADE, related_name='punto_control')
+    sincronizacion = models.ForeignKey(SincronizacionUbicaciones, on_delete=models.SET_NULL,
+                                       null=True, related_name='puntos_control')
+    hash_contenido = models.CharField(max_length=64)
+    ciudades = models.PositiveIntegerField(default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.pais} ({self.hash_contenido[:8]})"
+
+    class Meta:
+        verbose_name = 'Punto de control de país'
+        verbose_name_plural = 'Puntos de control de países'
+
+class CiudadBusqueda(models.Model):
+    """
+    Entrada del índice de autocompletado de ciudades. La clave es el nombre
+    normalizado (minúsculas, sin acentos) para búsquedas por prefijo; los
+    trigramas del texto completo se guardan en TrigramaCiudad. Se construye
+    con el comando indexar_ciudades (ver pasajes.autocompletado).
+    """
+    ciudad = models.OneToOneField(Ciudad, on_delete=models.CASCADE, related_name='busqueda')
+    clave = models.CharField(max_length=100, db_index=True)
+    texto = models.CharField(max_length=310)
+    poblacion = models.PositiveIntegerField(default=0)
+    popularidad = models.PositiveIntegerField(default=0, help_text='Cantidad de líneas activas que pasan por la ciudad')
+
+    def __str__(self):
+        return self.texto
+
+    class Meta:
+        verbose_name = 'Índice de ciudad'
+        verbose_name_plural = 'Índice de ciudades'
+
+class TrigramaCiudad(models.Model):
+    trigrama = models.CharField(max_length=3)
+    ciudad = models.ForeignKey(Ciudad, on_delete=models.CASCADE, related_name='trigramas')
+
+    class Meta:
+        verbose_name = 'Trigrama de ciudad'
+        verbose_name_plural = 'Trigramas de ciudades'
+        indexes = [
+            models.Index(fields=['trigrama', 'ciudad'], name='trigrama_ciudad_idx'),
+        ]
 
 class Linea(models.Model):
     nombre = models.CharField(max_length=100)
@@ -56,11 +143,23 @@ class Linea(models.Model):
         verbose_name = 'Línea'
         verbose_name_plural = 'Líneas'
         ordering = ['nombre_empresa', 'nombre']
+        indexes = [
+            # Búsqueda de viajes por ruta
+            models.Index(fields=['origen', 'destino'], name='linea_origen_destino_idx'),
+        ]
 
 class Bus(models.Model):
+    # Distribuciones de asientos; su forma se define en pasajes.asientos.PLANTILLAS
+    PLANTILLAS_ASIENTOS = [
+        ('estandar', 'Estándar'),
+        ('economico', 'Económico'),
+        ('cama', 'Cama'),
+    ]
+
     linea = models.ForeignKey(Linea, on_delete=models.CASCADE)
     numero = models.CharField(max_length=20)
     capacidad = models.PositiveIntegerField()
+    plantilla_asientos = models.CharField(max_length=20, choices=PLANTILLAS_ASIENTOS, default='estandar')
     activo = models.BooleanField(default=True)
     
     def __str__(self):
@@ -72,6 +171,152 @@ class Bus(models.Model):
         ordering = ['linea', 'numero']
         unique_together = ['linea', 'numero']
 
+def validar_dias_semana(valor):
+    if not valor or set(valor) - set('1234567'):
+        raise ValidationError('Use los dígitos 1 (lunes) a 7 (domingo)')
+
+class Horario(models.Model):
+    """
+    Salida diaria recurrente de un bus; la ruta y el precio base salen de
+    la línea del bus. El comando generar_viajes la materializa en filas de
+    Viaje hasta un horizonte de días; generado_hasta marca el último día ya
+    generado, de modo que cada ejecución solo agrega los días nuevos.
+    """
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='horarios')
+    # Días ISO de la semana en que opera: 1 = lunes ... 7 = domingo
+    dias_semana = models.CharField(max_length=7, default='1234567', validators=[validar_dias_semana])
+    # Las reservas se identifican por asiento y fecha: un bus hace un solo
+    # viaje por día, o dos viajes compartirían los asientos
+    hora_salida = models.TimeField(help_text='Hora local de salida')
+    precio = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                 validators=[MinValueValidator(0)],
+                                 help_text='Si se deja vacío se usa el precio base de la línea')
+    recargo_fin_de_semana = models.DecimalField(max_digits=5, decimal_places=2, default=0,
+                                                validators=[MinValueValidator(0)],
+                                                help_text='Porcentaje sobre el precio los sábados y domingos')
+    vigente_desde = models.DateField()
+    vigente_hasta = models.DateField(null=True, blank=True)
+    activo = models.BooleanField(default=True)
+    generado_hasta = models.DateField(null=True, blank=True, editable=False)
+
+    def clean(self):
+        if self.vigente_hasta and self.vigente_hasta < self.vigente_desde:
+            raise ValidationError({'vigente_hasta': 'Debe ser posterior a la fecha de inicio'})
+        if self.bus_id and self.activo and self.superpuestos().exists():
+            raise ValidationError({'bus': 'El bus ya tiene otro horario activo esos días'})
+
+    def superpuestos(self):
+        """Otros horarios activos del mismo bus con algún día de la semana y de vigencia en común"""
+        vigentes = Horario.objects.filter(bus_id=self.bus_id, activo=True).exclude(pk=self.pk).filter(
+            Q(vigente_hasta__isnull=True) | Q(vigente_hasta__gte=self.vigente_desde)
+        )
+        if self.vigente_hasta:
+            vigentes = vigentes.filter(vigente_desde__lte=self.vigente_hasta)
+        dias = Q(pk__in=[])
+        for dia in set(self.dias_semana):
+            dias |= Q(dias_semana__contains=dia)
+        return vigentes.filter(dias)
+
+    def save(self, *args, **kwargs):
+        # Los horarios también se crean fuera de formularios (comandos, shell):
+        # lo que la generación de viajes necesita se valida siempre
+        self.clean()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.bus} ({self.hora_salida:%H:%M})"
+
+    class Meta:
+        verbose_name = 'Horario'
+        verbose_name_plural = 'Horarios'
+        ordering = ['bus', 'id']
+
+def limites_dias(desde: date, hasta: Optional[date] = None) -> Tuple[datetime, datetime]:
+    """
+    Instantes [inicio, fin) que cubren los días locales de desde a hasta
+    (inclusive). Filtrar fecha_salida por este rango semiabierto equivale a
+    fecha_salida__date__range, pero puede usar los índices sobre la columna.
+    """
+    hasta = hasta or desde
+    return (
+        timezone.make_aware(datetime.combine(desde, time.min)),
+        timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min)),
+    )
+
+class ViajeQuerySet(models.QuerySet):
+    def salen_entre(self, desde: date, hasta: Optional[date] = None):
+        """Viajes con salida en los días locales de desde a hasta, ambos inclusive"""
+        inicio, fin = limites_dias(desde, hasta)
+        return self.filter(fecha_salida__gte=inicio, fecha_salida__lt=fin)
+
+    def salen_en(self, fechas: Iterable[date]):
+        """Viajes con salida en alguno de los días locales indicados"""
+        condicion = Q(pk__in=[])
+        for fecha in set(fechas):
+            inicio, fin = limites_dias(fecha)
+            condicion |= Q(fecha_salida__gte=inicio, fecha_salida__lt=fin)
+        return self.filter(condicion)
+
+    def ruta_desactualizada(self):
+        """Viajes cuya copia de la ruta no coincide con la línea actual de su bus"""
+        return self.filter(
+            ~Q(origen=F('bus__linea__origen'))
+            | ~Q(destino=F('bus__linea__destino'))
+            | ~Q(nombre_empresa=F('bus__linea__nombre_empresa'))
+            | ~Q(duracion=F('bus__linea__duracion'))
+            | ~Q(fecha_llegada=ExpressionWrapper(
+                F('fecha_salida') + F('bus__linea__duracion'), output_field=DateTimeField()
+            ))
+        )
+
+    def sincronizar_ruta(self) -> int:
+        """
+        Vuelve a copiar en los viajes los datos de la línea de su bus con un
+        solo UPDATE. Returns: Cantidad de viajes actualizados
+        """
+        linea = Linea.objects.filter(bus=OuterRef('bus')).order_by()
+        duracion = Subquery(linea.values('duracion')[:1])
+        return self.update(
+            origen_id=Subquery(linea.values('origen_id')[:1]),
+            destino_id=Subquery(linea.values('destino_id')[:1]),
+            nombre_empresa=Subquery(linea.values('nombre_empresa')[:1]),
+            duracion=duracion,
+            fecha_llegada=ExpressionWrapper(F('fecha_salida') + duracion, output_field=DateTimeField()),
+        )
+
+    def con_asientos_libres(self):
+        """
+        Anota cada viaje con asientos_libres usando subconsultas correlacionadas,
+        de modo que la búsqueda completa se resuelve en una sola consulta sin
+        importar cuántos viajes coincidan. Las reservas se cuentan por la fecha
+        de cada viaje.
+        """
+        total = Asiento.objects.filter(
+            bus=OuterRef('bus')
+        ).order_by().values('bus').annotate(
+            total=Count('id')
+        ).values('total')
+
+        ocupados = Reserva.objects.filter(
+            asiento__bus=OuterRef('bus'),
+            fecha_viaje=OuterRef('fecha_viaje')
+        ).order_by().values('asiento__bus').annotate(
+            total=Count('asiento', distinct=True, filter=Q(estado__in=Reserva.ESTADOS_ACTIVOS))
+        ).values('total')
+
+        calculados = Coalesce(Subquery(total), 0) - Coalesce(Subquery(ocupados), 0)
+
+        # La disponibilidad materializada tiene prioridad; el cálculo sobre
+        # Asiento y Reserva solo se evalúa para viajes que aún no la tienen
+        return self.annotate(
+            fecha_viaje=TruncDate('fecha_salida'),
+        ).annotate(
+            asientos_libres=Coalesce(
+                'disponibilidad__asientos_libres', calculados,
+                output_field=models.IntegerField()
+            )
+        )
+
 class Viaje(models.Model):
     bus = models.ForeignKey(Bus, on_delete=models.CASCADE)
     fecha_salida = models.DateTimeField()
@@ -82,14 +327,43 @@ class Viaje(models.Model):
         ('completado', 'Completado'),
         ('cancelado', 'Cancelado')
     ], default='programado')
+    horario = models.ForeignKey(Horario, on_delete=models.SET_NULL, null=True, blank=True, related_name='viajes')
+    # Copia de la ruta de la línea del bus para buscar y mostrar viajes sin
+    # pasar por Bus y Linea. Se completa al guardar el viaje (copiar_ruta) y
+    # las señales de Bus y Linea la mantienen al día; el comando
+    # sincronizar_rutas corrige los viajes que hayan quedado desactualizados
+    origen = models.ForeignKey(Ciudad, on_delete=models.PROTECT, related_name='viajes_origen', editable=False)
+    destino = models.ForeignKey(Ciudad, on_delete=models.PROTECT, related_name='viajes_destino', editable=False)
+    nombre_empresa = models.CharField(max_length=100, editable=False)
+    duracion = models.DurationField(editable=False)
+    fecha_llegada = models.DateTimeField(editable=False)
+
+    objects = ViajeQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.bus.linea.nombre} - {self.fecha_salida}"
 
+    def copiar_ruta(self, linea: Linea) -> 'Viaje':
+        """Copia los datos de la línea; necesario antes de un bulk_create"""
+        self.origen_id = linea.origen_id
+        self.destino_id = linea.destino_id
+        self.nombre_empresa = linea.nombre_empresa
+        self.duracion = linea.duracion
+        self.fecha_llegada = self.fecha_salida + linea.duracion
+        return self
+
     class Meta:
         verbose_name = 'Viaje'
         verbose_name_plural = 'Viajes'
         ordering = ['fecha_salida']
+        constraints = [
+            # Permite regenerar horarios con bulk_create(ignore_conflicts=True)
+            models.UniqueConstraint(fields=['bus', 'fecha_salida'], name='viaje_bus_salida_unica'),
+        ]
+        indexes = [
+            # Búsqueda por ruta y ventana de fechas sobre la copia de la ruta
+            models.Index(fields=['origen', 'destino', 'fecha_salida'], name='viaje_ruta_salida_idx'),
+        ]
 
 class Asiento(models.Model):
     bus = models.ForeignKey(Bus, on_delete=models.CASCADE)
@@ -109,6 +383,9 @@ class Asiento(models.Model):
         unique_together = ['bus', 'numero']
 
 class Reserva(models.Model):
+    # Estados que mantienen el asiento ocupado para la fecha del viaje
+    ESTADOS_ACTIVOS = ('pendiente', 'confirmada')
+
     usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     asiento = models.ForeignKey(Asiento, on_delete=models.CASCADE)
     fecha_viaje = models.DateField()
@@ -120,11 +397,61 @@ class Reserva(models.Model):
     ])
     precio = models.DecimalField(max_digits=10, decimal_places=2)
     paypal_order_id = models.CharField(max_length=100, null=True, blank=True)
+    expira_en = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='Vencimiento de la retención de una reserva pendiente de pago'
+    )
     
     def __str__(self):
         return f"Reserva {self.id} - {self.usuario} - {self.asiento}"
+
+    def retencion_vencida(self, ahora=None):
+        """Indica si es una reserva pendiente cuya retención ya venció."""
+        return (
+            self.estado == 'pendiente'
+            and self.expira_en is not None
+            and self.expira_en <= (ahora or timezone.now())
+        )
     
     class Meta:
         verbose_name = 'Reserva'
         verbose_name_plural = 'Reservas'
         ordering = ['-fecha_reserva']
+        indexes = [
+            models.Index(fields=['estado', 'expira_en'], name='reserva_estado_expira_idx'),
+            # Ocupación de un asiento (o de los asientos de un bus) en una fecha
+            models.Index(fields=['asiento', 'fecha_viaje', 'estado'], name='reserva_asiento_fecha_idx'),
+            # Reservas de un usuario (mis viajes, dashboard)
+            models.Index(fields=['usuario', 'estado', 'fecha_viaje'], name='reserva_usuario_estado_idx'),
+        ]
+        constraints = [
+            # Un asiento solo puede tener una reserva activa por fecha
+            models.UniqueConstraint(
+                fields=['asiento', 'fecha_viaje'],
+                condition=Q(estado__in=['pendiente', 'confirmada']),
+                name='reserva_asiento_fecha_activa_unica',
+            ),
+        ]
+
+class DisponibilidadViaje(models.Model):
+    """
+    Disponibilidad materializada de un viaje: cantidad de asientos libres y un
+    mapa de bits de ocupación (bit numero-1 en 1 = asiento ocupado). Se
+    mantiene desde pasajes.disponibilidad al crear, confirmar o cancelar
+    reservas y se reconstruye con el comando reconstruir_disponibilidad.
+    """
+    viaje = models.OneToOneField(Viaje, on_delete=models.CASCADE, related_name='disponibilidad')
+    total_asientos = models.PositiveIntegerField(default=0)
+    asientos_libres = models.PositiveIntegerField(default=0)
+    mapa_ocupacion = models.BinaryField(default=b'')
+    # Aumenta con cada cambio de reservas del viaje; base de los ETag de la API
+    version = models.PositiveIntegerField(default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Disponibilidad {self.viaje_id}: {self.asientos_libres}/{self.total_asientos}"
+
+    class Meta:
+        verbose_name = 'Disponibilidad de viaje'
+        verbose_name_plural = 'Disponibilidad de viajes'
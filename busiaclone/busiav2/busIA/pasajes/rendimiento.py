@@ -0,0 +1,298 @@
+"""
+Benchmark de extremo a extremo del embudo de compra:
+comprar -> buscar_viajes -> obtener_asientos -> crear_reserva -> confirmar_pago
+"""
+
+import base64
+import json
+import math
+import random
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from . import disponibilidad
+from .models import Reserva, Viaje, limites_dias
+
+PASOS = ['comprar', 'buscar_viajes', 'obtener_asientos', 'crear_reserva', 'confirmar_pago']
+PERCENTILES = (50, 95, 99)
+PREFIJO_USUARIOS = 'benchmark-embudo-'
+
+
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not valores:
+        return None
+    return valores[max(math.ceil(p / 100 * len(valores)) - 1, 0)]
+
+
+def version_codigo() -> Optional[str]:
+    """Commit actual del repositorio, para comparar resultados entre versiones"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5, check=True,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _host_permitido() -> str:
+    """Un host aceptado por ALLOWED_HOSTS para las solicitudes del cliente de pruebas"""
+    hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+    return hosts[0].lstrip('.') if hosts else 'localhost'
+
+
+class ClienteDjango:
+    """Usuario virtual sobre el cliente de pruebas de Django; cuenta las consultas de cada solicitud"""
+
+    def __init__(self, usuario):
+        self.cliente = Client(SERVER_NAME=_host_permitido())
+        self.cliente.force_login(usuario)
+
+    def solicitar(self, metodo: str, url: str, datos: Optional[Dict] = None) -> Tuple[int, Any, Optional[int]]:
+        consultas = 0
+
+        def contar(execute, sql, params, many, context):
+            nonlocal consultas
+            consultas += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(contar):
+            if metodo == 'POST':
+                respuesta = self.cliente.post(url, json.dumps(datos), content_type='application/json')
+            else:
+                respuesta = self.cliente.get(url)
+        return respuesta.status_code, _json(respuesta.content, respuesta.get('Content-Type', '')), consultas
+
+
+class ClienteHTTP:
+    """
+    Usuario virtual contra un servidor local (runserver, gunicorn...) que usa
+    la misma base de datos: la sesión se crea en la base y se envía como cookie
+    """
+
+    def __init__(self, usuario, url_base: str):
+        self.url_base = url_base.rstrip('/')
+        self.sesion = requests.Session()
+        cliente = Client()
+        cliente.force_login(usuario)
+        self.sesion.cookies.set(settings.SESSION_COOKIE_NAME, cliente.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    def solicitar(self, metodo: str, url: str, datos: Optional[Dict] = None) -> Tuple[int, Any, Optional[int]]:
+        if metodo == 'POST':
+            respuesta = self.sesion.post(
+                self.url_base + url, json=datos,
+                headers={'X-CSRFToken': self.sesion.cookies.get(settings.CSRF_COOKIE_NAME, '')},
+            )
+        else:
+            respuesta = self.sesion.get(self.url_base + url)
+        # El servidor informa sus consultas si tiene activo el middleware de monitoreo
+        consultas = respuesta.headers.get('X-Consultas-SQL')
+        return (
+            respuesta.status_code,
+            _json(respuesta.content, respuesta.headers.get('Content-Type', '')),
+            int(consultas) if consultas else None,
+        )
+
+
+def _json(contenido: bytes, tipo: str):
+    if 'json' not in tipo:
+        return None
+    try:
+        return json.loads(contenido)
+    except ValueError:
+        return None
+
+
+def asiento_libre(datos: Dict, azar: random.Random) -> Optional[int]:
+    """Elige un asiento libre al azar desde la respuesta compacta (?formato=bits)"""
+    existentes = base64.b64decode(datos['existentes'])
+    ocupados = base64.b64decode(datos['ocupados'])
+    distribucion = datos['distribucion']
+    libres = [
+        numero for numero in range(1, distribucion['ultimo_numero'] + 1)
+        if disponibilidad.asiento_ocupado(existentes, numero) and not disponibilidad.asiento_ocupado(ocupados, numero)
+    ]
+    if not libres:
+        return None
+    numero = azar.choice(libres)
+    if 'id_base' in distribucion:
+        return distribucion['id_base'] + numero
+    return distribucion['ids'][numero - 1]
+
+
+class EmbudoCompra:
+    """
+    Recorre el embudo de compra con usuarios virtuales concurrentes y mide
+    latencia, rendimiento y consultas por solicitud de cada paso
+    """
+
+    def __init__(self, usuarios_virtuales: int = 8, iteraciones: int = 20, url_base: Optional[str] = None,
+                 semilla: int = 42, rutas: int = 50):
+        self.usuarios_virtuales = usuarios_virtuales
+        self.iteraciones = iteraciones
+        self.url_base = url_base
+        self.semilla = semilla
+        self.cantidad_rutas = rutas
+        self._lock = threading.Lock()
+        self.mediciones = defaultdict(list)
+        self.estados = defaultdict(lambda: defaultdict(int))
+        self.consultas = defaultdict(list)
+        self.embudos_completos = 0
+
+    def rutas(self) -> List[Tuple[int, int, str]]:
+        """Rutas (origen, destino, fecha) con viajes programados en los próximos días, las más ofrecidas primero"""
+        hoy = timezone.localdate()
+        filas = Viaje.objects.filter(
+            estado='programado',
+            fecha_salida__gte=timezone.now(),
+            fecha_salida__lt=limites_dias(hoy + timedelta(days=14))[0],
+        ).values_list('origen_id', 'destino_id', 'fecha_salida')
+        conteo = defaultdict(int)
+        for origen_id, destino_id, salida in filas.iterator():
+            conteo[origen_id, destino_id, timezone.localdate(salida).isoformat()] += 1
+        return sorted(conteo, key=lambda ruta: -conteo[ruta])[:self.cantidad_rutas]
+
+    def preparar_usuarios(self):
+        Usuario = get_user_model()
+        usuarios = []
+        for indice in range(self.usuarios_virtuales):
+            usuario, _ = Usuario.objects.get_or_create(
+                email=f'{PREFIJO_USUARIOS}{indice}@busia.test',
+                defaults={'nombre': f'Benchmark {indice}', 'is_verified': True},
+            )
+            usuarios.append(usuario)
+        return usuarios
+
+    def _registrar(self, paso: str, segundos: float, estado: int, consultas: Optional[int]):
+        with self._lock:
+            self.mediciones[paso].append(segundos)
+            self.estados[paso][estado] += 1
+            if consultas is not None:
+                self.consultas[paso].append(consultas)
+
+    def _paso(self, cliente, paso: str, metodo: str, url: str, datos: Optional[Dict] = None):
+        inicio = time.perf_counter()
+        estado, cuerpo, consultas = cliente.solicitar(metodo, url, datos)
+        self._registrar(paso, time.perf_counter() - inicio, estado, consultas)
+        return estado, cuerpo
+
+    def recorrer(self, cliente, rutas, azar: random.Random) -> bool:
+        """Un recorrido completo del embudo; devuelve True si terminó con el pago confirmado"""
+        origen_id, destino_id, fecha = azar.choice(rutas)
+        self._paso(cliente, 'comprar', 'GET', reverse('pasajes:comprar'))
+
+        estado, cuerpo = self._paso(
+            cliente, 'buscar_viajes', 'GET',
+            f"{reverse('pasajes:buscar_viajes')}?origen={origen_id}&destino={destino_id}&fecha={fecha}"
+        )
+        viajes = [viaje for viaje in (cuerpo or {}).get('viajes', []) if viaje['asientos_disponibles'] > 0]
+        if estado != 200 or not viajes:
+            return False
+        viaje = azar.choice(viajes)
+
+        estado, cuerpo = self._paso(
+            cliente, 'obtener_asientos', 'GET',
+            f"{reverse('pasajes:obtener_asientos', args=[viaje['viaje_id']])}?formato=bits"
+        )
+        asiento_id = asiento_libre(cuerpo, azar) if estado == 200 and cuerpo else None
+        if asiento_id is None:
+            return False
+
+        estado, cuerpo = self._paso(cliente, 'crear_reserva', 'POST', reverse('pasajes:crear_reserva'), {
+            'asiento_id': asiento_id,
+            # El día local buscado, que es el día de salida del viaje
+            'fecha_viaje': fecha,
+            'retener': True,
+        })
+        if estado != 200:
+            return False
+
+        estado, _ = self._paso(
+            cliente, 'confirmar_pago', 'POST',
+            reverse('pasajes:confirmar_pago', args=[cuerpo['reserva_id']]),
+            {'order_id': f'BENCH-{cuerpo["reserva_id"]}'},
+        )
+        return estado == 200
+
+    def _usuario_virtual(self, indice: int, cliente, rutas) -> None:
+        azar = random.Random(self.semilla + indice)
+        try:
+            for _ in range(self.iteraciones):
+                if self.recorrer(cliente, rutas, azar):
+                    with self._lock:
+                        self.embudos_completos += 1
+        finally:
+            close_old_connections()
+            connection.close()
+
+    def ejecutar(self) -> Dict[str, Any]:
+        """
+        Ejecuta el benchmark
+        Returns:
+            Dict: Resultados por paso (percentiles en ms, rendimiento en
+            solicitudes por segundo, consultas por solicitud y códigos HTTP)
+        """
+        rutas = self.rutas()
+        if not rutas:
+            raise ValueError('No hay viajes programados; genere datos con crear_datos_prueba')
+        # Las sesiones se abren antes de medir y de a una: el inicio de sesión
+        # no es parte del embudo y en SQLite compite por la tabla de sesiones
+        clientes = [
+            ClienteHTTP(usuario, self.url_base) if self.url_base else ClienteDjango(usuario)
+            for usuario in self.preparar_usuarios()
+        ]
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.usuarios_virtuales) as pool:
+            for futuro in [pool.submit(self._usuario_virtual, i, cliente, rutas) for i, cliente in enumerate(clientes)]:
+                futuro.result()
+        duracion = time.perf_counter() - inicio
+
+        return {
+            'version': version_codigo(),
+            'fecha': timezone.now().isoformat(),
+            'modo': 'http' if self.url_base else 'cliente',
+            'usuarios_virtuales': self.usuarios_virtuales,
+            'iteraciones': self.iteraciones,
+            'duracion_segundos': round(duracion, 3),
+            'embudos_completos': self.embudos_completos,
+            'pasos': {paso: self._resumen(paso, duracion) for paso in PASOS},
+        }
+
+    def _resumen(self, paso: str, duracion: float) -> Dict[str, Any]:
+        tiempos = sorted(self.mediciones[paso])
+        consultas = self.consultas[paso]
+        resumen = {
+            'solicitudes': len(tiempos),
+            'rendimiento_rps': round(len(tiempos) / duracion, 2) if duracion else None,
+            'media_ms': round(sum(tiempos) / len(tiempos) * 1000, 2) if tiempos else None,
+            'estados': {str(estado): total for estado, total in sorted(self.estados[paso].items())},
+            'consultas_media': round(sum(consultas) / len(consultas), 2) if consultas else None,
+            'consultas_max': max(consultas) if consultas else None,
+        }
+        for p in PERCENTILES:
+            valor = percentil(tiempos, p)
+            resumen[f'p{p}_ms'] = round(valor * 1000, 2) if valor is not None else None
+        return resumen
+
+    def limpiar(self) -> int:
+        """Elimina las reservas de los usuarios virtuales y recalcula la disponibilidad afectada"""
+        reservas = Reserva.objects.filter(usuario__email__startswith=PREFIJO_USUARIOS)
+        pares = set(reservas.values_list('asiento__bus_id', 'fecha_viaje'))
+        eliminadas, _ = reservas.delete()
+        disponibilidad.recalcular_buses(pares)
+        return eliminadas
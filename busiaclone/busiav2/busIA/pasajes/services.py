@@ -2,15 +2,27 @@
 Servicios para la gestión de ubicaciones y búsqueda de viajes
 """
 
-import requests
-from typing import List, Dict, Any
+import base64
+import binascii
+import hashlib
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import List, Dict, Any, Optional, Tuple
 from django.conf import settings
-from .models import Pais, Region, Ciudad
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import Count, Min, Q, Sum
+from django.utils import timezone
+from .models import Viaje, Asiento, Reserva, SincronizacionUbicaciones
+from . import disponibilidad
+from .importacion import ImportadorUbicaciones
 
 class UbicacionService:
     """
     Servicio para gestionar la obtención y actualización de ubicaciones
-    utilizando APIs externas
+    utilizando APIs externas (ver pasajes.importacion)
     """
     
     @staticmethod
@@ -20,19 +32,7 @@ class UbicacionService:
         Returns:
             List[Dict]: Lista de países con su información
         """
-        url = "https://restcountries.com/v3.1/all"
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        paises = []
-        for pais in response.json():
-            if 'name' in pais and 'cca2' in pais:
-                paises.append({
-                    'nombre': pais['name']['common'],
-                    'codigo': pais['cca2']
-                })
-        
-        return sorted(paises, key=lambda x: x['nombre'])
+        return ImportadorUbicaciones().obtener_paises()
 
     @staticmethod
     def obtener_ciudades(pais_codigo: str) -> List[Dict[str, Any]]:
@@ -43,132 +43,433 @@ class UbicacionService:
         Returns:
             List[Dict]: Lista de ciudades con su información
         """
-        url = f"https://wft-geo-db.p.rapidapi.com/v1/geo/cities"
-        headers = {
-            "X-RapidAPI-Key": settings.GEODB_API_KEY,
-            "X-RapidAPI-Host": "wft-geo-db.p.rapidapi.com"
-        }
-        params = {
-            "countryIds": pais_codigo,
-            "minPopulation": 100000,  # Solo ciudades con más de 100,000 habitantes
-            "types": "CITY",
-            "sort": "-population"  # Ordenar por población descendente
-        }
-        
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        ciudades = []
-        for ciudad in response.json()['data']:
-            ciudades.append({
-                'nombre': ciudad['city'],
-                'region': ciudad['region'],
-                'latitud': ciudad['latitude'],
-                'longitud': ciudad['longitude']
-            })
-        
-        return ciudades
+        return ImportadorUbicaciones().obtener_ciudades(pais_codigo)
 
     @classmethod
-    def actualizar_ubicaciones(cls) -> Dict[str, int]:
+    def actualizar_ubicaciones(cls, codigos: Optional[List[str]] = None, **opciones) -> Dict[str, Any]:
         """
-        Actualiza la base de datos con la información de países y ciudades
+        Actualiza la base de datos con la información de países y ciudades.
+        Las ciudades se descargan en paralelo y se guardan con upserts masivos.
+        Args:
+            codigos: Limita la importación de ciudades a estos países
+            opciones: Parámetros de ImportadorUbicaciones (hilos, tamano_lote, ...)
         Returns:
-            Dict: Contador de elementos creados/actualizados
-        """
-        contador = {'paises': 0, 'regiones': 0, 'ciudades': 0}
-        
-        # 1. Obtener y actualizar países
-        paises = cls.obtener_paises()
-        for pais_data in paises:
-            pais, created = Pais.objects.update_or_create(
-                codigo=pais_data['codigo'],
-                defaults={'nombre': pais_data['nombre']}
-            )
-            if created:
-                contador['paises'] += 1
-            
-            # 2. Obtener y actualizar ciudades del país
-            try:
-                ciudades = cls.obtener_ciudades(pais.codigo)
-                for ciudad_data in ciudades:
-                    # Crear o actualizar región
-                    region, created = Region.objects.update_or_create(
-                        nombre=ciudad_data['region'],
-                        pais=pais,
-                        defaults={'nombre': ciudad_data['region']}
-                    )
-                    if created:
-                        contador['regiones'] += 1
-                    
-                    # Crear o actualizar ciudad
-                    ciudad, created = Ciudad.objects.update_or_create(
-                        nombre=ciudad_data['nombre'],
-                        region=region,
-                        defaults={
-                            'latitud': ciudad_data['latitud'],
-                            'longitud': ciudad_data['longitud']
-                        }
-                    )
-                    if created:
-                        contador['ciudades'] += 1
-                        
-            except Exception as e:
-                print(f"Error al obtener ciudades de {pais.nombre}: {str(e)}")
-                continue
-        
-        return contador
+            Dict: Contador de elementos creados/actualizados y países con error
+        """
+        return ImportadorUbicaciones(**opciones).importar(codigos)
+
+    @classmethod
+    def sincronizar_ubicaciones(cls, codigos: Optional[List[str]] = None, reanudar: bool = False,
+                                forzar: bool = False, **opciones) -> SincronizacionUbicaciones:
+        """
+        Sincroniza las ciudades escribiendo solo las diferencias y guardando
+        un punto de control por país (ver ImportadorUbicaciones.sincronizar)
+        Returns:
+            SincronizacionUbicaciones: Ejecución con su resumen y tiempos por etapa
+        """
+        return ImportadorUbicaciones(**opciones).sincronizar(codigos, reanudar=reanudar, forzar=forzar)
 
 
 class ViajeService:
     """
-    Servicio para la búsqueda y gestión de viajes
+    Servicio para la búsqueda y gestión de viajes.
+
+    Cada llamada a buscar_viajes resuelve la página completa en una sola
+    consulta (viajes, ciudades y asientos libres), independiente del tamaño
+    de la ventana de fechas o de la página. La ruta se filtra y se muestra
+    con la copia guardada en Viaje, sin pasar por Bus ni Linea.
     """
-    
+
+    # Criterios de orden admitidos: campos de la consulta, de mayor a menor prioridad
+    ORDENES = {
+        'salida': ('fecha_salida', 'id'),
+        'precio': ('precio', 'fecha_salida', 'id'),
+    }
+    LIMITE_POR_DEFECTO = 50
+    LIMITE_MAXIMO = 100
+    VENTANA_MAXIMA_DIAS = 7
+    # Días a cada lado de la fecha elegida en el calendario de precios
+    DIAS_CALENDARIO = 3
+    DIAS_CALENDARIO_MAXIMO = 7
+
     @staticmethod
-    def buscar_viajes(origen_id: int, destino_id: int, fecha: str) -> List[Dict[str, Any]]:
+    def consulta_busqueda(origen_id: int, destino_id: int, fecha_desde: date, fecha_hasta: Optional[date] = None):
+        """Viajes programados de la ruta entre las dos fechas (inclusive), sin anotar ni ordenar"""
+        return Viaje.objects.filter(
+            origen_id=origen_id,
+            destino_id=destino_id,
+            estado='programado'
+        ).salen_entre(fecha_desde, fecha_hasta)
+
+    @classmethod
+    def buscar_viajes(cls, origen_id: int, destino_id: int, fecha_desde: date,
+                      fecha_hasta: Optional[date] = None, orden: str = 'salida',
+                      cursor: Optional[str] = None,
+                      limite: int = LIMITE_POR_DEFECTO) -> Dict[str, Any]:
         """
-        Busca viajes disponibles según origen, destino y fecha
+        Busca viajes programados con asientos libres entre dos ciudades
         Args:
             origen_id: ID de la ciudad de origen
             destino_id: ID de la ciudad de destino
-            fecha: Fecha del viaje en formato YYYY-MM-DD
+            fecha_desde: Primer día de la ventana de búsqueda
+            fecha_hasta: Último día de la ventana (inclusive); por defecto fecha_desde
+            orden: 'salida' o 'precio'
+            cursor: Cursor opaco devuelto por la página anterior
+            limite: Cantidad máxima de viajes por página
         Returns:
-            List[Dict]: Lista de viajes disponibles con su información
+            Dict: {'viajes': [...], 'siguiente_cursor': str | None}
+        Raises:
+            ValueError: Si algún parámetro no es válido
         """
-        from django.db.models import Count, Q
-        from .models import Linea
-        
-        # Buscar líneas que coincidan con origen y destino
-        lineas = Linea.objects.filter(
-            origen_id=origen_id,
-            destino_id=destino_id
+        fecha_hasta = fecha_hasta or fecha_desde
+        if fecha_hasta < fecha_desde:
+            raise ValueError('La fecha final no puede ser anterior a la inicial')
+        if (fecha_hasta - fecha_desde).days >= cls.VENTANA_MAXIMA_DIAS:
+            raise ValueError(f'La búsqueda admite como máximo {cls.VENTANA_MAXIMA_DIAS} días')
+        if orden not in cls.ORDENES:
+            raise ValueError(f'Orden no válido: {orden}')
+        limite = max(1, min(int(limite), cls.LIMITE_MAXIMO))
+
+        campos = cls.ORDENES[orden]
+        viajes = cls.consulta_busqueda(
+            origen_id, destino_id, fecha_desde, fecha_hasta
+        ).con_asientos_libres().filter(
+            asientos_libres__gt=0
         ).select_related(
-            'empresa',
-            'origen',
-            'destino'
-        ).prefetch_related(
-            'buses__asientos'
-        ).annotate(
-            asientos_disponibles=Count(
-                'buses__asientos',
-                filter=Q(buses__asientos__estado='disponible')
+            'origen__region__pais',
+            'destino__region__pais'
+        ).order_by(*campos)
+
+        if cursor:
+            viajes = viajes.filter(cls._filtro_cursor(campos, cls._decodificar_cursor(cursor, campos)))
+
+        # Se pide un elemento extra para saber si existe una página siguiente
+        pagina = list(viajes[:limite + 1])
+        siguiente_cursor = None
+        if len(pagina) > limite:
+            pagina = pagina[:limite]
+            siguiente_cursor = cls._codificar_cursor(pagina[-1], campos)
+
+        return {
+            'viajes': [cls.serializar_viaje(viaje) for viaje in pagina],
+            'siguiente_cursor': siguiente_cursor,
+        }
+
+    @classmethod
+    def etag_busqueda(cls, clave: str, origen_id: int, destino_id: int, fecha_desde: date,
+                      fecha_hasta: Optional[date] = None, **kwargs) -> Optional[str]:
+        """
+        Calcula un ETag para una búsqueda sin consultar Reserva: combina la
+        clave de la consulta con el ID, precio, salida y versión de
+        disponibilidad de cada viaje que puede aparecer en el resultado
+        Args:
+            clave: Identifica la consulta (parámetros, orden y cursor)
+        Returns:
+            str | None: None si algún viaje aún no tiene disponibilidad materializada
+        """
+        filas = cls.consulta_busqueda(
+            origen_id, destino_id, fecha_desde, fecha_hasta
+        ).order_by('id').values_list(
+            'id', 'precio', 'fecha_salida', 'fecha_llegada', 'nombre_empresa', 'disponibilidad__version'
+        )
+
+        resumen = hashlib.sha1(clave.encode())
+        for fila in filas:
+            if fila[-1] is None:
+                return None
+            resumen.update(repr(fila).encode())
+        return f'viajes-{resumen.hexdigest()}'
+
+    @classmethod
+    def ventana_calendario(cls, fecha: date, dias: int = DIAS_CALENDARIO) -> Tuple[date, date]:
+        """
+        Primer y último día del calendario de precios
+        Raises:
+            ValueError: Si dias no es válido
+        """
+        if not 0 <= dias <= cls.DIAS_CALENDARIO_MAXIMO:
+            raise ValueError(f'El calendario admite entre 0 y {cls.DIAS_CALENDARIO_MAXIMO} días a cada lado')
+        return max(fecha - timedelta(days=dias), timezone.localdate()), fecha + timedelta(days=dias)
+
+    @classmethod
+    def calendario_precios(cls, origen_id: int, destino_id: int, fecha: date,
+                           dias: int = DIAS_CALENDARIO) -> Dict[str, Any]:
+        """
+        Tarifa más baja y disponibilidad de cada día entre fecha - dias y
+        fecha + dias (sin días pasados) para una ruta, con una sola consulta
+        agrupada por día. Lee la disponibilidad materializada de cada viaje,
+        que ya se actualiza al reservar o cancelar, así que no necesita un
+        resumen propio que mantener.
+        Returns:
+            Dict: {'desde', 'hasta', 'dias': [{'fecha', 'precio_minimo',
+            'viajes', 'asientos_disponibles'}, ...]}; precio_minimo es None
+            los días sin viajes con asientos libres
+        Raises:
+            ValueError: Si dias no es válido
+        """
+        desde, hasta = cls.ventana_calendario(fecha, dias)
+        por_dia = {
+            fila['fecha_viaje']: fila
+            for fila in cls.consulta_busqueda(
+                origen_id, destino_id, desde, hasta
+            ).con_asientos_libres().order_by().values('fecha_viaje').annotate(
+                precio_minimo=Min('precio', filter=Q(asientos_libres__gt=0)),
+                viajes=Count('id', filter=Q(asientos_libres__gt=0)),
+                asientos=Sum('asientos_libres'),
             )
+        }
+
+        resultado = []
+        dia = desde
+        while dia <= hasta:
+            fila = por_dia.get(dia, {})
+            precio = fila.get('precio_minimo')
+            resultado.append({
+                'fecha': dia.isoformat(),
+                'precio_minimo': float(precio) if precio is not None else None,
+                'viajes': fila.get('viajes', 0),
+                'asientos_disponibles': fila.get('asientos') or 0,
+            })
+            dia += timedelta(days=1)
+        return {'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'dias': resultado}
+
+    @staticmethod
+    def serializar_viaje(viaje: Viaje) -> Dict[str, Any]:
+        """
+        Convierte un viaje anotado con con_asientos_libres() al formato de la API
+        """
+        salida = timezone.localtime(viaje.fecha_salida)
+        return {
+            'viaje_id': viaje.id,
+            'bus_id': viaje.bus_id,
+            'empresa': viaje.nombre_empresa,
+            'origen': str(viaje.origen),
+            'destino': str(viaje.destino),
+            'fecha': salida.strftime('%Y-%m-%d'),
+            'hora_salida': salida.strftime('%H:%M'),
+            'hora_llegada': timezone.localtime(viaje.fecha_llegada).strftime('%H:%M'),
+            'duracion': str(viaje.duracion),
+            'precio': float(viaje.precio),
+            'asientos_disponibles': viaje.asientos_libres
+        }
+
+    @staticmethod
+    def _codificar_cursor(viaje: Viaje, campos) -> str:
+        valores = [str(getattr(viaje, campo)) for campo in campos]
+        return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+    @staticmethod
+    def _decodificar_cursor(cursor: str, campos) -> List[Any]:
+        try:
+            valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(valores) != len(campos):
+                raise ValueError
+            conversores = {
+                'fecha_salida': datetime.fromisoformat,
+                'precio': Decimal,
+                'id': int,
+            }
+            return [conversores[campo](valor) for campo, valor in zip(campos, valores)]
+        except (ValueError, TypeError, ArithmeticError, binascii.Error):
+            raise ValueError('Cursor no válido')
+
+    @staticmethod
+    def _filtro_cursor(campos, valores) -> Q:
+        """
+        Construye la condición "posterior al último elemento" para paginación
+        por clave (keyset), que usa el mismo orden que la consulta
+        """
+        condicion = Q()
+        for i in range(len(campos) - 1, -1, -1):
+            igualdad = {campo: valor for campo, valor in zip(campos[:i], valores[:i])}
+            condicion |= Q(**igualdad, **{f'{campos[i]}__gt': valores[i]})
+        return condicion
+
+
+class ConflictoReserva(Exception):
+    """El asiento no puede reservarse por una reserva concurrente o existente"""
+
+
+class ReservaService:
+    """
+    Servicio para crear reservas sin dobles ventas.
+
+    La fila del asiento se bloquea con select_for_update durante la
+    transacción y la restricción única parcial de Reserva garantiza a nivel
+    de base de datos que no existan dos reservas activas del mismo asiento
+    para la misma fecha.
+    """
+
+    # Reintentos ante bloqueos de la base de datos (deadlock, lock timeout)
+    REINTENTOS = 3
+    ESPERA_REINTENTO = 0.05
+
+    @classmethod
+    def reservar(cls, usuario, asiento_id: int, fecha: date, estado: str = 'confirmada') -> Tuple[Reserva, bool]:
+        """
+        Reserva un asiento para la fecha indicada. Las reservas en estado
+        'pendiente' son retenciones que vencen tras settings.RETENCION_ASIENTO.
+        Args:
+            usuario: Usuario que realiza la reserva
+            asiento_id: ID del asiento
+            fecha: Fecha del viaje
+            estado: Estado inicial de la reserva ('pendiente' o 'confirmada')
+        Returns:
+            Tuple: (reserva, creada). Si el mismo usuario ya tiene el asiento
+            reservado se devuelve esa reserva, de modo que los reintentos del
+            cliente son idempotentes.
+        Raises:
+            Asiento.DoesNotExist, Viaje.DoesNotExist: Si no existe el asiento o el viaje
+            ConflictoReserva: Si el asiento ya está reservado por otro usuario
+        """
+        return cls._con_reintentos(
+            lambda: cls._reservar(usuario, asiento_id, fecha, estado),
+            'El asiento está siendo reservado, intenta nuevamente'
+        )
+
+    @classmethod
+    def _con_reintentos(cls, operacion, mensaje_conflicto: str):
+        """
+        Ejecuta la operación reintentando ante bloqueos de la base de datos
+        Raises:
+            ConflictoReserva: Si el bloqueo persiste tras REINTENTOS intentos
+        """
+        for intento in range(cls.REINTENTOS + 1):
+            try:
+                return operacion()
+            except OperationalError:
+                if intento == cls.REINTENTOS:
+                    raise ConflictoReserva(mensaje_conflicto)
+                # Espera exponencial con variación aleatoria para no reintentar en bloque
+                time.sleep(cls.ESPERA_REINTENTO * (2 ** intento) * random.uniform(0.5, 1.5))
+
+    @classmethod
+    def retener(cls, usuario, asiento_id: int, fecha: date) -> Tuple[Reserva, bool]:
+        """
+        Retiene un asiento mientras el pago está en curso
+        Returns:
+            Tuple: (reserva pendiente, creada)
+        """
+        return cls.reservar(usuario, asiento_id, fecha, estado='pendiente')
+
+    @classmethod
+    def confirmar(cls, usuario, reserva_id: int, order_id: str) -> Reserva:
+        """
+        Confirma el pago de una retención del usuario
+        Raises:
+            Reserva.DoesNotExist: Si el usuario no tiene esa reserva pendiente
+            ConflictoReserva: Si la retención venció o la reserva sigue bloqueada
+        """
+        return cls._con_reintentos(
+            lambda: cls._confirmar(usuario, reserva_id, order_id),
+            'La reserva está siendo modificada, intenta nuevamente'
         )
-        
-        viajes = []
-        for linea in lineas:
-            for bus in linea.buses.all():
-                viajes.append({
-                    'linea_id': linea.id,
-                    'empresa': linea.empresa.nombre,
-                    'origen': linea.origen.nombre,
-                    'destino': linea.destino.nombre,
-                    'duracion': str(linea.duracion),
-                    'precio_base': float(linea.precio_base),
-                    'bus_id': bus.id,
-                    'bus_numero': bus.numero,
-                    'asientos_disponibles': sum(1 for a in bus.asientos.all() if a.estado == 'disponible')
-                })
-        
-        return sorted(viajes, key=lambda x: x['precio_base'])
+
+    @staticmethod
+    def _confirmar(usuario, reserva_id, order_id):
+        with transaction.atomic():
+            reserva = Reserva.objects.select_related('asiento').select_for_update(of=('self',)).get(
+                id=reserva_id,
+                usuario=usuario,
+                estado='pendiente'
+            )
+            if reserva.retencion_vencida():
+                raise ConflictoReserva('La retención del asiento expiró')
+
+            # Aquí deberíamos verificar el pago con PayPal
+            # Por ahora solo actualizamos el estado
+            reserva.estado = 'confirmada'
+            reserva.paypal_order_id = order_id
+            reserva.expira_en = None
+            reserva.save()
+            disponibilidad.sincronizar_asiento(reserva.asiento, reserva.fecha_viaje)
+            return reserva
+
+    @staticmethod
+    def _reservar(usuario, asiento_id, fecha, estado):
+        ahora = timezone.now()
+        with transaction.atomic():
+            asiento = Asiento.objects.select_for_update().get(id=asiento_id)
+            viaje = Viaje.objects.filter(
+                bus_id=asiento.bus_id,
+                estado='programado'
+            ).salen_entre(fecha).order_by('fecha_salida').first()
+            if viaje is None:
+                raise Viaje.DoesNotExist('Viaje no encontrado')
+
+            existente = Reserva.objects.filter(
+                asiento=asiento,
+                fecha_viaje=fecha,
+                estado__in=Reserva.ESTADOS_ACTIVOS
+            ).first()
+            if existente is not None and existente.retencion_vencida(ahora):
+                # Una retención vencida no bloquea el asiento aunque el
+                # barrido todavía no la haya liberado
+                existente.estado = 'cancelada'
+                existente.save(update_fields=['estado'])
+                existente = None
+            if existente is not None:
+                if existente.usuario_id == usuario.id:
+                    return existente, False
+                raise ConflictoReserva('El asiento ya está reservado')
+
+            try:
+                with transaction.atomic():
+                    reserva = Reserva.objects.create(
+                        usuario=usuario,
+                        asiento=asiento,
+                        fecha_viaje=fecha,
+                        estado=estado,
+                        precio=viaje.precio,
+                        expira_en=ahora + settings.RETENCION_ASIENTO if estado == 'pendiente' else None
+                    )
+            except IntegrityError:
+                raise ConflictoReserva('El asiento ya está reservado')
+
+            disponibilidad.sincronizar_asiento(asiento, fecha)
+            return reserva, True
+
+    @staticmethod
+    def liberar_retenciones_vencidas(tamano_lote: int = 500, max_lotes: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Cancela en lotes las reservas pendientes cuya retención venció y
+        actualiza la disponibilidad de los viajes afectados
+        Args:
+            tamano_lote: Cantidad máxima de reservas por lote (una transacción por lote)
+            max_lotes: Límite de lotes por pasada; sin límite por defecto
+        Returns:
+            Dict: Métricas de la pasada (liberadas, lotes, segundos, por_segundo)
+        """
+        inicio = time.monotonic()
+        liberadas = 0
+        lotes = 0
+        while max_lotes is None or lotes < max_lotes:
+            ahora = timezone.now()
+            with transaction.atomic():
+                vencidas = list(
+                    Reserva.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                        estado='pendiente',
+                        expira_en__lt=ahora
+                    ).order_by('expira_en').values_list('id', 'asiento__bus_id', 'fecha_viaje')[:tamano_lote]
+                )
+                if not vencidas:
+                    break
+                # La condición se repite para no cancelar una reserva confirmada entre medio
+                cantidad = Reserva.objects.filter(
+                    id__in=[reserva_id for reserva_id, _, _ in vencidas],
+                    estado='pendiente',
+                    expira_en__lt=ahora
+                ).update(estado='cancelada')
+                disponibilidad.recalcular_buses({(bus_id, fecha) for _, bus_id, fecha in vencidas})
+            liberadas += cantidad
+            lotes += 1
+            if len(vencidas) < tamano_lote:
+                break
+
+        segundos = time.monotonic() - inicio
+        return {
+            'liberadas': liberadas,
+            'lotes': lotes,
+            'segundos': segundos,
+            'por_segundo': liberadas / segundos if segundos > 0 else 0.0,
+        }
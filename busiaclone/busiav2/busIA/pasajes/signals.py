@@ -0,0 +1,124 @@
+"""
+Señales de la aplicación de pasajes
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import asientos, autocompletado, busquedas, conexiones
+from .models import Pais, Region, Ciudad, Linea, Bus, Viaje
+
+
+@receiver(post_save, sender=Ciudad)
+def indexar_ciudad(sender, instance, raw=False, **kwargs):
+    """Mantiene al día la entrada de la ciudad en el índice de autocompletado."""
+    if not raw:
+        autocompletado.indexar([instance.id])
+
+
+@receiver(post_save, sender=Region)
+def indexar_ciudades_region(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        autocompletado.indexar(Ciudad.objects.filter(region=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Pais)
+def indexar_ciudades_pais(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        autocompletado.indexar(Ciudad.objects.filter(region__pais=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Linea)
+def actualizar_popularidad(sender, instance, raw=False, **kwargs):
+    """La popularidad de una ciudad depende de las líneas activas que pasan por ella."""
+    if not raw:
+        autocompletado.indexar([instance.origen_id, instance.destino_id])
+
+
+@receiver(post_save, sender=Bus)
+def generar_asientos_bus(sender, instance, raw=False, **kwargs):
+    """Crea los asientos de los buses nuevos y completa los que cambian de capacidad o plantilla."""
+    if not raw:
+        asientos.generar([instance.id])
+
+
+@receiver(pre_save, sender=Viaje)
+def copiar_ruta_viaje(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Completa la copia de la ruta del viaje a partir de la línea de su bus."""
+    if raw or (update_fields is not None and not {'bus', 'fecha_salida'} & set(update_fields)):
+        return
+    instance.copiar_ruta(Linea.objects.get(bus=instance.bus_id))
+
+
+@receiver(pre_save, sender=Viaje)
+def recordar_ruta_anterior(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Guarda la ruta y el día previos para descartar también sus búsquedas si cambian."""
+    instance._ruta_anterior = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not {'bus', 'fecha_salida'} & set(update_fields):
+        return
+    anterior = Viaje.objects.filter(pk=instance.pk).only('origen', 'destino', 'fecha_salida').first()
+    if anterior is not None:
+        instance._ruta_anterior = busquedas.ruta_del_viaje(anterior)
+
+
+@receiver(post_save, sender=Viaje)
+def invalidar_busquedas_viaje(sender, instance, raw=False, **kwargs):
+    """Cualquier cambio del viaje (precio, estado, horario) descarta las búsquedas de su ruta y día."""
+    if not raw:
+        rutas = {busquedas.ruta_del_viaje(instance), getattr(instance, '_ruta_anterior', None)}
+        busquedas.invalidar(ruta for ruta in rutas if ruta is not None)
+
+
+@receiver(post_delete, sender=Viaje)
+def invalidar_busquedas_viaje_eliminado(sender, instance, **kwargs):
+    busquedas.invalidar([busquedas.ruta_del_viaje(instance)])
+
+
+@receiver(post_save, sender=Viaje)
+def actualizar_grafo_conexiones(sender, instance, raw=False, **kwargs):
+    """Aplica el viaje al grafo de conexiones en memoria una vez confirmado."""
+    if not raw:
+        transaction.on_commit(lambda: conexiones.viaje_guardado(instance))
+
+
+@receiver(post_delete, sender=Viaje)
+def quitar_de_grafo_conexiones(sender, instance, **kwargs):
+    viaje_id = instance.id
+    transaction.on_commit(lambda: conexiones.viaje_eliminado(viaje_id))
+
+
+@receiver(post_save, sender=Linea)
+def sincronizar_ruta_linea(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        if Viaje.objects.filter(bus__linea=instance).ruta_desactualizada().sincronizar_ruta():
+            transaction.on_commit(conexiones.descartar)
+            busquedas.descartar()
+
+
+@receiver(post_save, sender=Bus)
+def sincronizar_ruta_bus(sender, instance, created=False, raw=False, **kwargs):
+    """Los viajes de un bus que cambia de línea pasan a la ruta nueva."""
+    if not raw and not created:
+        if Viaje.objects.filter(bus=instance).ruta_desactualizada().sincronizar_ruta():
+            transaction.on_commit(conexiones.descartar)
+            busquedas.descartar()
+
+
+@receiver(post_save, sender=Ciudad)
+@receiver(post_save, sender=Region)
+@receiver(post_save, sender=Pais)
+def invalidar_busquedas_ubicacion(sender, created=False, raw=False, **kwargs):
+    """Los nombres de las ciudades forman parte de los resultados de búsqueda."""
+    if not raw and not created:
+        busquedas.descartar()
+
+
+@receiver(post_delete, sender=Ciudad)
+@receiver(post_delete, sender=Region)
+@receiver(post_delete, sender=Pais)
+def invalidar_autocompletado(sender, **kwargs):
+    """Las entradas del índice se borran en cascada; solo falta descartar la cache."""
+    transaction.on_commit(autocompletado.invalidar_cache)
@@ -1,3 +1,1487 @@
-from django.test import TestCase
+from datetime import datetime, time, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import base64
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from time import sleep
+from unittest import skipUnless
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from usuarios.models import Usuario
+from .models import Pais, Region, Ciudad, Linea, Bus, Viaje, Asiento, Reserva, DisponibilidadViaje, Horario, TrigramaCiudad
+from . import asientos, autocompletado, busquedas, checks, conexiones, disponibilidad, horarios
+from .datos_prueba import GeneradorDatos
+from .importacion import ImportadorUbicaciones
+from .rendimiento import EmbudoCompra, percentil
+from .services import ViajeService, ReservaService, ConflictoReserva
+
+
+class DatosPasajesMixin:
+    """Crea una red mínima de ciudades, líneas, buses y asientos para las pruebas."""
+
+    @classmethod
+    def crear_datos(cls):
+        pais = Pais.objects.create(nombre='Chile', codigo='CL')
+        region = Region.objects.create(nombre='Metropolitana', pais=pais)
+        cls.santiago = Ciudad.objects.create(nombre='Santiago', region=region)
+        cls.valparaiso = Ciudad.objects.create(nombre='Valparaíso', region=region)
+        cls.linea = Linea.objects.create(
+            nombre='Santiago - Valparaíso',
+            nombre_empresa='Turbus',
+            origen=cls.santiago,
+            destino=cls.valparaiso,
+            duracion=timedelta(hours=2),
+            precio_base=Decimal('5000.00'),
+        )
+        cls.usuario = Usuario.objects.create_user(
+            email='pasajero@busia.cl', nombre='Pasajero', password='clave-segura-123'
+        )
+        cls.fecha = timezone.localdate() + timedelta(days=1)
+
+    @classmethod
+    def crear_bus(cls, numero, asientos=4):
+        # Los asientos los crea la señal de Bus según la plantilla
+        return Bus.objects.create(
+            linea=cls.linea, numero=numero, capacidad=asientos, plantilla_asientos='economico'
+        )
+
+    @classmethod
+    def crear_viaje(cls, bus, hora=8, fecha=None):
+        salida = timezone.make_aware(datetime.combine(fecha or cls.fecha, time(hora)))
+        return Viaje.objects.create(bus=bus, fecha_salida=salida, precio=Decimal('5000.00'))
+
+    def reservar(self, asiento, estado='confirmada', fecha=None):
+        return Reserva.objects.create(
+            usuario=self.usuario,
+            asiento=asiento,
+            fecha_viaje=fecha or self.fecha,
+            estado=estado,
+            precio=Decimal('5000.00'),
+        )
+
+
+class BuscarViajesApiTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def buscar(self):
+        return self.client.get(reverse('pasajes:buscar_viajes'), {
+            'origen': self.santiago.id,
+            'destino': self.valparaiso.id,
+            'fecha': self.fecha.isoformat(),
+        })
+
+    def test_cuenta_asientos_libres_por_fecha(self):
+        bus = self.crear_bus('001')
+        self.crear_viaje(bus)
+        asientos = list(bus.asiento_set.all())
+        self.reservar(asientos[0])
+        self.reservar(asientos[1], estado='pendiente')
+        self.reservar(asientos[2], estado='cancelada')
+        # Una reserva en otra fecha no ocupa el asiento de este viaje
+        self.reservar(asientos[3], fecha=self.fecha + timedelta(days=1))
+
+        viajes = self.buscar().json()['viajes']
+
+        self.assertEqual(len(viajes), 1)
+        self.assertEqual(viajes[0]['asientos_disponibles'], 2)
+
+    def test_excluye_viajes_sin_asientos_libres(self):
+        bus = self.crear_bus('001', asientos=1)
+        self.crear_viaje(bus)
+        self.reservar(bus.asiento_set.get())
+
+        self.assertEqual(self.buscar().json()['viajes'], [])
+
+    def test_numero_de_consultas_constante(self):
+        bus = self.crear_bus('001')
+        self.crear_viaje(bus)
+        with CaptureQueriesContext(connection) as un_viaje:
+            self.buscar()
+
+        for numero in range(2, 21):
+            self.crear_viaje(self.crear_bus(f'{numero:03d}'), hora=numero)
+        with CaptureQueriesContext(connection) as muchos_viajes:
+            viajes = self.buscar().json()['viajes']
+
+        self.assertEqual(len(viajes), 20)
+        self.assertEqual(len(un_viaje), len(muchos_viajes))
+
+    def test_fecha_y_hora_locales_en_salidas_nocturnas(self):
+        # 22:00 en Santiago ya es el día siguiente en UTC
+        self.crear_viaje(self.crear_bus('001'), hora=22)
+
+        viaje = self.buscar().json()['viajes'][0]
+
+        self.assertEqual((viaje['fecha'], viaje['hora_salida']), (self.fecha.isoformat(), '22:00'))
+
+
+class ViajeServiceTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        cls.viajes = []
+        for dia in range(3):
+            for hora in (8, 12, 18):
+                bus = cls.crear_bus(f'{dia}{hora:02d}')
+                viaje = cls.crear_viaje(bus, hora=hora, fecha=cls.fecha + timedelta(days=dia))
+                viaje.precio = Decimal(10000 - hora * 100 - dia)
+                viaje.save()
+                cls.viajes.append(viaje)
+
+    def buscar(self, **kwargs):
+        parametros = {
+            'origen_id': self.santiago.id,
+            'destino_id': self.valparaiso.id,
+            'fecha_desde': self.fecha,
+        }
+        parametros.update(kwargs)
+        return ViajeService.buscar_viajes(**parametros)
+
+    def test_ventana_de_varios_dias(self):
+        resultado = self.buscar(fecha_hasta=self.fecha + timedelta(days=1))
+        self.assertEqual(len(resultado['viajes']), 6)
+        self.assertIsNone(resultado['siguiente_cursor'])
+
+    def test_ordena_por_precio(self):
+        resultado = self.buscar(fecha_hasta=self.fecha + timedelta(days=2), orden='precio')
+        precios = [viaje['precio'] for viaje in resultado['viajes']]
+        self.assertEqual(precios, sorted(precios))
+
+    def test_paginacion_por_cursor_recorre_todos_los_viajes(self):
+        for orden in ViajeService.ORDENES:
+            vistos = []
+            cursor = None
+            while True:
+                resultado = self.buscar(
+                    fecha_hasta=self.fecha + timedelta(days=2), orden=orden, cursor=cursor, limite=4
+                )
+                vistos.extend(viaje['viaje_id'] for viaje in resultado['viajes'])
+                cursor = resultado['siguiente_cursor']
+                if not cursor:
+                    break
+            self.assertEqual(sorted(vistos), sorted(v.id for v in self.viajes))
+
+    def test_presupuesto_de_consultas(self):
+        with self.assertNumQueries(1):
+            primera = self.buscar(fecha_hasta=self.fecha + timedelta(days=2), limite=4)
+        with self.assertNumQueries(1):
+            self.buscar(fecha_hasta=self.fecha + timedelta(days=2), limite=4, cursor=primera['siguiente_cursor'])
+
+    def test_parametros_invalidos(self):
+        with self.assertRaises(ValueError):
+            self.buscar(orden='duracion')
+        with self.assertRaises(ValueError):
+            self.buscar(cursor='no-es-un-cursor')
+        with self.assertRaises(ValueError):
+            self.buscar(fecha_hasta=self.fecha + timedelta(days=ViajeService.VENTANA_MAXIMA_DIAS))
+
+
+class DisponibilidadViajeTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        cls.bus = cls.crear_bus('001', asientos=10)
+        cls.viaje = cls.crear_viaje(cls.bus)
+        cls.asientos = list(cls.bus.asiento_set.order_by('numero'))
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def test_mapa_de_bits(self):
+        mapa = disponibilidad.codificar_mapa([1, 3, 10])
+        self.assertEqual(mapa, bytes([0b101, 0b10]))
+        self.assertTrue(disponibilidad.asiento_ocupado(mapa, 10))
+        self.assertFalse(disponibilidad.asiento_ocupado(mapa, 2))
+        self.assertFalse(disponibilidad.asiento_ocupado(mapa, 40))
+
+    def test_reservar_y_cancelar_actualizan_la_disponibilidad(self):
+        respuesta = self.client.post(
+            reverse('pasajes:crear_reserva'),
+            json.dumps({'asiento_id': self.asientos[2].id, 'fecha_viaje': self.fecha.isoformat()}),
+            content_type='application/json',
+        )
+        self.assertEqual(respuesta.status_code, 200)
+        registro = DisponibilidadViaje.objects.get(viaje=self.viaje)
+        self.assertEqual(registro.asientos_libres, 9)
+        self.assertTrue(disponibilidad.asiento_ocupado(bytes(registro.mapa_ocupacion), 3))
+
+        self.client.get(reverse('usuarios:cancelar_reserva', args=[respuesta.json()['reserva_id']]))
+        registro.refresh_from_db()
+        self.assertEqual(registro.asientos_libres, 10)
+        self.assertFalse(disponibilidad.asiento_ocupado(bytes(registro.mapa_ocupacion), 3))
+        self.assertEqual(disponibilidad.verificar(), [])
+
+    def test_busqueda_lee_la_disponibilidad_materializada(self):
+        disponibilidad.reconstruir()
+        # Una reserva creada por fuera del flujo no se refleja hasta reconstruir
+        self.reservar(self.asientos[0])
+        viaje = Viaje.objects.con_asientos_libres().get(id=self.viaje.id)
+        self.assertEqual(viaje.asientos_libres, 10)
+
+        disponibilidad.reconstruir()
+        viaje = Viaje.objects.con_asientos_libres().get(id=self.viaje.id)
+        self.assertEqual(viaje.asientos_libres, 9)
+
+    def test_comando_reconstruye_y_verifica(self):
+        self.reservar(self.asientos[4])
+        with self.assertRaises(CommandError):
+            call_command('reconstruir_disponibilidad', '--verificar', stdout=StringIO())
+
+        salida = StringIO()
+        call_command('reconstruir_disponibilidad', stdout=salida)
+        self.assertIn('consistente', salida.getvalue())
+        self.assertEqual(DisponibilidadViaje.objects.get(viaje=self.viaje).asientos_libres, 9)
+
+
+class CrearReservaTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        cls.bus = cls.crear_bus('001')
+        cls.viaje = cls.crear_viaje(cls.bus)
+        cls.asiento = cls.bus.asiento_set.first()
+        cls.otro_usuario = Usuario.objects.create_user(
+            email='otro@busia.cl', nombre='Otro', password='clave-segura-123'
+        )
+
+    def crear(self, asiento_id=None):
+        return self.client.post(
+            reverse('pasajes:crear_reserva'),
+            json.dumps({'asiento_id': asiento_id or self.asiento.id, 'fecha_viaje': self.fecha.isoformat()}),
+            content_type='application/json',
+        )
+
+    def test_asiento_ocupado_devuelve_409(self):
+        self.client.force_login(self.otro_usuario)
+        self.assertEqual(self.crear().status_code, 200)
+
+        self.client.force_login(self.usuario)
+        respuesta = self.crear()
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertEqual(Reserva.objects.count(), 1)
+
+    def test_reintento_del_mismo_usuario_es_idempotente(self):
+        self.client.force_login(self.usuario)
+        primera = self.crear().json()
+        segunda = self.crear()
+        self.assertEqual(segunda.status_code, 200)
+        self.assertEqual(segunda.json()['reserva_id'], primera['reserva_id'])
+
+    def test_asiento_inexistente_devuelve_404(self):
+        self.client.force_login(self.usuario)
+        self.assertEqual(self.crear(asiento_id=999999).status_code, 404)
+
+
+class ReservaConcurrenteTests(DatosPasajesMixin, TransactionTestCase):
+    HILOS = 16
+
+    def setUp(self):
+        self.crear_datos()
+        self.bus = self.crear_bus('001')
+        self.crear_viaje(self.bus)
+        self.asiento = self.bus.asiento_set.first()
+        self.usuarios = [
+            Usuario.objects.create_user(email=f'u{i}@busia.cl', nombre=f'U{i}')
+            for i in range(self.HILOS)
+        ]
+
+    def test_sin_dobles_reservas_con_alta_contencion(self):
+        barrera = threading.Barrier(self.HILOS)
+        resultados = []
+
+        def comprar(usuario):
+            try:
+                barrera.wait()
+                try:
+                    ReservaService.reservar(usuario, self.asiento.id, self.fecha)
+                    resultados.append('ok')
+                except ConflictoReserva:
+                    resultados.append('conflicto')
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=comprar, args=(usuario,)) for usuario in self.usuarios]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(len(resultados), self.HILOS)
+        self.assertEqual(resultados.count('ok'), 1)
+        self.assertEqual(
+            Reserva.objects.filter(asiento=self.asiento, estado__in=Reserva.ESTADOS_ACTIVOS).count(), 1
+        )
+        self.assertEqual(disponibilidad.verificar(), [])
+
+    def test_confirmaciones_simultaneas(self):
+        bus = self.crear_bus('002', asientos=8)
+        self.crear_viaje(bus)
+        reservas = [
+            ReservaService.retener(usuario, asiento.id, self.fecha)[0]
+            for usuario, asiento in zip(self.usuarios, bus.asiento_set.order_by('numero'))
+        ]
+        barrera = threading.Barrier(len(reservas))
+        resultados = []
+
+        def confirmar(reserva):
+            try:
+                barrera.wait()
+                ReservaService.confirmar(reserva.usuario, reserva.id, f'ORDEN-{reserva.id}')
+                resultados.append('ok')
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=confirmar, args=(reserva,)) for reserva in reservas]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(resultados, ['ok'] * len(reservas))
+        self.assertEqual(Reserva.objects.filter(asiento__bus=bus, estado='confirmada').count(), len(reservas))
+        self.assertEqual(disponibilidad.verificar(Viaje.objects.filter(bus=bus)), [])
+
+
+class EmbudoCompraTests(DatosPasajesMixin, TransactionTestCase):
+    def setUp(self):
+        self.crear_datos()
+        # Salidas nocturnas: en UTC ya son del día siguiente
+        for numero in range(2):
+            self.crear_viaje(self.crear_bus(f'E{numero}', asientos=8), hora=22 + numero)
+        disponibilidad.reconstruir()
+
+    def test_percentil_por_rango_mas_cercano(self):
+        valores = list(range(1, 101))
+        self.assertEqual([percentil(valores, p) for p in (50, 95, 99)], [50, 95, 99])
+        self.assertIsNone(percentil([], 50))
+
+    # Bajo contención la reserva reintenta y puede superar su presupuesto de
+    # consultas; el benchmark las mide, no debe fallar por ellas
+    @override_settings(MONITOREO_CONSULTAS={'ESTRICTO': False})
+    def test_recorre_el_embudo_y_limpia(self):
+        embudo = EmbudoCompra(usuarios_virtuales=2, iteraciones=2)
+        resultados = embudo.ejecutar()
+
+        self.assertEqual(set(resultados['pasos']), {
+            'comprar', 'buscar_viajes', 'obtener_asientos', 'crear_reserva', 'confirmar_pago'
+        })
+        self.assertGreater(resultados['embudos_completos'], 0)
+        for paso, resumen in resultados['pasos'].items():
+            self.assertFalse([estado for estado in resumen['estados'] if estado >= '500'], paso)
+        # Toda reserva creada termina confirmada
+        reservas_creadas = resultados['pasos']['crear_reserva']['estados'].get('200', 0)
+        self.assertEqual(resultados['pasos']['confirmar_pago']['estados'], {'200': reservas_creadas})
+        self.assertEqual(resultados['embudos_completos'], reservas_creadas)
+        self.assertEqual(Reserva.objects.filter(estado='confirmada').count(), reservas_creadas)
+        busqueda = resultados['pasos']['buscar_viajes']
+        self.assertEqual(busqueda['solicitudes'], 4)
+        self.assertLessEqual(busqueda['p50_ms'], busqueda['p99_ms'])
+        self.assertGreater(busqueda['consultas_media'], 0)
+        json.dumps(resultados)
+
+        self.assertGreaterEqual(embudo.limpiar(), resultados['embudos_completos'])
+        self.assertFalse(Reserva.objects.exists())
+        self.assertEqual(disponibilidad.verificar(), [])
+
+
+class RetencionAsientoTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        cls.bus = cls.crear_bus('001')
+        cls.viaje = cls.crear_viaje(cls.bus)
+        cls.asientos = list(cls.bus.asiento_set.order_by('numero'))
+        cls.otro_usuario = Usuario.objects.create_user(email='otro@busia.cl', nombre='Otro')
+
+    def vencer(self, reserva):
+        Reserva.objects.filter(id=reserva.id).update(expira_en=timezone.now() - timedelta(seconds=1))
+
+    def test_retencion_bloquea_el_asiento_hasta_vencer(self):
+        reserva, _ = ReservaService.retener(self.usuario, self.asientos[0].id, self.fecha)
+        self.assertEqual(reserva.estado, 'pendiente')
+        self.assertIsNotNone(reserva.expira_en)
+        with self.assertRaises(ConflictoReserva):
+            ReservaService.reservar(self.otro_usuario, self.asientos[0].id, self.fecha)
+
+        # Vencida, el asiento se puede volver a vender aunque el barrido no haya corrido
+        self.vencer(reserva)
+        nueva, creada = ReservaService.reservar(self.otro_usuario, self.asientos[0].id, self.fecha)
+        self.assertTrue(creada)
+        reserva.refresh_from_db()
+        self.assertEqual(reserva.estado, 'cancelada')
+
+    def test_confirmar_pago_de_retencion_vencida_devuelve_409(self):
+        reserva, _ = ReservaService.retener(self.usuario, self.asientos[0].id, self.fecha)
+        self.vencer(reserva)
+        self.client.force_login(self.usuario)
+        respuesta = self.client.post(
+            reverse('pasajes:confirmar_pago', args=[reserva.id]),
+            json.dumps({'order_id': 'ORDEN-1'}),
+            content_type='application/json',
+        )
+        self.assertEqual(respuesta.status_code, 409)
+
+    def test_barrido_libera_por_lotes_y_actualiza_disponibilidad(self):
+        for asiento in self.asientos:
+            reserva, _ = ReservaService.retener(self.usuario, asiento.id, self.fecha)
+            if asiento.numero != 4:
+                self.vencer(reserva)
+        self.assertEqual(DisponibilidadViaje.objects.get(viaje=self.viaje).asientos_libres, 0)
+
+        metricas = ReservaService.liberar_retenciones_vencidas(tamano_lote=2)
+
+        self.assertEqual(metricas['liberadas'], 3)
+        self.assertEqual(metricas['lotes'], 2)
+        self.assertEqual(Reserva.objects.filter(estado='pendiente').count(), 1)
+        self.assertEqual(DisponibilidadViaje.objects.get(viaje=self.viaje).asientos_libres, 3)
+        self.assertEqual(disponibilidad.verificar(), [])
+
+    def test_comando_reporta_metricas(self):
+        reserva, _ = ReservaService.retener(self.usuario, self.asientos[0].id, self.fecha)
+        self.vencer(reserva)
+        salida = StringIO()
+        call_command('liberar_retenciones', stdout=salida)
+        self.assertIn('1 reservas liberadas', salida.getvalue())
+
+    def test_update_reservas_no_confirma_retenciones_sin_pagar(self):
+        vigente, _ = ReservaService.retener(self.usuario, self.asientos[0].id, self.fecha)
+        vencida, _ = ReservaService.retener(self.usuario, self.asientos[1].id, self.fecha)
+        self.vencer(vencida)
+
+        salida = StringIO()
+        call_command('update_reservas', stdout=salida)
+
+        self.assertIn('Se liberaron 1 reservas', salida.getvalue())
+        self.assertEqual(Reserva.objects.get(id=vigente.id).estado, 'pendiente')
+        self.assertEqual(Reserva.objects.get(id=vencida.id).estado, 'cancelada')
+        self.assertEqual(DisponibilidadViaje.objects.get(viaje=self.viaje).asientos_libres, 3)
+        self.assertEqual(disponibilidad.verificar(), [])
+
+
+class MapaAsientosApiTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        cls.bus = cls.crear_bus('001', asientos=12)
+        cls.viaje = cls.crear_viaje(cls.bus)
+        cls.asientos = list(cls.bus.asiento_set.order_by('numero'))
+        Asiento.objects.filter(bus=cls.bus, numero__lte=2).update(tipo='premium')
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def obtener(self, **parametros):
+        return self.client.get(reverse('pasajes:obtener_asientos', args=[self.viaje.id]), parametros)
+
+    def test_formato_bits(self):
+        ReservaService.reservar(self.usuario, self.asientos[9].id, self.fecha)
+        data = self.obtener(formato='bits').json()
+
+        ocupados = base64.b64decode(data['ocupados'])
+        premium = base64.b64decode(data['premium'])
+        self.assertEqual(data['distribucion']['ultimo_numero'], 12)
+        self.assertEqual(data['distribucion']['id_base'] + 10, self.asientos[9].id)
+        self.assertEqual(
+            [n for n in range(1, 13) if disponibilidad.asiento_ocupado(ocupados, n)], [10]
+        )
+        self.assertEqual(
+            [n for n in range(1, 13) if disponibilidad.asiento_ocupado(premium, n)], [1, 2]
+        )
+
+    def test_ids_no_correlativos(self):
+        Asiento.objects.filter(id=self.asientos[5].id).delete()
+        Asiento.objects.create(bus=self.bus, numero=6)
+        disponibilidad.reconstruir()
+        data = self.obtener(formato='bits').json()
+
+        self.assertNotIn('id_base', data['distribucion'])
+        self.assertEqual(data['distribucion']['ids'][0], self.asientos[0].id)
+        self.assertEqual(data['distribucion']['ids'][5], Asiento.objects.get(bus=self.bus, numero=6).id)
+
+    def test_salida_en_hora_local(self):
+        viaje = self.crear_viaje(self.bus, hora=23, fecha=self.fecha + timedelta(days=1))
+        disponibilidad.obtener(viaje)
+        data = self.client.get(reverse('pasajes:obtener_asientos', args=[viaje.id])).json()
+        self.assertEqual(data['viaje']['fecha_salida'], f'{self.fecha + timedelta(days=1)} 23:00')
+
+    def test_consultas_acotadas_en_ambos_formatos(self):
+        disponibilidad.reconstruir()
+        self.obtener()
+        for formato in ('bits', 'lista'):
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = self.obtener(formato=formato)
+            self.assertEqual(respuesta.status_code, 200)
+            # Sesión, usuario, versión para el ETag, viaje con disponibilidad y asientos
+            self.assertLessEqual(len(consultas), 5)
+
+
+class RutaViajeTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        cls.bus = cls.crear_bus('001')
+        cls.viaje = cls.crear_viaje(cls.bus)
+        cls.vina = Ciudad.objects.create(nombre='Viña del Mar', region=cls.santiago.region)
+
+    def test_el_viaje_copia_la_ruta_de_su_linea(self):
+        self.assertEqual((self.viaje.origen, self.viaje.destino), (self.santiago, self.valparaiso))
+        self.assertEqual((self.viaje.nombre_empresa, self.viaje.duracion), ('Turbus', timedelta(hours=2)))
+        self.assertEqual(self.viaje.fecha_llegada, self.viaje.fecha_salida + timedelta(hours=2))
+
+    def test_editar_la_linea_actualiza_sus_viajes(self):
+        self.linea.destino = self.vina
+        self.linea.duracion = timedelta(hours=3)
+        self.linea.save()
+
+        self.viaje.refresh_from_db()
+        self.assertEqual(self.viaje.destino, self.vina)
+        self.assertEqual(self.viaje.fecha_llegada, self.viaje.fecha_salida + timedelta(hours=3))
+
+    def test_mover_el_bus_de_linea_actualiza_sus_viajes(self):
+        otra = Linea.objects.create(
+            nombre='Santiago - Viña', nombre_empresa='Pullman', origen=self.santiago, destino=self.vina,
+            duracion=timedelta(hours=1, minutes=45), precio_base=Decimal('4000.00'),
+        )
+        self.bus.linea = otra
+        self.bus.save()
+
+        self.viaje.refresh_from_db()
+        self.assertEqual((self.viaje.destino, self.viaje.nombre_empresa), (self.vina, 'Pullman'))
+        resultado = ViajeService.buscar_viajes(self.santiago.id, self.vina.id, self.fecha)
+        self.assertEqual([viaje['viaje_id'] for viaje in resultado['viajes']], [self.viaje.id])
+        # Sale a las 08:00 hora local y la nueva línea dura 1:45
+        self.assertEqual(resultado['viajes'][0]['hora_llegada'], '09:45')
+        self.assertEqual(resultado['viajes'][0]['duracion'], '1:45:00')
+
+    def test_mis_viajes_lee_la_ruta_y_la_llegada_del_viaje(self):
+        # Sale a las 23:00 hora local: en UTC ya es el día siguiente
+        nocturno = self.crear_viaje(self.crear_bus('002'), hora=23)
+        self.reservar(nocturno.bus.asiento_set.first())
+        self.client.force_login(self.usuario)
+
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('pasajes:mis_viajes'))
+
+        self.assertEqual(respuesta.context['reservas'][0].viaje, nocturno)
+        self.assertContains(respuesta, 'Santiago, Metropolitana, Chile → Valparaíso, Metropolitana, Chile')
+        self.assertContains(respuesta, '<strong>Hora de salida:</strong> 23:00')
+        self.assertContains(respuesta, f'<strong>Llegada estimada:</strong> {self.fecha + timedelta(days=1):%d/%m} 01:00')
+        self.assertFalse(any('pasajes_linea' in consulta['sql'] for consulta in consultas))
+
+    def test_la_busqueda_no_pasa_por_bus_ni_linea(self):
+        sql = str(ViajeService.consulta_busqueda(self.santiago.id, self.valparaiso.id, self.fecha).query)
+        self.assertNotIn('pasajes_bus', sql)
+        self.assertNotIn('pasajes_linea', sql)
+
+    def test_comando_corrige_los_viajes_desactualizados(self):
+        # update() no emite señales: la copia queda desactualizada
+        Linea.objects.filter(id=self.linea.id).update(nombre_empresa='Condor')
+        with self.assertRaises(CommandError):
+            call_command('sincronizar_rutas', '--verificar', stdout=StringIO())
+
+        salida = StringIO()
+        call_command('sincronizar_rutas', stdout=salida)
+
+        self.assertIn('Se actualizó la ruta de 1 viajes', salida.getvalue())
+        self.viaje.refresh_from_db()
+        self.assertEqual(self.viaje.nombre_empresa, 'Condor')
+        self.assertFalse(Viaje.objects.ruta_desactualizada().exists())
+
+
+class ConexionesTests(DatosPasajesMixin, TestCase):
+    """
+    Santiago → Talca no tiene viaje directo; se llega por Rancagua (más
+    temprano) o por Chillán (más barato)
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        region = cls.santiago.region
+        cls.rancagua = Ciudad.objects.create(nombre='Rancagua', region=region)
+        cls.talca = Ciudad.objects.create(nombre='Talca', region=region)
+        cls.chillan = Ciudad.objects.create(nombre='Chillán', region=region)
+        cls.a_rancagua = cls.tramo(cls.santiago, cls.rancagua, [time(8), time(9)], 3000)
+        # La salida de las 09:15 deja solo 15 minutos de conexión
+        cls.rancagua_talca = cls.tramo(cls.rancagua, cls.talca, [time(9, 15), time(10)], 4000, horas=2)
+        cls.tramo(cls.santiago, cls.chillan, [time(8, 30)], 1000)
+        cls.tramo(cls.chillan, cls.talca, [time(12)], 1000, horas=2)
+
+    @classmethod
+    def tramo(cls, origen, destino, salidas, precio, horas=1):
+        linea = Linea.objects.create(
+            nombre=f'{origen.nombre} - {destino.nombre}', nombre_empresa='Pullman', origen=origen,
+            destino=destino, duracion=timedelta(hours=horas), precio_base=Decimal(precio),
+        )
+        bus = Bus.objects.create(linea=linea, numero='001', capacidad=4, plantilla_asientos='economico')
+        return [
+            Viaje.objects.create(
+                bus=bus, fecha_salida=timezone.make_aware(datetime.combine(cls.fecha, salida)), precio=Decimal(precio)
+            )
+            for salida in salidas
+        ]
+
+    def setUp(self):
+        conexiones.reiniciar()
+
+    def buscar(self, **kwargs):
+        return conexiones.buscar(self.santiago.id, self.talca.id, self.fecha, **kwargs)
+
+    def test_encuentra_itinerarios_con_una_escala(self):
+        itinerarios = self.buscar()
+
+        self.assertEqual(len(itinerarios), 2)
+        primero = itinerarios[0]
+        self.assertEqual(primero['escalas'], 1)
+        self.assertEqual([tramo['viaje_id'] for tramo in primero['tramos']],
+                         [self.a_rancagua[0].id, self.rancagua_talca[1].id])
+        self.assertEqual(primero['tramos'][0]['destino'], str(self.rancagua))
+        self.assertEqual((primero['precio_total'], primero['duracion']), (7000.0, '4:00:00'))
+        self.assertEqual(primero['asientos_disponibles'], 4)
+        self.assertEqual(itinerarios[1]['tramos'][0]['destino'], str(self.chillan))
+
+    def test_ordena_por_precio_total(self):
+        itinerarios = self.buscar(orden='precio')
+        self.assertEqual([itinerario['precio_total'] for itinerario in itinerarios], [2000.0, 7000.0])
+
+    def test_respeta_la_conexion_minima_y_el_maximo_de_tramos(self):
+        self.assertEqual(len(self.buscar(conexion_minima=timedelta(minutes=90))), 1)
+        self.assertEqual(len(self.buscar(espera_maxima=timedelta(hours=2))), 1)
+        self.assertEqual(self.buscar(tramos_maximos=1), [])
+        with self.assertRaises(ValueError):
+            self.buscar(tramos_maximos=conexiones.TRAMOS_MAXIMOS + 1)
+
+    def test_descarta_tramos_sin_asientos_libres(self):
+        bus = self.rancagua_talca[1].bus
+        for asiento in bus.asiento_set.all():
+            self.reservar(asiento)
+
+        itinerarios = self.buscar()
+
+        self.assertEqual(len(itinerarios), 1)
+        self.assertEqual(itinerarios[0]['tramos'][0]['destino'], str(self.chillan))
+
+    def test_aplica_los_cambios_de_viajes_sin_recargar_el_dia(self):
+        self.buscar()
+        dia = conexiones.obtener_grafo().dia(self.fecha)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            directo = self.tramo(self.santiago, self.talca, [time(7)], 9000, horas=3)[0]
+        self.assertEqual(self.buscar()[0]['tramos'][0]['viaje_id'], directo.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            directo.estado = 'cancelado'
+            directo.save()
+        self.assertEqual(len(self.buscar()), 2)
+        self.assertIs(conexiones.obtener_grafo().dia(self.fecha), dia)
+
+    def test_api(self):
+        self.client.force_login(self.usuario)
+        url = reverse('pasajes:buscar_conexiones')
+        parametros = {'origen': self.santiago.id, 'destino': self.talca.id, 'fecha': self.fecha.isoformat()}
+
+        response = self.client.get(url, {**parametros, 'orden': 'precio', 'conexion_minima': 60})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['itinerarios'][0]['precio_total'], 2000.0)
+
+        self.assertEqual(self.client.get(url, {**parametros, 'tramos': 9}).status_code, 400)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Los planes se leen con EXPLAIN QUERY PLAN de SQLite')
+class PlanesConsultaTests(DatosPasajesMixin, TestCase):
+    """
+    Ejecuta los recorridos frecuentes, pide EXPLAIN QUERY PLAN de cada SELECT
+    y falla si alguno recorre una tabla completa (SCAN) en vez de usar un índice
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        for numero in range(3):
+            bus = cls.crear_bus(f'00{numero}')
+            cls.crear_viaje(bus)
+            cls.crear_viaje(bus, fecha=cls.fecha + timedelta(days=1))
+        cls.bus = bus
+        cls.asiento = bus.asiento_set.first()
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def recorridos(self, funcion):
+        with CaptureQueriesContext(connection) as consultas:
+            funcion()
+        planes = []
+        with connection.cursor() as cursor:
+            for consulta in consultas.captured_queries:
+                if not consulta['sql'].lstrip().upper().startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + consulta['sql'])
+                planes.append((consulta['sql'], [fila[-1] for fila in cursor.fetchall()]))
+        self.assertTrue(planes)
+        return [
+            f'{paso}\n    en: {sql}' for sql, pasos in planes for paso in pasos
+            if re.match(r'SCAN (?!CONSTANT ROW)', paso)
+        ]
+
+    def assertSinRecorridosCompletos(self, funcion):
+        recorridos = self.recorridos(funcion)
+        self.assertEqual(recorridos, [], 'Consultas que recorren tablas completas:\n' + '\n'.join(recorridos))
+
+    def test_busqueda_de_viajes(self):
+        self.assertSinRecorridosCompletos(lambda: self.client.get(reverse('pasajes:buscar_viajes'), {
+            'origen': self.santiago.id,
+            'destino': self.valparaiso.id,
+            'fecha': self.fecha.isoformat(),
+            'fecha_hasta': (self.fecha + timedelta(days=1)).isoformat(),
+        }))
+
+    def test_mapa_de_asientos(self):
+        viaje = Viaje.objects.filter(bus=self.bus).first()
+        disponibilidad.obtener(viaje)
+        self.assertSinRecorridosCompletos(
+            lambda: self.client.get(reverse('pasajes:obtener_asientos', args=[viaje.id]), {'formato': 'bits'})
+        )
+
+    def test_reserva_y_pago(self):
+        def comprar():
+            reserva, _ = ReservaService.retener(self.usuario, self.asiento.id, self.fecha)
+            self.client.post(
+                reverse('pasajes:confirmar_pago', args=[reserva.id]),
+                json.dumps({'order_id': 'PLAN-1'}), content_type='application/json',
+            )
+        self.assertSinRecorridosCompletos(comprar)
+
+    def test_recalculo_de_disponibilidad(self):
+        self.reservar(self.asiento)
+        self.assertSinRecorridosCompletos(
+            lambda: disponibilidad.recalcular_buses({(self.bus.id, self.fecha), (self.bus.id, self.fecha + timedelta(days=1))})
+        )
+
+    def test_reservas_del_usuario(self):
+        self.reservar(self.asiento)
+        self.assertSinRecorridosCompletos(lambda: (
+            self.client.get(reverse('pasajes:mis_viajes')),
+            self.client.get(reverse('usuarios:dashboard')),
+        ))
+
+    def test_rango_por_dias_equivale_a_filtrar_por_fecha_local(self):
+        for hora in (0, 23):
+            self.crear_viaje(self.bus, hora=hora, fecha=self.fecha + timedelta(days=2))
+        for desde, hasta in ((self.fecha, None), (self.fecha + timedelta(days=1), self.fecha + timedelta(days=2))):
+            por_fecha = Viaje.objects.filter(fecha_salida__date__gte=desde, fecha_salida__date__lte=hasta or desde)
+            self.assertQuerySetEqual(
+                Viaje.objects.salen_entre(desde, hasta).order_by('id'), por_fecha.order_by('id'), ordered=True
+            )
+        self.assertEqual(Viaje.objects.salen_en([self.fecha, self.fecha + timedelta(days=2)]).count(), 5)
+
+    def test_detecta_un_recorrido_completo(self):
+        self.assertTrue(self.recorridos(lambda: list(Reserva.objects.filter(precio__gt=0))))
+
+
+class GetCondicionalTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        cls.bus = cls.crear_bus('001')
+        cls.viaje = cls.crear_viaje(cls.bus)
+        cls.asientos = list(cls.bus.asiento_set.order_by('numero'))
+        disponibilidad.reconstruir()
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def urls(self):
+        return [
+            (reverse('pasajes:obtener_asientos', args=[self.viaje.id]), {'formato': 'bits'}),
+            (reverse('pasajes:buscar_viajes'), {
+                'origen': self.santiago.id, 'destino': self.valparaiso.id, 'fecha': self.fecha.isoformat()
+            }),
+        ]
+
+    def test_304_sin_consultar_reservas(self):
+        for url, parametros in self.urls():
+            etag = self.client.get(url, parametros)['ETag']
+            self.assertTrue(etag.startswith('"'))
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = self.client.get(url, parametros, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(respuesta.status_code, 304)
+            self.assertFalse(any('pasajes_reserva' in consulta['sql'] for consulta in consultas))
+
+    def test_etag_cambia_al_reservar_confirmar_y_cancelar(self):
+        def etags():
+            return [self.client.get(url, parametros)['ETag'] for url, parametros in self.urls()]
+
+        vistos = [etags()]
+        reserva, _ = ReservaService.retener(self.usuario, self.asientos[0].id, self.fecha)
+        vistos.append(etags())
+        self.client.post(
+            reverse('pasajes:confirmar_pago', args=[reserva.id]),
+            json.dumps({'order_id': 'ORDEN-1'}),
+            content_type='application/json',
+        )
+        vistos.append(etags())
+        self.client.get(reverse('usuarios:cancelar_reserva', args=[reserva.id]))
+        vistos.append(etags())
+
+        for i in range(len(self.urls())):
+            self.assertEqual(len({etags_url[i] for etags_url in vistos}), len(vistos))
+            respuesta = self.client.get(*self.urls()[i], HTTP_IF_NONE_MATCH=vistos[0][i])
+            self.assertEqual(respuesta.status_code, 200)
+
+
+class CalendarioPreciosTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        cls.viajes = {}
+        for dia, hora, precio, asientos in ((0, 8, 7000, 4), (0, 18, 4000, 1), (2, 8, 6000, 2)):
+            viaje = cls.crear_viaje(cls.crear_bus(f'{dia}{hora:02d}', asientos=asientos), hora=hora,
+                                    fecha=cls.fecha + timedelta(days=dia))
+            viaje.precio = Decimal(precio)
+            viaje.save()
+            cls.viajes[dia, hora] = viaje
+        disponibilidad.reconstruir()
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def calendario(self, encabezados=None, **parametros):
+        return self.client.get(reverse('pasajes:calendario_precios'), {
+            'origen': self.santiago.id, 'destino': self.valparaiso.id,
+            'fecha': (self.fecha + timedelta(days=1)).isoformat(), **parametros,
+        }, headers=encabezados)
+
+    def test_precio_minimo_y_disponibilidad_por_dia(self):
+        dias = {dia['fecha']: dia for dia in self.calendario().json()['dias']}
+
+        manana = dias[self.fecha.isoformat()]
+        self.assertEqual((manana['precio_minimo'], manana['viajes'], manana['asientos_disponibles']), (4000, 2, 5))
+        self.assertEqual(dias[(self.fecha + timedelta(days=2)).isoformat()]['precio_minimo'], 6000)
+        sin_viajes = dias[(self.fecha + timedelta(days=1)).isoformat()]
+        self.assertEqual((sin_viajes['precio_minimo'], sin_viajes['viajes']), (None, 0))
+
+    def test_un_viaje_lleno_no_cuenta_para_el_precio(self):
+        ReservaService.retener(self.usuario, self.viajes[0, 18].bus.asiento_set.get().id, self.fecha)
+
+        manana = self.calendario().json()['dias'][1]
+
+        self.assertEqual((manana['precio_minimo'], manana['viajes'], manana['asientos_disponibles']), (7000, 1, 4))
+
+    def test_la_ventana_no_incluye_dias_pasados(self):
+        datos = self.calendario().json()
+
+        # La fecha central es pasado mañana: de hoy a 3 días después
+        self.assertEqual(datos['desde'], timezone.localdate().isoformat())
+        self.assertEqual(datos['hasta'], (self.fecha + timedelta(days=4)).isoformat())
+        self.assertEqual(len(datos['dias']), 6)
+        self.assertEqual(len(self.calendario(dias=1).json()['dias']), 3)
+
+    def test_rechaza_parametros_invalidos(self):
+        for dias in ('-1', str(ViajeService.DIAS_CALENDARIO_MAXIMO + 1), 'muchos'):
+            self.assertEqual(self.calendario(dias=dias).status_code, 400)
+        self.assertEqual(self.calendario(fecha='ayer').status_code, 400)
+
+    def test_una_sola_consulta_agrupada(self):
+        with CaptureQueriesContext(connection) as consultas:
+            ViajeService.calendario_precios(self.santiago.id, self.valparaiso.id, self.fecha, 7)
+        self.assertEqual(len(consultas), 1)
+        self.assertIn('GROUP BY', consultas[0]['sql'])
+
+    def test_etag_cambia_al_reservar(self):
+        etag = self.calendario()['ETag']
+        self.assertEqual(self.calendario({'If-None-Match': etag}).status_code, 304)
+
+        ReservaService.retener(self.usuario, self.viajes[2, 8].bus.asiento_set.first().id,
+                               self.fecha + timedelta(days=2))
+
+        respuesta = self.calendario({'If-None-Match': etag})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['dias'][3]['asientos_disponibles'], 1)
+
+
+class CacheBusquedasTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        cls.bus = cls.crear_bus('001')
+        cls.viaje = cls.crear_viaje(cls.bus)
+        cls.otro_dia = cls.crear_viaje(cls.crear_bus('002'), fecha=cls.fecha + timedelta(days=1))
+        disponibilidad.reconstruir()
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        busquedas.reiniciar()
+        self.addCleanup(busquedas.reiniciar)
+
+    def buscar(self, fecha=None):
+        return self.client.get(reverse('pasajes:buscar_viajes'), {
+            'origen': self.santiago.id, 'destino': self.valparaiso.id,
+            'fecha': (fecha or self.fecha).isoformat(),
+        }).json()['viajes']
+
+    def test_repite_el_resultado_sin_volver_a_buscar(self):
+        primero = self.buscar()
+        # El ETag y el resultado salen de la cache: solo se leen la sesión y el usuario
+        with self.assertNumQueries(2):
+            segundo = self.buscar()
+
+        self.assertEqual(primero, segundo)
+        self.assertEqual(busquedas.estadisticas()['aciertos'], 1)
+
+    def test_una_reserva_invalida_solo_su_ruta_y_dia(self):
+        self.buscar()
+        self.buscar(self.fecha + timedelta(days=1))
+
+        ReservaService.retener(self.usuario, self.bus.asiento_set.first().id, self.fecha)
+
+        self.assertEqual(self.buscar()[0]['asientos_disponibles'], 3)
+        self.buscar(self.fecha + timedelta(days=1))
+        self.assertEqual(busquedas.estadisticas()['aciertos'], 1)
+        self.assertEqual(busquedas.estadisticas()['fallos'], 3)
+
+    def test_cambios_del_viaje_invalidan_el_dia_anterior_y_el_nuevo(self):
+        self.assertEqual(self.buscar()[0]['precio'], 5000)
+        self.viaje.precio = Decimal('4500.00')
+        self.viaje.save()
+        self.assertEqual(self.buscar()[0]['precio'], 4500)
+
+        self.assertEqual(len(self.buscar(self.fecha + timedelta(days=1))), 1)
+        self.viaje.fecha_salida += timedelta(days=1)
+        self.viaje.save()
+        self.assertEqual(self.buscar(), [])
+        self.assertEqual(len(self.buscar(self.fecha + timedelta(days=1))), 2)
+
+    def test_cambiar_la_empresa_de_la_linea_descarta_los_resultados(self):
+        self.buscar()
+        self.linea.nombre_empresa = 'Pullman'
+        self.linea.save()
+        self.assertEqual(self.buscar()[0]['empresa'], 'Pullman')
+
+    def test_liberar_retenciones_invalida_su_ruta_y_dia(self):
+        reserva, _ = ReservaService.retener(self.usuario, self.bus.asiento_set.first().id, self.fecha)
+        self.assertEqual(self.buscar()[0]['asientos_disponibles'], 3)
+
+        Reserva.objects.filter(id=reserva.id).update(expira_en=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(ReservaService.liberar_retenciones_vencidas()['liberadas'], 1)
+
+        self.assertEqual(self.buscar()[0]['asientos_disponibles'], 4)
+
+    def test_exige_un_backend_compartido_en_produccion(self):
+        self.assertEqual([error.id for error in checks.revisar_cache_busquedas(None)], ['pasajes.E001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                                   'LOCATION': 'cache'}}):
+            self.assertEqual(checks.revisar_cache_busquedas(None), [])
+
+    def test_importacion_masiva_descarta_los_resultados(self):
+        self.buscar()
+        ImportadorUbicaciones(api_key='prueba').guardar_paises([{'codigo': 'CL', 'nombre': 'República de Chile'}])
+        self.assertTrue(self.buscar()[0]['origen'].endswith('República de Chile'))
+
+    def test_un_solo_calculo_ante_fallos_simultaneos(self):
+        parametros = {'origen_id': 1, 'destino_id': 2, 'fecha_desde': self.fecha, 'fecha_hasta': None}
+        calculos = []
+        resultados = []
+        barrera = threading.Barrier(8)
+
+        def calcular():
+            calculos.append(1)
+            sleep(0.2)
+            return {'viajes': []}
+
+        def buscar():
+            barrera.wait()
+            resultados.append(busquedas.obtener(busquedas.huella('', parametros), parametros, calcular))
+
+        hilos = [threading.Thread(target=buscar) for _ in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(len(calculos), 1)
+        self.assertEqual(resultados, [{'viajes': []}] * 8)
+        self.assertEqual(busquedas.estadisticas()['esperas'], 7)
+
+    def test_un_error_no_se_guarda_ni_deja_el_bloqueo(self):
+        parametros = {'origen_id': 1, 'destino_id': 2, 'fecha_desde': self.fecha, 'fecha_hasta': None}
+
+        def fallar():
+            raise ValueError('Orden no válido')
+
+        with self.assertRaises(ValueError):
+            busquedas.obtener(busquedas.huella('', parametros), parametros, fallar)
+        self.assertEqual(busquedas.obtener(busquedas.huella('', parametros), parametros, lambda: 'ok'), 'ok')
+
+
+class GeneracionAsientosTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+
+    def tipos(self, bus):
+        return dict(Asiento.objects.filter(bus=bus).values_list('numero', 'tipo'))
+
+    def test_bus_nuevo_recibe_asientos_de_su_plantilla(self):
+        bus = Bus.objects.create(linea=self.linea, numero='E1', capacidad=10)
+        tipos = self.tipos(bus)
+        self.assertEqual(sorted(tipos), list(range(1, 11)))
+        self.assertEqual([n for n, tipo in sorted(tipos.items()) if tipo == 'premium'], list(range(1, 9)))
+
+        cama = Bus.objects.create(linea=self.linea, numero='C1', capacidad=7, plantilla_asientos='cama')
+        self.assertEqual(set(self.tipos(cama).values()), {'premium'})
+
+    def test_solo_escribe_diferencias(self):
+        bus = Bus.objects.create(linea=self.linea, numero='E1', capacidad=8)
+        viaje = self.crear_viaje(bus)
+        disponibilidad.reconstruir()
+        originales = set(Asiento.objects.filter(bus=bus).values_list('id', flat=True))
+
+        bus.capacidad = 12
+        bus.plantilla_asientos = 'economico'
+        bus.save()
+
+        self.assertTrue(originales <= set(Asiento.objects.filter(bus=bus).values_list('id', flat=True)))
+        self.assertEqual(set(self.tipos(bus).values()), {'normal'})
+        self.assertEqual(len(self.tipos(bus)), 12)
+        self.assertEqual(DisponibilidadViaje.objects.get(viaje=viaje).total_asientos, 12)
+        # Sin diferencias solo se leen el bus y sus asientos
+        with self.assertNumQueries(2):
+            self.assertEqual(asientos.generar([bus.id]), {'creados': 0, 'actualizados': 0, 'eliminados': 0})
+
+    def test_podar_respeta_asientos_con_reservas(self):
+        bus = self.crear_bus('P1', asientos=6)
+        self.reservar(Asiento.objects.get(bus=bus, numero=6))
+        Bus.objects.filter(id=bus.id).update(capacidad=4)
+
+        resultado = asientos.generar([bus.id], podar=True)
+
+        self.assertEqual(resultado['eliminados'], 1)
+        self.assertEqual(sorted(self.tipos(bus)), [1, 2, 3, 4, 6])
+
+    def test_comando_generate_seats(self):
+        ids = [bus.id for bus in Bus.objects.bulk_create([
+            Bus(linea=self.linea, numero=f'M{i}', capacidad=40) for i in range(3)
+        ])]
+        salida = StringIO()
+        call_command('generate_seats', '--lote', '2', stdout=salida)
+        self.assertIn('Asientos creados: 120', salida.getvalue())
+        self.assertEqual(Asiento.objects.filter(bus_id__in=ids).count(), 120)
+
+
+class HorariosTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        cls.bus = cls.crear_bus('H1')
+        # 2030-01-07 es lunes
+        cls.lunes = datetime(2030, 1, 7).date()
+        cls.horario = Horario.objects.create(
+            bus=cls.bus, dias_semana='12345', hora_salida=time(18, 30),
+            recargo_fin_de_semana=Decimal('10'), vigente_desde=cls.lunes,
+        )
+
+    def test_genera_dias_y_horas_del_horario(self):
+        resultado = horarios.generar(dias=7, hoy=self.lunes)
+
+        self.assertEqual(resultado, {'horarios': 1, 'viajes': 5})
+        salidas = [timezone.localtime(v.fecha_salida) for v in Viaje.objects.filter(horario=self.horario)]
+        self.assertEqual({salida.isoweekday() for salida in salidas}, {1, 2, 3, 4, 5})
+        self.assertEqual({salida.strftime('%H:%M') for salida in salidas}, {'18:30'})
+        self.assertEqual(DisponibilidadViaje.objects.filter(viaje__horario=self.horario).count(), 5)
+        self.horario.refresh_from_db()
+        self.assertEqual(self.horario.generado_hasta, self.lunes + timedelta(days=6))
+
+    def test_precio_con_recargo_de_fin_de_semana(self):
+        self.assertEqual(horarios.precio(self.horario, self.lunes, Decimal('5000.00')), Decimal('5000.00'))
+        self.assertEqual(
+            horarios.precio(self.horario, self.lunes + timedelta(days=5), Decimal('5000.00')),
+            Decimal('5500.00')
+        )
+
+    def test_incremental_e_idempotente(self):
+        horarios.generar(dias=7, hoy=self.lunes)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(horarios.generar(dias=7, hoy=self.lunes), {'horarios': 0, 'viajes': 0})
+        self.assertEqual(horarios.generar(dias=7, hoy=self.lunes, completo=True)['viajes'], 0)
+
+        # Al día siguiente solo se agrega el nuevo día del horizonte (lunes siguiente)
+        resultado = horarios.generar(dias=7, hoy=self.lunes + timedelta(days=1))
+        self.assertEqual(resultado, {'horarios': 1, 'viajes': 1})
+        self.assertEqual(Viaje.objects.filter(horario=self.horario).count(), 6)
+
+    def test_respeta_vigencia(self):
+        Horario.objects.filter(id=self.horario.id).update(vigente_hasta=self.lunes + timedelta(days=1))
+        self.assertEqual(horarios.generar(dias=30, hoy=self.lunes)['viajes'], 2)
+
+    def test_comando_generar_viajes(self):
+        Horario.objects.filter(id=self.horario.id).update(vigente_desde=timezone.localdate())
+        salida = StringIO()
+        call_command('generar_viajes', '--dias', '14', stdout=salida)
+        self.assertIn('de 1 horarios', salida.getvalue())
+        self.assertEqual(Viaje.objects.filter(horario=self.horario).count(), 10)
+
+    def test_un_bus_hace_una_sola_salida_por_dia(self):
+        # Dos viajes del mismo bus y día compartirían los asientos de las reservas
+        with self.assertRaises(ValidationError):
+            Horario.objects.create(bus=self.bus, dias_semana='5', hora_salida=time(7),
+                                   vigente_desde=self.lunes + timedelta(days=30))
+
+        # Los fines de semana o tras el fin de la vigencia el bus está libre
+        Horario.objects.create(bus=self.bus, dias_semana='67', hora_salida=time(7), vigente_desde=self.lunes)
+        self.horario.vigente_hasta = self.lunes + timedelta(days=6)
+        self.horario.save()
+        Horario.objects.create(bus=self.bus, dias_semana='1', hora_salida=time(7),
+                               vigente_desde=self.lunes + timedelta(days=7))
+
+    def test_ruta_y_precio_de_la_linea_del_bus(self):
+        otra = Linea.objects.create(
+            nombre='Otra', nombre_empresa='Pullman', origen=self.valparaiso, destino=self.santiago,
+            duracion=timedelta(hours=2), precio_base=Decimal('8000.00'),
+        )
+        # Si el bus cambia de línea, el viaje sigue a la línea del bus en ruta y precio
+        Bus.objects.filter(id=self.bus.id).update(linea=otra)
+        horarios.generar(dias=1, hoy=self.lunes)
+        viaje = Viaje.objects.get(horario=self.horario)
+        self.assertEqual((viaje.origen, viaje.precio), (self.valparaiso, Decimal('8000.00')))
+
+
+class GeneradorDatosTests(TestCase):
+    PARAMETROS = {
+        'paises': 1, 'regiones_por_pais': 2, 'ciudades': 12, 'lineas': 10, 'buses_por_linea': 2,
+        'capacidad': 8, 'dias': 10, 'usuarios': 30, 'reservas': 400, 'fecha_base': datetime(2030, 3, 1).date(),
+    }
+
+    def test_genera_datos_consistentes(self):
+        resultado = GeneradorDatos(semilla=1, **self.PARAMETROS).generar()
+
+        self.assertEqual(resultado['cantidades']['reservas'], 400)
+        self.assertEqual(Viaje.objects.count(), 10 * 2 * 10)
+        self.assertEqual(Asiento.objects.count(), 10 * 2 * 8)
+        self.assertEqual(disponibilidad.verificar(), [])
+        # La demanda se concentra en los corredores con más población
+        por_linea = sorted(
+            Reserva.objects.values('asiento__bus__linea').annotate(total=Count('id')).values_list('total', flat=True)
+        )
+        self.assertGreater(por_linea[-1], 2 * por_linea[len(por_linea) // 2])
+
+    def test_misma_semilla_mismos_datos(self):
+        def huella():
+            GeneradorDatos(semilla=5, **self.PARAMETROS).generar()
+            lineas = list(Linea.objects.order_by('nombre').values_list('nombre', 'origen__nombre', 'destino__nombre'))
+            reservas = sorted(Reserva.objects.values_list(
+                'asiento__bus__linea__nombre', 'asiento__bus__numero', 'asiento__numero', 'fecha_viaje', 'estado'
+            ))
+            Reserva.objects.all().delete()
+            Usuario.objects.all().delete()
+            Linea.objects.all().delete()
+            return lineas, reservas
+
+        self.assertEqual(huella(), huella())
+
+    def test_comando_rechaza_semilla_repetida(self):
+        opciones = ['--semilla', '3', '--ciudades', '5', '--lineas', '3', '--dias', '2',
+                    '--usuarios', '5', '--reservas', '10']
+        call_command('crear_datos_prueba', *opciones, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('crear_datos_prueba', *opciones, stdout=StringIO())
+
+
+class AutocompletadoCiudadesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        chile = Pais.objects.create(nombre='Chile', codigo='CL')
+        peru = Pais.objects.create(nombre='Perú', codigo='PE')
+        rm = Region.objects.create(nombre='Metropolitana', pais=chile)
+        lima = Region.objects.create(nombre='Lima', pais=peru)
+        cls.santiago = Ciudad.objects.create(nombre='Santiago', region=rm, poblacion=6000000)
+        cls.san_bernardo = Ciudad.objects.create(nombre='San Bernardo', region=rm, poblacion=300000)
+        cls.san_isidro = Ciudad.objects.create(nombre='San Isidro', region=lima, poblacion=60000)
+        cls.concepcion = Ciudad.objects.create(nombre='Concepción', region=rm, poblacion=200000)
+
+    def setUp(self):
+        autocompletado.reiniciar_cache()
+
+    def ids(self, consulta):
+        return [resultado['id'] for resultado in autocompletado.buscar(consulta)]
+
+    def test_normalizacion(self):
+        self.assertEqual(autocompletado.normalizar('  Concepción,  BÍO-BÍO '), 'concepcion bio bio')
+
+    def test_prefijo_sin_acentos_ordenado_por_poblacion(self):
+        self.assertEqual(self.ids('SAN'), [self.santiago.id, self.san_bernardo.id, self.san_isidro.id])
+        self.assertEqual(self.ids('concepcion'), [self.concepcion.id])
+
+    def test_popularidad_antes_que_poblacion(self):
+        Linea.objects.create(
+            nombre='Lima - San Isidro', nombre_empresa='Cruz del Sur',
+            origen=self.san_isidro, destino=self.concepcion,
+            duracion=timedelta(hours=1), precio_base=Decimal('10.00'),
+        )
+        self.assertEqual(self.ids('san')[0], self.san_isidro.id)
+
+    def test_trigramas_encuentran_palabras_intermedias_y_errores(self):
+        self.assertEqual(self.ids('bernardo'), [self.san_bernardo.id])
+        self.assertIn(self.concepcion.id, self.ids('consepcion'))
+
+    def test_indice_se_actualiza_al_guardar(self):
+        self.santiago.nombre = 'Santiago de Chile'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.santiago.save()
+        self.assertEqual(
+            autocompletado.buscar('santiago de')[0]['text'],
+            'Santiago de Chile, Metropolitana, Chile'
+        )
+
+    def test_reindexar_con_limpiar_no_deja_trigramas_huerfanos(self):
+        # update() no emite señales: el índice queda con el nombre anterior
+        Ciudad.objects.filter(id=self.concepcion.id).update(nombre='Penco')
+
+        # --limpiar vacía las dos tablas antes de reconstruir
+        with patch.object(autocompletado, 'indexar', return_value=0):
+            call_command('indexar_ciudades', '--limpiar', stdout=StringIO())
+        self.assertFalse(TrigramaCiudad.objects.exists())
+
+        call_command('indexar_ciudades', '--limpiar', stdout=StringIO())
+
+        self.assertFalse(TrigramaCiudad.objects.filter(ciudad__busqueda__isnull=True).exists())
+        self.assertEqual(
+            set(TrigramaCiudad.objects.filter(ciudad=self.concepcion).values_list('trigrama', flat=True)),
+            autocompletado.trigramas('Penco Metropolitana Chile'),
+        )
+        self.assertEqual(TrigramaCiudad.objects.count(), sum(
+            len(autocompletado.trigramas(f'{c.nombre} {c.region.nombre} {c.region.pais.nombre}'))
+            for c in Ciudad.objects.select_related('region__pais')
+        ))
+        self.assertNotIn(self.concepcion.id, self.ids('concepcion'))
+
+    def test_api(self):
+        respuesta = self.client.get(reverse('pasajes:buscar_ciudades'), {'q': 'Conc'})
+        self.assertEqual(respuesta.json()['results'], [
+            {'id': self.concepcion.id, 'text': 'Concepción, Metropolitana, Chile'}
+        ])
+
+
+class CacheAutocompletadoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        pais = Pais.objects.create(nombre='Chile', codigo='CL')
+        cls.region = Region.objects.create(nombre='Valparaíso', pais=pais)
+        cls.vina = Ciudad.objects.create(nombre='Viña del Mar', region=cls.region)
+
+    def setUp(self):
+        autocompletado.reiniciar_cache()
+        self.addCleanup(autocompletado.reiniciar_cache)
+
+    def test_lru_con_ttl(self):
+        cache = autocompletado.CacheLocal(max_entradas=2, ttl=60)
+        cache.guardar('a', 1)
+        cache.guardar('b', 2)
+        cache.obtener('a')
+        cache.guardar('c', 3)
+        self.assertEqual(cache.obtener('a'), (True, 1))
+        self.assertEqual(cache.obtener('b'), (False, None))
+
+        vencida = autocompletado.CacheLocal(max_entradas=2, ttl=0)
+        vencida.guardar('a', 1)
+        self.assertEqual(vencida.obtener('a'), (False, None))
+
+    def test_consultas_equivalentes_comparten_entrada(self):
+        autocompletado.buscar('Viña')
+        with self.assertNumQueries(0):
+            resultados = autocompletado.buscar('  VINA ')
+        self.assertEqual(resultados[0]['id'], self.vina.id)
+        self.assertEqual(autocompletado.estadisticas_cache()['aciertos'], 1)
+        self.assertEqual(autocompletado.estadisticas_cache()['fallos'], 1)
+
+    def test_invalidacion_al_modificar_ubicaciones(self):
+        self.assertEqual(autocompletado.buscar('quilpue'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            quilpue = Ciudad.objects.create(nombre='Quilpué', region=self.region)
+        self.assertEqual(autocompletado.buscar('quilpue')[0]['id'], quilpue.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            quilpue.delete()
+        self.assertEqual(autocompletado.buscar('quilpue'), [])
+
+    @override_settings(AUTOCOMPLETADO_CACHE={'BACKEND': 'default', 'TTL': 60})
+    def test_backend_del_framework_de_cache(self):
+        autocompletado.reiniciar_cache()
+        autocompletado.buscar('vina')
+        with self.assertNumQueries(0):
+            autocompletado.buscar('vina')
+        autocompletado.invalidar_cache()
+        with self.assertNumQueries(2):
+            autocompletado.buscar('vina')
+
+    def test_estadisticas_solo_staff(self):
+        url = reverse('pasajes:estadisticas_cache_ciudades')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        staff = Usuario.objects.create_user(email='staff@busia.cl', nombre='Staff', is_staff=True)
+        self.client.force_login(staff)
+        self.assertIn('aciertos', self.client.get(url).json())
+
+
+class ApiUbicacionesFalsa(BaseHTTPRequestHandler):
+    """Responde como RestCountries y GeoDB con datos fijos; la primera consulta de AR recibe un 429"""
+
+    paises = [
+        {'name': {'common': 'Chile'}, 'cca2': 'CL'},
+        {'name': {'common': 'Argentina'}, 'cca2': 'AR'},
+    ]
+    ciudades_base = {
+        'CL': [
+            {'city': 'Santiago', 'region': 'Metropolitana', 'latitude': -33.45, 'longitude': -70.66, 'population': 6000000},
+            {'city': 'Valparaíso', 'region': 'Valparaíso', 'latitude': -33.05, 'longitude': -71.62, 'population': 300000},
+            {'city': 'Viña del Mar', 'region': 'Valparaíso', 'latitude': -33.02, 'longitude': -71.55, 'population': 330000},
+        ],
+        'AR': [
+            {'city': 'Mendoza', 'region': 'Mendoza', 'latitude': -32.89, 'longitude': -68.83, 'population': 115000},
+        ],
+    }
+    ciudades = {}
+    limitadas = set()
+    fallidos = set()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/paises':
+            return self.responder(self.paises)
+        codigo = parse_qs(url.query)['countryIds'][0]
+        if codigo in self.fallidos:
+            self.send_response(500)
+            self.end_headers()
+            return
+        if codigo == 'AR' and codigo not in self.limitadas:
+            self.limitadas.add(codigo)
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        self.responder({'data': self.ciudades[codigo]})
+
+    def responder(self, datos):
+        cuerpo = json.dumps(datos).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImportacionUbicacionesTests(TestCase):
+    def setUp(self):
+        ApiUbicacionesFalsa.ciudades = {codigo: list(ciudades) for codigo, ciudades in ApiUbicacionesFalsa.ciudades_base.items()}
+        ApiUbicacionesFalsa.limitadas = set()
+        ApiUbicacionesFalsa.fallidos = set()
+        servidor = ThreadingHTTPServer(('127.0.0.1', 0), ApiUbicacionesFalsa)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+        base = f'http://127.0.0.1:{servidor.server_port}'
+        self.importador = ImportadorUbicaciones(
+            url_paises=f'{base}/paises', url_ciudades=f'{base}/ciudades',
+            api_key='prueba', hilos=2, espera_base=0,
+        )
+        self.addCleanup(self.importador.sesion.close)
+
+    def test_importa_con_reintento_tras_429(self):
+        contador = self.importador.importar()
+
+        self.assertEqual(contador, {'paises': 2, 'regiones': 3, 'ciudades': 4, 'errores': []})
+        self.assertIn('AR', ApiUbicacionesFalsa.limitadas)
+        mendoza = Ciudad.objects.get(nombre='Mendoza')
+        self.assertEqual(mendoza.region.pais.codigo, 'AR')
+        self.assertEqual(mendoza.poblacion, 115000)
+        self.assertEqual(Ciudad.objects.filter(region__nombre='Valparaíso').count(), 2)
+        self.assertEqual(autocompletado.buscar_sin_cache('vina')[0]['id'], Ciudad.objects.get(nombre='Viña del Mar').id)
+
+    def test_reimportar_actualiza_sin_duplicar(self):
+        self.importador.importar()
+        Ciudad.objects.filter(nombre='Santiago').update(poblacion=1)
+
+        contador = self.importador.importar()
+
+        self.assertEqual(contador['regiones'], 0)
+        self.assertEqual(Pais.objects.count(), 2)
+        self.assertEqual(Region.objects.count(), 3)
+        self.assertEqual(Ciudad.objects.count(), 4)
+        self.assertEqual(Ciudad.objects.get(nombre='Santiago').poblacion, 6000000)
+
+    def test_solo_paises_indicados(self):
+        contador = self.importador.importar(codigos=['CL'])
+
+        self.assertEqual(contador['ciudades'], 3)
+        self.assertFalse(Ciudad.objects.filter(region__pais__codigo='AR').exists())
+
+    def test_sincronizacion_escribe_solo_diferencias(self):
+        primera = self.importador.sincronizar()
+        self.assertEqual(primera.resumen['insertadas'], 4)
+        self.assertIsNotNone(primera.finalizada)
+        self.assertTrue({'paises', 'descarga', 'comparacion', 'escritura', 'indexacion', 'total'} <= set(primera.tiempos))
+
+        segunda = self.importador.sincronizar()
+        self.assertEqual(segunda.resumen['sin_cambios'], 2)
+        self.assertEqual(segunda.resumen['insertadas'] + segunda.resumen['actualizadas'], 0)
+
+        chile = ApiUbicacionesFalsa.ciudades['CL']
+        chile[0] = dict(chile[0], population=6100000)
+        del chile[2]
+        chile.append({'city': 'Quilpué', 'region': 'Valparaíso', 'latitude': -33.05, 'longitude': -71.44, 'population': 150000})
+
+        tercera = self.importador.sincronizar()
+        self.assertEqual(tercera.resumen['sin_cambios'], 1)
+        self.assertEqual(
+            {clave: tercera.resumen[clave] for clave in ('insertadas', 'actualizadas', 'desactivadas')},
+            {'insertadas': 1, 'actualizadas': 1, 'desactivadas': 1},
+        )
+        vina = Ciudad.objects.get(nombre='Viña del Mar')
+        self.assertFalse(vina.activa)
+        self.assertEqual(Ciudad.objects.get(nombre='Santiago').poblacion, 6100000)
+        self.assertEqual(autocompletado.buscar_sin_cache('vina del'), [])
+
+        chile.append(ApiUbicacionesFalsa.ciudades_base['CL'][2])
+        cuarta = self.importador.sincronizar()
+        self.assertEqual(cuarta.resumen['actualizadas'], 1)
+        vina.refresh_from_db()
+        self.assertTrue(vina.activa)
+        self.assertEqual(autocompletado.buscar_sin_cache('vina del')[0]['id'], vina.id)
+
+    def test_reanudar_tras_error(self):
+        ApiUbicacionesFalsa.fallidos = {'AR'}
+        interrumpida = self.importador.sincronizar()
+        self.assertEqual(interrumpida.resumen['errores'], ['AR'])
+        self.assertIsNone(interrumpida.finalizada)
+        self.assertFalse(Ciudad.objects.filter(region__pais__codigo='AR').exists())
+
+        ApiUbicacionesFalsa.fallidos = set()
+        reanudada = self.importador.sincronizar(reanudar=True)
+
+        self.assertEqual(reanudada.id, interrumpida.id)
+        self.assertEqual(reanudada.resumen['reanudados'], 1)
+        self.assertEqual(reanudada.resumen['insertadas'], 4)
+        self.assertIsNotNone(reanudada.finalizada)
+        self.assertTrue(Ciudad.objects.filter(nombre='Mendoza').exists())
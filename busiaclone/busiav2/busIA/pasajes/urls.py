@@ -11,7 +11,10 @@ urlpatterns = [
     
     # APIs de búsqueda
     path('api/ciudades/buscar/', views.buscar_ciudades, name='buscar_ciudades'),
+    path('api/ciudades/cache/', views.estadisticas_cache_ciudades, name='estadisticas_cache_ciudades'),
     path('api/viajes/buscar/', views.buscar_viajes_api, name='buscar_viajes'),
+    path('api/viajes/calendario/', views.calendario_precios_api, name='calendario_precios'),
+    path('api/viajes/conexiones/', views.buscar_conexiones_api, name='buscar_conexiones'),
     
     # APIs de reserva
     path('api/asientos/<int:viaje_id>/', views.obtener_asientos_api, name='obtener_asientos'),
@@ -4,15 +4,21 @@ Vistas para la gestión de pasajes y viajes
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
 from django.db.models import Q
+from django.utils import timezone
 from datetime import datetime, timedelta
 import json
 import logging
 
-from .models import Linea, Bus, Asiento, Reserva, Ciudad, Viaje
-from .services import UbicacionService
+from .models import Linea, Bus, Asiento, Reserva, Ciudad, Viaje, DisponibilidadViaje
+from .services import UbicacionService, ViajeService, ReservaService, ConflictoReserva
+from . import autocompletado, busquedas, conexiones, disponibilidad
+from .asientos import forma_mapa
+from monitoreo.metricas import instrumentar
 
 logger = logging.getLogger(__name__)
 
@@ -29,120 +35,224 @@ def index(request):
     return redirect('comprar')
 
 # @login_required  # Temporalmente comentado para debug
+@instrumentar('busqueda_ciudades')
 def buscar_ciudades(request):
-    """API para buscar ciudades por nombre."""
+    """API para buscar ciudades por nombre (índice de autocompletado)."""
     try:
         query = request.GET.get('q', '')
         logger.debug(f"Buscando ciudades con query: {query}")
         
-        if len(query) < 2:
-            return JsonResponse({'results': []})
-        
-        ciudades = Ciudad.objects.filter(
-            Q(nombre__icontains=query) | 
-            Q(region__nombre__icontains=query) |
-            Q(region__pais__nombre__icontains=query)
-        ).select_related('region', 'region__pais')[:10]
-        
-        logger.debug(f"SQL Query: {ciudades.query}")
-        logger.debug(f"Ciudades encontradas: {list(ciudades)}")
-        
-        results = [{
-            'id': ciudad.id,
-            'text': f"{ciudad.nombre}, {ciudad.region.nombre}, {ciudad.region.pais.nombre}"
-        } for ciudad in ciudades]
-        
-        return JsonResponse({'results': results})
+        return JsonResponse({'results': autocompletado.buscar(query)})
     except Exception as e:
         logger.error(f"Error en buscar_ciudades: {str(e)}", exc_info=True)
         return JsonResponse({'error': str(e)}, status=500)
 
-@login_required
-def buscar_viajes_api(request):
-    """API para buscar viajes disponibles."""
+@staff_member_required
+def estadisticas_cache_ciudades(request):
+    """API (solo staff) con los aciertos y fallos de la cache de autocompletado."""
+    return JsonResponse(autocompletado.estadisticas_cache())
+
+def _parametros_busqueda(request):
+    """
+    Valida los parámetros de búsqueda de viajes
+    Raises:
+        ValueError: Si faltan parámetros o no son válidos
+    """
     origen_id = request.GET.get('origen')
     destino_id = request.GET.get('destino')
     fecha_str = request.GET.get('fecha')
     
     if not all([origen_id, destino_id, fecha_str]):
+        raise ValueError('Faltan parámetros requeridos')
+    
+    fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
+    if fecha < datetime.now().date():
+        raise ValueError('La fecha no puede ser anterior a hoy')
+    
+    fecha_hasta_str = request.GET.get('fecha_hasta')
+    fecha_hasta = datetime.strptime(fecha_hasta_str, '%Y-%m-%d').date() if fecha_hasta_str else None
+    
+    return {
+        'origen_id': int(origen_id),
+        'destino_id': int(destino_id),
+        'fecha_desde': fecha,
+        'fecha_hasta': fecha_hasta,
+        'orden': request.GET.get('orden', 'salida'),
+        'cursor': request.GET.get('cursor'),
+        'limite': int(request.GET.get('limite', ViajeService.LIMITE_POR_DEFECTO)),
+    }
+
+def _etag_busqueda(request):
+    """
+    ETag de la búsqueda a partir de las versiones de su ruta y días en la
+    cache (busquedas.huella), sin consultar la base de datos. Se calcula una
+    vez por solicitud: también es la clave del resultado guardado.
+    """
+    if not hasattr(request, '_etag_busqueda'):
+        try:
+            request._etag_busqueda = busquedas.huella(request.GET.urlencode(), _parametros_busqueda(request))
+        except ValueError:
+            request._etag_busqueda = None
+    return request._etag_busqueda
+
+def _etag_asientos(request, viaje_id):
+    """ETag del mapa de asientos a partir de la versión de disponibilidad del viaje."""
+    version = DisponibilidadViaje.objects.filter(
+        viaje_id=viaje_id
+    ).values_list('version', flat=True).first()
+    if version is None:
+        return None
+    return f"asientos-{viaje_id}-{version}-{request.GET.get('formato', 'lista')}"
+
+@login_required
+@instrumentar('busqueda_viajes')
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_etag_busqueda)
+def buscar_viajes_api(request):
+    """
+    API para buscar viajes disponibles. El resultado se guarda por ruta y
+    día hasta que cambie un viaje o su disponibilidad (pasajes.busquedas).
+    Responde 304 si el ETag enviado en If-None-Match sigue vigente.
+    """
+    try:
+        parametros = _parametros_busqueda(request)
+        resultado = busquedas.obtener(
+            _etag_busqueda(request), parametros, lambda: ViajeService.buscar_viajes(**parametros)
+        )
+    except ValueError as e:
         return JsonResponse({
-            'error': 'Faltan parámetros requeridos'
+            'error': str(e)
         }, status=400)
     
+    return JsonResponse(resultado)
+
+def _parametros_calendario(request):
+    """
+    Ruta, fecha central y días a cada lado del calendario de precios
+    Raises:
+        ValueError: Si faltan parámetros o no son válidos
+    """
+    parametros = _parametros_busqueda(request)
+    return {
+        'origen_id': parametros['origen_id'],
+        'destino_id': parametros['destino_id'],
+        'fecha': parametros['fecha_desde'],
+        'dias': int(request.GET.get('dias', ViajeService.DIAS_CALENDARIO)),
+    }
+
+def _etag_calendario(request):
+    """ETag del calendario a partir de las versiones de los viajes de la ventana."""
     try:
-        fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-        if fecha < datetime.now().date():
-            raise ValueError('La fecha no puede ser anterior a hoy')
+        parametros = _parametros_calendario(request)
+        desde, hasta = ViajeService.ventana_calendario(parametros['fecha'], parametros['dias'])
+    except ValueError:
+        return None
+    # La ventana depende del día actual, que también forma parte de la clave
+    clave = f'calendario:{desde}:{request.GET.urlencode()}'
+    return ViajeService.etag_busqueda(clave, parametros['origen_id'], parametros['destino_id'], desde, hasta)
+
+@login_required
+@instrumentar('calendario_precios')
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_etag_calendario)
+def calendario_precios_api(request):
+    """
+    API con la tarifa más baja y la disponibilidad de cada día alrededor de
+    la fecha buscada (?dias=3 por defecto), para el calendario de precios.
+    Responde 304 si el ETag enviado en If-None-Match sigue vigente.
+    """
+    try:
+        resultado = ViajeService.calendario_precios(**_parametros_calendario(request))
     except ValueError as e:
         return JsonResponse({
             'error': str(e)
         }, status=400)
-    
-    # Buscar viajes disponibles para la fecha
-    viajes_disponibles = Viaje.objects.filter(
-        bus__linea__origen_id=origen_id,
-        bus__linea__destino_id=destino_id,
-        fecha_salida__date=fecha,
-        estado='programado'
-    ).select_related(
-        'bus__linea',
-        'bus__linea__origen',
-        'bus__linea__destino'
-    ).order_by('fecha_salida')
-    
-    viajes = []
-    for viaje in viajes_disponibles:
-        asientos_disponibles = Asiento.objects.filter(
-            bus=viaje.bus,
-            reserva__isnull=True
-        ).count()
-        
-        if asientos_disponibles > 0:
-            viajes.append({
-                'viaje_id': viaje.id,
-                'bus_id': viaje.bus.id,
-                'empresa': viaje.bus.linea.nombre_empresa,
-                'origen': str(viaje.bus.linea.origen),
-                'destino': str(viaje.bus.linea.destino),
-                'hora_salida': viaje.fecha_salida.strftime('%H:%M'),
-                'duracion': str(viaje.bus.linea.duracion),
-                'precio': float(viaje.precio),
-                'asientos_disponibles': asientos_disponibles
-            })
-    
-    return JsonResponse({'viajes': viajes})
+
+    return JsonResponse(resultado)
 
 @login_required
+@instrumentar('busqueda_conexiones')
+def buscar_conexiones_api(request):
+    """
+    API para buscar itinerarios con escalas cuando no hay viaje directo.
+    Parámetros además de origen, destino y fecha: orden (llegada o precio),
+    tramos (máximo de tramos), conexion_minima y espera_maxima (minutos) y limite.
+    """
+    def minutos(nombre, por_defecto):
+        valor = request.GET.get(nombre)
+        return timedelta(minutes=int(valor)) if valor else por_defecto
+
+    try:
+        parametros = _parametros_busqueda(request)
+        itinerarios = conexiones.buscar(
+            parametros['origen_id'],
+            parametros['destino_id'],
+            parametros['fecha_desde'],
+            orden=request.GET.get('orden', 'llegada'),
+            tramos_maximos=int(request.GET.get('tramos', 2)),
+            conexion_minima=minutos('conexion_minima', conexiones.CONEXION_MINIMA),
+            espera_maxima=minutos('espera_maxima', conexiones.ESPERA_MAXIMA),
+            limite=int(request.GET.get('limite', conexiones.LIMITE_RESULTADOS)),
+        )
+    except ValueError as e:
+        return JsonResponse({
+            'error': str(e)
+        }, status=400)
+
+    return JsonResponse({'itinerarios': itinerarios})
+
+@login_required
+@instrumentar('mapa_asientos')
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_etag_asientos)
 def obtener_asientos_api(request, viaje_id):
-    """API para obtener el estado de los asientos de un viaje."""
+    """
+    API para obtener el estado de los asientos de un viaje.
+    Con ?formato=bits responde el mapa compacto (distribución más mapas de
+    bits de ocupación y tipo) pensado para consultas frecuentes. Responde
+    304 si el ETag enviado en If-None-Match sigue vigente.
+    """
     try:
-        viaje = Viaje.objects.get(id=viaje_id, estado='programado')
-        # Obtener asientos y sus reservas para la fecha del viaje
-        asientos = Asiento.objects.filter(bus=viaje.bus)
-        reservas = Reserva.objects.filter(
-            asiento__in=asientos,
-            fecha_viaje=viaje.fecha_salida.date(),
-            estado='confirmada'
-        ).values_list('asiento_id', flat=True)
+        viaje = Viaje.objects.select_related(
+            'bus',
+            'origen__region__pais',
+            'destino__region__pais',
+            'disponibilidad'
+        ).get(id=viaje_id, estado='programado')
+        # La ocupación se lee del mapa de bits materializado del viaje
+        try:
+            registro = viaje.disponibilidad
+        except DisponibilidadViaje.DoesNotExist:
+            registro = disponibilidad.obtener(viaje)
+        mapa = bytes(registro.mapa_ocupacion)
+        asientos = list(Asiento.objects.filter(bus_id=viaje.bus_id).values_list('id', 'numero', 'tipo'))
+        
+        datos_viaje = {
+            'id': viaje.id,
+            'empresa': viaje.nombre_empresa,
+            'origen': str(viaje.origen),
+            'destino': str(viaje.destino),
+            'fecha_salida': timezone.localtime(viaje.fecha_salida).strftime('%Y-%m-%d %H:%M'),
+            'precio': float(viaje.precio)
+        }
+        
+        if request.GET.get('formato') == 'bits':
+            return JsonResponse({
+                'viaje': datos_viaje,
+                **disponibilidad.mapa_compacto(asientos, mapa, **forma_mapa(viaje.bus.plantilla_asientos))
+            })
         
         asientos_data = []
-        for asiento in asientos:
+        for asiento_id, numero, tipo in asientos:
             asientos_data.append({
-                'id': asiento.id,
-                'numero': asiento.numero,
-                'tipo': asiento.tipo,
-                'ocupado': asiento.id in reservas
+                'id': asiento_id,
+                'numero': numero,
+                'tipo': tipo,
+                'ocupado': disponibilidad.asiento_ocupado(mapa, numero)
             })
         
         return JsonResponse({
-            'viaje': {
-                'id': viaje.id,
-                'empresa': viaje.bus.linea.nombre_empresa,
-                'origen': str(viaje.bus.linea.origen),
-                'destino': str(viaje.bus.linea.destino),
-                'fecha_salida': viaje.fecha_salida.strftime('%Y-%m-%d %H:%M'),
-                'precio': float(viaje.precio)
-            },
+            'viaje': datos_viaje,
             'asientos': asientos_data
         })
     except Viaje.DoesNotExist:
@@ -152,6 +262,7 @@ def obtener_asientos_api(request, viaje_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 @login_required
+@instrumentar('reserva')
 def crear_reserva(request):
     """API para crear una reserva."""
     try:
@@ -166,39 +277,30 @@ def crear_reserva(request):
         if fecha < datetime.now().date():
             raise ValueError('La fecha no puede ser anterior a hoy')
         
-        # Verificar que el asiento esté disponible
-        asiento = get_object_or_404(Asiento, id=asiento_id)
-        if Reserva.objects.filter(
-            asiento=asiento,
-            fecha_viaje=fecha,
-            estado='confirmada'
-        ).exists():
-            raise ValueError('El asiento ya está reservado')
-        
-        # Obtener el viaje y su precio
-        viaje = get_object_or_404(
-            Viaje,
-            bus=asiento.bus,
-            fecha_salida__date=fecha,
-            estado='programado'
-        )
-        
-        # Crear reserva confirmada
-        reserva = Reserva.objects.create(
-            usuario=request.user,
-            asiento=asiento,
-            fecha_viaje=fecha,
-            estado='confirmada',
-            precio=viaje.precio
-        )
+        # Con "retener" el asiento queda bloqueado de forma temporal hasta confirmar el pago
+        if data.get('retener'):
+            reserva, creada = ReservaService.retener(request.user, asiento_id, fecha)
+        else:
+            reserva, creada = ReservaService.reservar(request.user, asiento_id, fecha)
         
-        logger.info(f"Reserva {reserva.id} creada para {request.user}")
+        if creada:
+            logger.info(f"Reserva {reserva.id} creada para {request.user}")
         
         return JsonResponse({
             'reserva_id': reserva.id,
-            'precio': float(reserva.precio)
+            'precio': float(reserva.precio),
+            'estado': reserva.estado,
+            'expira_en': reserva.expira_en.isoformat() if reserva.expira_en else None
         })
         
+    except (Asiento.DoesNotExist, Viaje.DoesNotExist):
+        return JsonResponse({
+            'error': 'Asiento o viaje no encontrado'
+        }, status=404)
+    except ConflictoReserva as e:
+        return JsonResponse({
+            'error': str(e)
+        }, status=409)
     except ValueError as e:
         return JsonResponse({
             'error': str(e)
@@ -210,6 +312,7 @@ def crear_reserva(request):
         }, status=500)
 
 @login_required
+@instrumentar('confirmacion_pago')
 @require_http_methods(['POST'])
 def confirmar_pago(request, reserva_id):
     """API para confirmar el pago de una reserva."""
@@ -220,26 +323,23 @@ def confirmar_pago(request, reserva_id):
         if not order_id:
             raise ValueError('Falta el ID de la orden de PayPal')
         
-        reserva = get_object_or_404(
-            Reserva,
-            id=reserva_id,
-            usuario=request.user,
-            estado='pendiente'
-        )
-        
-        # Aquí deberíamos verificar el pago con PayPal
-        # Por ahora solo actualizamos el estado
-        reserva.estado = 'confirmada'
-        reserva.paypal_order_id = order_id
-        reserva.save()
-        
+        ReservaService.confirmar(request.user, reserva_id, order_id)
         return JsonResponse({'status': 'ok'})
         
+    except Reserva.DoesNotExist:
+        return JsonResponse({
+            'error': 'Reserva pendiente no encontrada'
+        }, status=404)
+    except ConflictoReserva as e:
+        return JsonResponse({
+            'error': str(e)
+        }, status=409)
     except ValueError as e:
         return JsonResponse({
             'error': str(e)
         }, status=400)
-    except Exception as e:
+    except Exception:
+        logger.exception(f"Error al confirmar el pago de la reserva {reserva_id}")
         return JsonResponse({
             'error': 'Error al confirmar el pago'
         }, status=500)
@@ -247,19 +347,24 @@ def confirmar_pago(request, reserva_id):
 @login_required
 def mis_viajes(request):
     """Vista para mostrar los viajes del usuario."""
-    reservas = Reserva.objects.filter(
+    reservas = list(Reserva.objects.filter(
         usuario=request.user,
         estado='confirmada'
-    ).select_related(
-        'asiento',
-        'asiento__bus',
-        'asiento__bus__linea',
-        'asiento__bus__linea__origen',
-        'asiento__bus__linea__destino'
-    ).order_by('-fecha_viaje')
-    
-    logger.debug(f"Reservas encontradas para {request.user}: {reservas.count()}")
-    
+    ).select_related('asiento__bus').order_by('-fecha_viaje'))
+
+    # Viaje del bus en cada fecha reservada, con la ruta copiada en Viaje.
+    # Se filtra por el rango [inicio, fin) de cada día local para usar los índices
+    viajes = Viaje.objects.filter(
+        bus_id__in={reserva.asiento.bus_id for reserva in reservas}
+    ).salen_en(
+        reserva.fecha_viaje for reserva in reservas
+    ).select_related('origen__region__pais', 'destino__region__pais').order_by('-fecha_salida')
+    por_bus_y_dia = {(viaje.bus_id, timezone.localdate(viaje.fecha_salida)): viaje for viaje in viajes}
+    for reserva in reservas:
+        reserva.viaje = por_bus_y_dia.get((reserva.asiento.bus_id, reserva.fecha_viaje))
+
+    logger.debug(f"Reservas encontradas para {request.user}: {len(reservas)}")
+
     return render(request, 'pasajes/mis_viajes.html', {
         'reservas': reservas
     })
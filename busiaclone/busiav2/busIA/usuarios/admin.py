@@ -1,3 +1,11 @@
 from django.contrib import admin
+from .models import CorreoPendiente
 
 # Register your models here.
+
+@admin.register(CorreoPendiente)
+class CorreoPendienteAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'asunto', 'estado', 'intentos', 'proximo_intento', 'enviado')
+    list_filter = ('estado', 'tipo')
+    search_fields = ('asunto', 'destinatarios')
+    readonly_fields = ('lote', 'reclamado', 'creado', 'enviado', 'ultimo_error')
@@ -1,48 +1,203 @@
 """
 Módulo para manejar el envío de emails en la aplicación de usuarios.
+
+Los correos no se envían dentro de la solicitud: se guardan en la cola de
+salida (CorreoPendiente) y el comando enviar_correos los despacha en lotes
+por una sola conexión SMTP, con reintentos y espera exponencial.
 """
 
-from django.core.mail import send_mail
+import logging
+import uuid
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.html import strip_tags
-from django.conf import settings
 
-def enviar_codigo_verificacion(usuario):
+from monitoreo import metricas
+from .models import CorreoPendiente
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 50
+MAX_INTENTOS = 6
+# Espera antes del reintento n: ESPERA_BASE * 2 ** (n - 1), como máximo ESPERA_MAXIMA
+ESPERA_BASE = timedelta(seconds=30)
+ESPERA_MAXIMA = timedelta(hours=1)
+# Un correo tomado por un proceso que murió vuelve a la cola pasado este tiempo
+RECLAMO_VENCIDO = timedelta(minutes=10)
+
+
+def encolar(tipo: str, destinatarios: Iterable[str], asunto: str, plantilla: str,
+            contexto: Dict, remitente: Optional[str] = None) -> CorreoPendiente:
+    """Renderiza la plantilla HTML y deja el correo en la cola de salida"""
+    html_mensaje = render_to_string(plantilla, contexto)
+    return CorreoPendiente.objects.create(
+        tipo=tipo,
+        destinatarios=list(destinatarios),
+        asunto=asunto,
+        cuerpo_texto=strip_tags(html_mensaje),
+        cuerpo_html=html_mensaje,
+        remitente=remitente or '',
+    )
+
+
+def enviar_codigo_verificacion(usuario, asunto='Verifica tu cuenta'):
     """
-    Envía el código de verificación al email del usuario.
+    Encola el código de verificación para el email del usuario.
     """
-    asunto = 'Verifica tu cuenta'
-    html_mensaje = render_to_string('usuarios/emails/verificacion.html', {
+    return encolar('verificacion', [usuario.email], asunto, 'usuarios/emails/verificacion.html', {
         'usuario': usuario,
         'codigo': usuario.codigo_verificacion
     })
-    mensaje_plano = strip_tags(html_mensaje)
-    
-    return send_mail(
-        asunto,
-        mensaje_plano,
-        settings.DEFAULT_FROM_EMAIL,
-        [usuario.email],
-        html_message=html_mensaje,
-        fail_silently=False
-    )
+
 
 def enviar_codigo_recuperacion(usuario, email_destino):
     """
-    Envía el código de recuperación al email especificado.
+    Encola el código de recuperación para el email especificado.
     """
-    asunto = 'Recuperación de cuenta'
-    html_mensaje = render_to_string('usuarios/emails/recuperacion.html', {
+    return encolar('recuperacion', [email_destino], 'Recuperación de cuenta', 'usuarios/emails/recuperacion.html', {
         'usuario': usuario,
         'codigo': usuario.codigo_recuperacion
     })
-    mensaje_plano = strip_tags(html_mensaje)
-    
-    return send_mail(
-        asunto,
-        mensaje_plano,
-        settings.DEFAULT_FROM_EMAIL,
-        [email_destino],
-        html_message=html_mensaje,
-        fail_silently=False
+
+
+def enviar_enlace_recuperacion(usuario, email_destino, token, dominio):
+    """
+    Encola el enlace para restablecer la cuenta.
+    """
+    return encolar('recuperacion', [email_destino], 'Recuperación de cuenta', 'usuarios/emails/recuperar_cuenta.html', {
+        'usuario': usuario,
+        'token': token,
+        'domain': dominio,
+    })
+
+
+def espera(intentos: int) -> timedelta:
+    return min(ESPERA_BASE * 2 ** (intentos - 1), ESPERA_MAXIMA)
+
+
+def reclamar(tamano_lote: int = TAMANO_LOTE):
+    """
+    Toma hasta tamano_lote correos vencidos para este proceso. La marca de
+    lote se escribe con un UPDATE condicionado al estado, así dos procesos
+    nunca toman el mismo correo.
+    """
+    ahora = timezone.now()
+    CorreoPendiente.objects.filter(estado='enviando', reclamado__lt=ahora - RECLAMO_VENCIDO).update(
+        estado='pendiente', lote=None, reclamado=None
+    )
+    ids = list(
+        CorreoPendiente.objects.filter(estado='pendiente', proximo_intento__lte=ahora)
+        .order_by('proximo_intento', 'id').values_list('id', flat=True)[:tamano_lote]
+    )
+    if not ids:
+        return []
+    lote = uuid.uuid4()
+    CorreoPendiente.objects.filter(id__in=ids, estado='pendiente').update(
+        estado='enviando', lote=lote, reclamado=ahora
+    )
+    return list(CorreoPendiente.objects.filter(lote=lote, estado='enviando'))
+
+
+def enviar_lote(tamano_lote: int = TAMANO_LOTE, max_intentos: int = MAX_INTENTOS, conexion=None) -> Dict[str, int]:
+    """
+    Envía un lote de la cola reutilizando una sola conexión del backend de email
+    Args:
+        conexion: Conexión compartida entre lotes; si se omite se abre y se
+            cierra una para este lote
+    Returns:
+        Dict: Correos enviados, reprogramados y fallidos definitivamente
+    """
+    correos = reclamar(tamano_lote)
+    totales = {'enviados': 0, 'reintentos': 0, 'fallidos': 0}
+    if not correos:
+        return totales
+
+    propia = conexion is None
+    conexion = conexion or get_connection(fail_silently=False)
+    try:
+        for indice, correo in enumerate(correos):
+            try:
+                # open() no hace nada si la conexión ya está abierta
+                conexion.open()
+            except Exception as e:
+                # Sin servidor no tiene sentido intentar el resto del lote
+                logger.error(f'No se pudo abrir la conexión de email: {e}')
+                for pendiente in correos[indice:]:
+                    _fallo(pendiente, e, max_intentos, totales)
+                break
+            try:
+                with metricas.medir('envio_email'):
+                    _mensaje(correo, conexion).send()
+            except Exception as e:
+                logger.warning(f'Error al enviar el correo {correo.id} ({correo.tipo}): {e}')
+                _fallo(correo, e, max_intentos, totales)
+                # La conexión puede haber quedado inutilizable: se reabre para el siguiente
+                conexion.close()
+            else:
+                correo.estado = 'enviado'
+                correo.enviado = timezone.now()
+                totales['enviados'] += 1
+    finally:
+        if propia:
+            conexion.close()
+        _guardar(correos)
+    return totales
+
+
+def _mensaje(correo: CorreoPendiente, conexion) -> EmailMultiAlternatives:
+    mensaje = EmailMultiAlternatives(
+        correo.asunto,
+        correo.cuerpo_texto,
+        correo.remitente or settings.DEFAULT_FROM_EMAIL,
+        correo.destinatarios,
+        connection=conexion,
     )
+    if correo.cuerpo_html:
+        mensaje.attach_alternative(correo.cuerpo_html, 'text/html')
+    return mensaje
+
+
+def _fallo(correo: CorreoPendiente, error: Exception, max_intentos: int, totales: Dict[str, int]):
+    correo.intentos += 1
+    correo.ultimo_error = str(error)[:2000]
+    if correo.intentos >= max_intentos:
+        correo.estado = 'fallido'
+        totales['fallidos'] += 1
+    else:
+        correo.estado = 'pendiente'
+        correo.proximo_intento = timezone.now() + espera(correo.intentos)
+        totales['reintentos'] += 1
+
+
+def _guardar(correos):
+    for correo in correos:
+        # Los que el lote no alcanzó a procesar (p. ej. por una interrupción) vuelven a la cola
+        if correo.estado == 'enviando':
+            correo.estado = 'pendiente'
+        correo.lote = None
+        correo.reclamado = None
+    with transaction.atomic():
+        CorreoPendiente.objects.bulk_update(correos, [
+            'estado', 'intentos', 'proximo_intento', 'ultimo_error', 'lote', 'reclamado', 'enviado'
+        ])
+
+
+def procesar_cola(tamano_lote: int = TAMANO_LOTE, max_intentos: int = MAX_INTENTOS) -> Dict[str, int]:
+    """Envía lotes por la misma conexión hasta que no queden correos vencidos"""
+    totales = {'enviados': 0, 'reintentos': 0, 'fallidos': 0}
+    conexion = get_connection(fail_silently=False)
+    try:
+        while True:
+            resultado = enviar_lote(tamano_lote, max_intentos, conexion)
+            for clave, valor in resultado.items():
+                totales[clave] += valor
+            if not any(resultado.values()):
+                return totales
+    finally:
+        conexion.close()
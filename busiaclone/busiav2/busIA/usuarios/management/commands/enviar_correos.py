@@ -0,0 +1,49 @@
+"""
+Comando para enviar los correos de la cola de salida
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from usuarios import emails
+
+class Command(BaseCommand):
+    help = 'Envía los correos pendientes en lotes por una sola conexión SMTP'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=emails.TAMANO_LOTE,
+            help='Correos tomados de la cola por lote',
+        )
+        parser.add_argument(
+            '--max-intentos',
+            type=int,
+            default=emails.MAX_INTENTOS,
+            help='Intentos antes de marcar un correo como fallido',
+        )
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='Sigue atendiendo la cola en lugar de terminar cuando se vacía',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=5,
+            help='Segundos de espera entre revisiones de la cola en modo continuo',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            inicio = time.monotonic()
+            resultado = emails.procesar_cola(tamano_lote=options['lote'], max_intentos=options['max_intentos'])
+            if any(resultado.values()) or not options['continuo']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Se enviaron {resultado["enviados"]} correos; {resultado["reintentos"]} se reintentarán '
+                    f'y {resultado["fallidos"]} fallaron definitivamente ({time.monotonic() - inicio:.2f}s)'
+                ))
+            if not options['continuo']:
+                return
+            time.sleep(options['intervalo'])
@@ -0,0 +1,68 @@
+"""
+Comando para notificar a los pasajeros de un viaje cancelado o retrasado
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from pasajes.models import Viaje
+from usuarios import notificaciones
+
+class Command(BaseCommand):
+    help = 'Envía por email la cancelación o el retraso de un viaje a todos sus pasajeros'
+
+    def add_arguments(self, parser):
+        parser.add_argument('viaje', type=int, help='ID del viaje')
+        parser.add_argument(
+            '--evento',
+            choices=list(notificaciones.EVENTOS),
+            required=True,
+            help='Tipo de aviso',
+        )
+        parser.add_argument(
+            '--minutos',
+            type=int,
+            default=None,
+            help='Minutos de retraso (para --evento retraso)',
+        )
+        parser.add_argument(
+            '--motivo',
+            default='',
+            help='Motivo que se incluye en el email',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=notificaciones.TAMANO_LOTE,
+            help='Mensajes por lote del informe y de la espera por límite de tasa (se envían de a uno por la misma conexión)',
+        )
+        parser.add_argument(
+            '--max-por-segundo',
+            type=float,
+            default=None,
+            help='Límite de mensajes por segundo (0 sin límite; por defecto NOTIFICACIONES_MAX_POR_SEGUNDO)',
+        )
+
+    def handle(self, *args, **options):
+        if options['evento'] == 'retraso' and options['minutos'] is None:
+            raise CommandError('--minutos es obligatorio para un retraso')
+        try:
+            viaje = Viaje.objects.select_related('origen__region__pais', 'destino__region__pais').get(id=options['viaje'])
+        except Viaje.DoesNotExist:
+            raise CommandError(f'No existe el viaje {options["viaje"]}')
+
+        notificador = notificaciones.NotificadorMasivo(
+            tamano_lote=options['lote'],
+            max_por_segundo=options['max_por_segundo'],
+        )
+        resultado = notificaciones.notificar_viaje(
+            viaje, options['evento'], notificador, motivo=options['motivo'], minutos=options['minutos'],
+        )
+        for numero, lote in enumerate(resultado['lotes'], 1):
+            self.stdout.write(
+                f'Lote {numero}: {lote["enviados"]}/{lote["mensajes"]} en {lote["segundos"]}s '
+                f'({lote["mensajes_por_segundo"]} mensajes/s)'
+            )
+        for email in resultado['rechazados']:
+            self.stdout.write(self.style.WARNING(f'Rechazado: {email}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Se notificó a {resultado["enviados"]} pasajeros en {resultado["segundos"]}s'
+        ))
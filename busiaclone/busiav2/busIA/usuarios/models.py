@@ -139,3 +139,43 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = 'Usuario'
         verbose_name_plural = 'Usuarios'
+
+class CorreoPendiente(models.Model):
+    """
+    Correo en la cola de salida. Las vistas solo lo encolan; el comando
+    enviar_correos los envía en lotes y reintenta los fallidos con espera
+    exponencial.
+    """
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('enviando', 'Enviando'),
+        ('enviado', 'Enviado'),
+        ('fallido', 'Fallido'),
+    ]
+
+    tipo = models.CharField(max_length=30)
+    destinatarios = models.JSONField()
+    asunto = models.CharField(max_length=255)
+    cuerpo_texto = models.TextField()
+    cuerpo_html = models.TextField(blank=True)
+    remitente = models.CharField(max_length=255, blank=True)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='pendiente')
+    intentos = models.PositiveSmallIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True)
+    # Identifica al proceso que tomó el correo para enviarlo
+    lote = models.UUIDField(null=True, blank=True)
+    reclamado = models.DateTimeField(null=True, blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    enviado = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.tipo} a {', '.join(self.destinatarios)} ({self.estado})"
+
+    class Meta:
+        verbose_name = 'Correo pendiente'
+        verbose_name_plural = 'Correos pendientes'
+        ordering = ['proximo_intento']
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento'], name='correo_estado_proximo_idx'),
+        ]
@@ -0,0 +1,171 @@
+"""
+Notificaciones masivas por email (cancelaciones y retrasos de viajes).
+
+Cada plantilla se renderiza una vez por idioma y los mensajes se envían de
+a uno sobre una sola conexión del backend, agrupados en lotes para medir y
+para limitar la cantidad de mensajes por segundo.
+"""
+
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import select_template
+from django.utils import timezone, translation
+from django.utils.html import strip_tags
+
+from monitoreo import metricas
+from pasajes.models import Reserva, Viaje
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 100
+MAX_POR_SEGUNDO = 20
+
+EVENTOS = {
+    'cancelacion': ('Tu viaje fue cancelado', 'viaje_cancelado.html'),
+    'retraso': ('Tu viaje tiene un retraso', 'viaje_retrasado.html'),
+}
+
+
+def plantilla(nombre: str, idioma: str):
+    """La versión del idioma (usuarios/emails/<idioma>/) si existe, si no la general"""
+    return select_template([f'usuarios/emails/{idioma}/{nombre}', f'usuarios/emails/{nombre}'])
+
+
+class NotificadorMasivo:
+    """
+    Envía un mismo mensaje a muchos destinatarios
+    Args:
+        tamano_lote: Mensajes de cada lote; el lote es la unidad del informe
+            y de la métrica envio_email_masivo, y tras cada uno se espera lo
+            necesario para respetar max_por_segundo (los mensajes se envían
+            de a uno por la misma conexión)
+        max_por_segundo: Límite de envío; 0 desactiva la espera
+        conexion: Conexión del backend de email ya creada (por defecto se
+            crea una y se mantiene abierta durante todo el envío)
+    """
+
+    def __init__(self, tamano_lote: int = TAMANO_LOTE, max_por_segundo: Optional[float] = None, conexion=None):
+        self.tamano_lote = tamano_lote
+        self.max_por_segundo = (
+            max_por_segundo if max_por_segundo is not None
+            else getattr(settings, 'NOTIFICACIONES_MAX_POR_SEGUNDO', MAX_POR_SEGUNDO)
+        )
+        self.conexion = conexion
+
+    def renderizar(self, nombre: str, contexto: Dict, idioma: str) -> Tuple[str, str]:
+        """Texto plano y HTML de la plantilla en el idioma"""
+        with translation.override(idioma):
+            html = plantilla(nombre, idioma).render(contexto)
+        return strip_tags(html), html
+
+    def enviar(self, asunto: str, nombre_plantilla: str, contexto: Dict,
+               destinatarios: Iterable[Tuple[str, str]]) -> Dict:
+        """
+        Args:
+            destinatarios: Pares (email, idioma)
+        Returns:
+            Dict: Totales, destinatarios rechazados, idiomas renderizados y,
+            por lote, mensajes, segundos y mensajes por segundo
+        """
+        por_idioma = defaultdict(list)
+        for email, idioma in destinatarios:
+            por_idioma[idioma or settings.LANGUAGE_CODE].append(email)
+
+        mensajes = []
+        for idioma, emails in por_idioma.items():
+            # Una sola renderización por idioma, compartida por todos sus destinatarios
+            texto, html = self.renderizar(nombre_plantilla, contexto, idioma)
+            for email in emails:
+                mensaje = EmailMultiAlternatives(asunto, texto, settings.DEFAULT_FROM_EMAIL, [email])
+                mensaje.attach_alternative(html, 'text/html')
+                mensajes.append(mensaje)
+
+        propia = self.conexion is None
+        conexion = self.conexion or get_connection(fail_silently=False)
+        resultado = {'enviados': 0, 'rechazados': [], 'lotes': []}
+        inicio = time.monotonic()
+        try:
+            for desde in range(0, len(mensajes), self.tamano_lote):
+                lote = mensajes[desde:desde + self.tamano_lote]
+                inicio_lote = time.monotonic()
+                enviados, rechazados = self._enviar_lote(conexion, lote)
+                segundos = time.monotonic() - inicio_lote
+                resultado['enviados'] += enviados
+                resultado['rechazados'].extend(rechazados)
+                resultado['lotes'].append({
+                    'mensajes': len(lote),
+                    'enviados': enviados,
+                    'segundos': round(segundos, 3),
+                    'mensajes_por_segundo': round(enviados / segundos, 1) if segundos else None,
+                })
+                self._esperar(desde + len(lote), inicio)
+        finally:
+            if propia:
+                conexion.close()
+        resultado['segundos'] = round(time.monotonic() - inicio, 3)
+        resultado['idiomas'] = len(por_idioma)
+        return resultado
+
+    def _enviar_lote(self, conexion, lote: List[EmailMultiAlternatives]) -> Tuple[int, List[str]]:
+        # Cada mensaje se envía por separado sobre la conexión abierta: si
+        # send_messages recibiera el lote completo y fallara a la mitad, no
+        # se sabría qué destinatarios ya lo recibieron
+        enviados, rechazados = 0, []
+        with metricas.medir('envio_email_masivo'):
+            for mensaje in lote:
+                mensaje.connection = conexion
+                try:
+                    # open() no hace nada si la conexión ya está abierta
+                    conexion.open()
+                    enviados += conexion.send_messages([mensaje]) or 0
+                except Exception as e:
+                    logger.warning(f'No se pudo notificar a {mensaje.to[0]}: {e}')
+                    rechazados.append(mensaje.to[0])
+                    # Tras un error la conexión se reabre para el mensaje siguiente
+                    conexion.close()
+        return enviados, rechazados
+
+    def _esperar(self, enviados: int, inicio: float):
+        """Duerme lo necesario para no superar max_por_segundo en promedio"""
+        if not self.max_por_segundo:
+            return
+        adelanto = enviados / self.max_por_segundo - (time.monotonic() - inicio)
+        if adelanto > 0:
+            time.sleep(adelanto)
+
+
+def pasajeros(viaje: Viaje) -> List[Tuple[str, str]]:
+    """
+    Destinatarios (email, idioma) de las reservas activas del viaje. Los
+    usuarios aún no tienen idioma propio, así que se usa LANGUAGE_CODE.
+    """
+    emails = Reserva.objects.filter(
+        asiento__bus_id=viaje.bus_id,
+        fecha_viaje=timezone.localdate(viaje.fecha_salida),
+        estado__in=Reserva.ESTADOS_ACTIVOS,
+    ).values_list('usuario__email', flat=True).distinct()
+    return [(email, settings.LANGUAGE_CODE) for email in emails]
+
+
+def notificar_viaje(viaje: Viaje, evento: str, notificador: Optional[NotificadorMasivo] = None, **contexto) -> Dict:
+    """
+    Notifica a los pasajeros de un viaje cancelado o retrasado
+    Args:
+        evento: 'cancelacion' o 'retraso'
+        contexto: Datos extra de la plantilla (motivo, minutos)
+    """
+    asunto, nombre_plantilla = EVENTOS[evento]
+    contexto = {
+        'empresa': viaje.nombre_empresa,
+        'origen': str(viaje.origen),
+        'destino': str(viaje.destino),
+        'salida': viaje.fecha_salida,
+        **contexto,
+    }
+    notificador = notificador or NotificadorMasivo()
+    return notificador.enviar(asunto, nombre_plantilla, contexto, pasajeros(viaje))
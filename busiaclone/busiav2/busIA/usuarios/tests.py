@@ -1,3 +1,229 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from smtplib import SMTPException
 
-# Create your tests here.
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from pasajes.models import Reserva
+from pasajes.tests import DatosPasajesMixin
+from . import emails, notificaciones
+from .models import CorreoPendiente, Usuario
+
+
+class BackendContador(locmem.EmailBackend):
+    """Backend locmem que cuenta las conexiones abiertas y falla para ciertos destinatarios"""
+    aperturas = 0
+    rechazados = set()
+    interrumpidos = set()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.abierta = False
+
+    def open(self):
+        if self.abierta:
+            return False
+        BackendContador.aperturas += 1
+        self.abierta = True
+        return True
+
+    def close(self):
+        self.abierta = False
+
+    def send_messages(self, messages):
+        # Como SMTP, los mensajes previos al rechazado ya quedan enviados
+        enviados = 0
+        for mensaje in messages:
+            if set(mensaje.to) & self.rechazados:
+                raise SMTPException('Destinatario rechazado')
+            if set(mensaje.to) & self.interrumpidos:
+                raise KeyboardInterrupt
+            enviados += super().send_messages([mensaje])
+        return enviados
+
+
+@override_settings(EMAIL_BACKEND='usuarios.tests.BackendContador')
+class ColaCorreosTests(TestCase):
+    def setUp(self):
+        BackendContador.aperturas = 0
+        BackendContador.rechazados = set()
+        BackendContador.interrumpidos = set()
+
+    def encolar(self, destinatario):
+        return emails.encolar('prueba', [destinatario], 'Asunto', 'usuarios/emails/verificacion.html', {
+            'usuario': None, 'codigo': '123456',
+        })
+
+    def test_registro_solo_encola_el_email(self):
+        response = self.client.post(reverse('usuarios:registro'), {
+            'nombre': 'Ana', 'email': 'ana@busia.test', 'password': 'clave-segura-123', 'password2': 'clave-segura-123',
+        })
+
+        self.assertRedirects(response, reverse('usuarios:verificar_email'), fetch_redirect_response=False)
+        self.assertEqual(mail.outbox, [])
+        correo = CorreoPendiente.objects.get()
+        usuario = Usuario.objects.get(email='ana@busia.test')
+        self.assertEqual((correo.tipo, correo.destinatarios), ('verificacion', ['ana@busia.test']))
+        self.assertIn(usuario.codigo_verificacion, correo.cuerpo_texto)
+
+        resultado = emails.procesar_cola()
+
+        self.assertEqual(resultado, {'enviados': 1, 'reintentos': 0, 'fallidos': 0})
+        self.assertEqual(mail.outbox[0].subject, 'Verifica tu cuenta en BusIA')
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        correo.refresh_from_db()
+        self.assertEqual(correo.estado, 'enviado')
+        self.assertIsNotNone(correo.enviado)
+
+    def test_recuperar_cuenta_encola_el_enlace(self):
+        Usuario.objects.create_user(email='luis@busia.test', nombre='Luis', password='clave-segura-123')
+        self.client.post(reverse('usuarios:recuperar_cuenta'), {'email': 'luis@busia.test'})
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(CorreoPendiente.objects.get().tipo, 'recuperacion')
+
+    def test_envia_varios_lotes_por_una_sola_conexion(self):
+        for i in range(7):
+            self.encolar(f'pasajero{i}@busia.test')
+
+        resultado = emails.procesar_cola(tamano_lote=3)
+
+        self.assertEqual(resultado['enviados'], 7)
+        self.assertEqual(len(mail.outbox), 7)
+        self.assertEqual(BackendContador.aperturas, 1)
+
+    def test_reintenta_con_espera_exponencial_y_luego_falla(self):
+        BackendContador.rechazados = {'rebota@busia.test'}
+        correo = self.encolar('rebota@busia.test')
+        self.encolar('ok@busia.test')
+
+        resultado = emails.procesar_cola(max_intentos=3)
+
+        self.assertEqual(resultado, {'enviados': 1, 'reintentos': 1, 'fallidos': 0})
+        correo.refresh_from_db()
+        self.assertEqual((correo.estado, correo.intentos), ('pendiente', 1))
+        self.assertIn('Destinatario rechazado', correo.ultimo_error)
+        espera = correo.proximo_intento - timezone.now()
+        self.assertTrue(timedelta(seconds=25) < espera <= emails.ESPERA_BASE)
+        # Tras un error la conexión se reabre para el siguiente correo
+        self.assertEqual(BackendContador.aperturas, 2)
+        self.assertEqual(emails.espera(3), emails.ESPERA_BASE * 4)
+
+        for _ in range(2):
+            CorreoPendiente.objects.filter(id=correo.id).update(proximo_intento=timezone.now())
+            emails.procesar_cola(max_intentos=3)
+        correo.refresh_from_db()
+        self.assertEqual((correo.estado, correo.intentos), ('fallido', 3))
+
+    def test_no_toma_correos_reclamados_salvo_si_el_reclamo_vencio(self):
+        correo = self.encolar('ana@busia.test')
+        self.assertEqual(emails.reclamar(), [correo])
+        self.assertEqual(emails.reclamar(), [])
+
+        CorreoPendiente.objects.filter(id=correo.id).update(
+            reclamado=timezone.now() - emails.RECLAMO_VENCIDO - timedelta(seconds=1)
+        )
+        self.assertEqual(emails.reclamar(), [correo])
+
+    def test_un_lote_interrumpido_devuelve_a_la_cola_lo_que_no_envio(self):
+        correos = [self.encolar(f'pasajero{i}@busia.test') for i in range(4)]
+        BackendContador.interrumpidos = {'pasajero1@busia.test'}
+
+        with self.assertRaises(KeyboardInterrupt):
+            emails.enviar_lote()
+
+        estados = dict(CorreoPendiente.objects.values_list('id', 'estado'))
+        self.assertEqual([estados[correo.id] for correo in correos], ['enviado', 'pendiente', 'pendiente', 'pendiente'])
+        self.assertFalse(CorreoPendiente.objects.filter(reclamado__isnull=False).exists())
+
+        BackendContador.interrumpidos = set()
+        self.assertEqual(emails.procesar_cola(), {'enviados': 3, 'reintentos': 0, 'fallidos': 0})
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), [f'pasajero{i}@busia.test' for i in range(4)])
+
+    def test_comando_enviar_correos(self):
+        self.encolar('ana@busia.test')
+        salida = StringIO()
+        call_command('enviar_correos', stdout=salida)
+        self.assertIn('Se enviaron 1 correos', salida.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(EMAIL_BACKEND='usuarios.tests.BackendContador')
+class NotificacionesMasivasTests(DatosPasajesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crear_datos()
+        bus = cls.crear_bus('001', asientos=8)
+        cls.viaje = cls.crear_viaje(bus)
+        for i, asiento in enumerate(bus.asiento_set.order_by('numero')[:6]):
+            usuario = Usuario.objects.create_user(
+                email=f'pasajero{i}@busia.test', nombre=f'Pasajero {i}', password='clave-segura-123'
+            )
+            Reserva.objects.create(
+                usuario=usuario, asiento=asiento, fecha_viaje=cls.fecha,
+                estado='cancelada' if i == 5 else 'confirmada', precio=Decimal('5000.00'),
+            )
+
+    def setUp(self):
+        BackendContador.aperturas = 0
+        BackendContador.rechazados = set()
+
+    def test_envia_en_lotes_por_una_sola_conexion(self):
+        notificador = notificaciones.NotificadorMasivo(tamano_lote=2, max_por_segundo=0)
+
+        resultado = notificaciones.notificar_viaje(self.viaje, 'cancelacion', notificador, motivo='Paro')
+
+        # La reserva cancelada no recibe aviso
+        self.assertEqual(resultado['enviados'], 5)
+        self.assertEqual([lote['mensajes'] for lote in resultado['lotes']], [2, 2, 1])
+        self.assertEqual(resultado['idiomas'], 1)
+        self.assertEqual(BackendContador.aperturas, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].subject, 'Tu viaje fue cancelado')
+        self.assertIn('Santiago', mail.outbox[0].body)
+        self.assertIn('Motivo: Paro', mail.outbox[0].body)
+
+    def test_aisla_los_destinatarios_rechazados(self):
+        BackendContador.rechazados = {'pasajero1@busia.test'}
+        notificador = notificaciones.NotificadorMasivo(tamano_lote=10, max_por_segundo=0)
+
+        resultado = notificaciones.notificar_viaje(self.viaje, 'retraso', notificador, minutos=45)
+
+        self.assertEqual(resultado['enviados'], 4)
+        self.assertEqual(resultado['rechazados'], ['pasajero1@busia.test'])
+        self.assertEqual(resultado['lotes'][0]['enviados'], 4)
+        self.assertIn('45 minutos', mail.outbox[0].body)
+
+    def test_un_rechazo_a_mitad_de_lote_no_duplica_envios(self):
+        BackendContador.rechazados = {'c@busia.test'}
+        notificador = notificaciones.NotificadorMasivo(tamano_lote=5, max_por_segundo=0)
+        destinatarios = [(f'{letra}@busia.test', 'es') for letra in 'abcde']
+
+        resultado = notificador.enviar('Aviso', 'viaje_cancelado.html', {'origen': 'Santiago'}, destinatarios)
+
+        self.assertEqual((resultado['enviados'], resultado['rechazados']), (4, ['c@busia.test']))
+        recibidos = sorted(mensaje.to[0] for mensaje in mail.outbox)
+        self.assertEqual(recibidos, ['a@busia.test', 'b@busia.test', 'd@busia.test', 'e@busia.test'])
+
+    def test_limita_los_mensajes_por_segundo(self):
+        notificador = notificaciones.NotificadorMasivo(tamano_lote=1, max_por_segundo=50)
+        resultado = notificaciones.notificar_viaje(self.viaje, 'cancelacion', notificador)
+        self.assertGreaterEqual(resultado['segundos'], 5 / 50 - 0.005)
+
+    def test_renderiza_una_vez_por_idioma(self):
+        notificador = notificaciones.NotificadorMasivo(max_por_segundo=0)
+        destinatarios = [('a@busia.test', 'es'), ('b@busia.test', 'en'), ('c@busia.test', 'es')]
+        resultado = notificador.enviar('Aviso', 'viaje_cancelado.html', {'origen': 'Santiago'}, destinatarios)
+        self.assertEqual((resultado['enviados'], resultado['idiomas']), (3, 2))
+
+    def test_comando_informa_el_rendimiento_por_lote(self):
+        salida = StringIO()
+        call_command('notificar_viaje', self.viaje.id, '--evento', 'cancelacion', '--lote', '3',
+                     '--max-por-segundo', '0', stdout=salida)
+        self.assertIn('Lote 1: 3/3', salida.getvalue())
+        self.assertIn('Se notificó a 5 pasajeros', salida.getvalue())
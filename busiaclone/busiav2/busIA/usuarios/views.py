@@ -8,14 +8,11 @@ from django.http import JsonResponse
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from django.core.mail import send_mail, EmailMultiAlternatives
-from django.conf import settings
 from django.utils import timezone
 from django.utils.decorators import method_decorator
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
 from django.contrib import messages
 from django.core.exceptions import ValidationError
+from django.db import transaction
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
@@ -27,13 +24,15 @@ import json
 import secrets
 import string
 import logging
-from smtplib import SMTPException
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
 from .models import Usuario
+from . import emails
 from pasajes.models import Reserva
+from pasajes import disponibilidad
+from monitoreo import metricas
 
 def registro(request):
     """Vista para registrar un nuevo usuario."""
@@ -64,54 +63,31 @@ def registro(request):
                 messages.error(request, 'Este email ya está registrado.')
                 return redirect('usuarios:registro')
             
-            # Crear el usuario
-            usuario = Usuario.objects.create_user(
-                email=email,
-                password=password,
-                nombre=nombre,
-                is_active=False  # El usuario estará inactivo hasta verificar su email
-            )
+            # El usuario y su email de verificación se guardan juntos o no se guarda ninguno
+            with transaction.atomic():
+                # Crear el usuario
+                usuario = Usuario.objects.create_user(
+                    email=email,
+                    password=password,
+                    nombre=nombre,
+                    is_active=False  # El usuario estará inactivo hasta verificar su email
+                )
+
+                # Generar código de verificación
+                usuario.generar_codigo_verificacion()
+
+                # El email se encola; el comando enviar_correos lo envía fuera de la solicitud
+                emails.enviar_codigo_verificacion(usuario, asunto='Verifica tu cuenta en BusIA')
             
-            # Generar código de verificación
-            codigo = usuario.generar_codigo_verificacion()
+            # Guardar el email en la sesión para el proceso de verificación
+            request.session['usuario_pendiente_verificacion'] = email
             
-            # Enviar email de verificación
-            try:
-                subject = 'Verifica tu cuenta en BusIA'
-                html_message = render_to_string('usuarios/emails/verificacion.html', {
-                    'usuario': usuario,
-                    'codigo': codigo
-                })
-                plain_message = strip_tags(html_message)
-                
-                send_mail(
-                    subject,
-                    plain_message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [email],
-                    html_message=html_message,
-                    fail_silently=False,
-                )
-                
-                # Guardar el email en la sesión para el proceso de verificación
-                request.session['usuario_pendiente_verificacion'] = email
-                
-                messages.success(
-                    request, 
-                    'Te hemos enviado un código de verificación a tu correo. '
-                    'Por favor, verifica tu cuenta para poder iniciar sesión.'
-                )
-                return redirect('usuarios:verificar_email')
-                
-            except SMTPException as e:
-                logger.error(f'Error al enviar email de verificación: {str(e)}')
-                usuario.delete()  # Eliminar el usuario si falla el envío
-                messages.error(
-                    request, 
-                    'Ha ocurrido un error al enviar el email de verificación. '
-                    'Por favor, intenta nuevamente.'
-                )
-                return redirect('usuarios:registro')
+            messages.success(
+                request, 
+                'Te hemos enviado un código de verificación a tu correo. '
+                'Por favor, verifica tu cuenta para poder iniciar sesión.'
+            )
+            return redirect('usuarios:verificar_email')
                 
         except Exception as e:
             logger.error(f'Error en registro: {str(e)}')
@@ -164,24 +140,10 @@ def reenviar_codigo(request):
     
     try:
         usuario = Usuario.objects.get(email=email, is_active=False)
-        codigo = usuario.generar_codigo_verificacion()
-        
-        # Enviar email de verificación
-        subject = 'Nuevo código de verificación - BusIA'
-        html_message = render_to_string('usuarios/emails/verificacion.html', {
-            'usuario': usuario,
-            'codigo': codigo
-        })
-        plain_message = strip_tags(html_message)
+        usuario.generar_codigo_verificacion()
         
-        send_mail(
-            subject,
-            plain_message,
-            settings.DEFAULT_FROM_EMAIL,
-            [email],
-            html_message=html_message,
-            fail_silently=False,
-        )
+        # El email se encola; el comando enviar_correos lo envía fuera de la solicitud
+        emails.enviar_codigo_verificacion(usuario, asunto='Nuevo código de verificación - BusIA')
         
         messages.success(
             request, 
@@ -191,19 +153,13 @@ def reenviar_codigo(request):
     except Usuario.DoesNotExist:
         messages.error(request, 'Usuario no encontrado.')
         return redirect('usuarios:login')
-    except SMTPException as e:
-        logger.error(f'Error al reenviar código de verificación: {str(e)}')
-        messages.error(
-            request, 
-            'Ha ocurrido un error al enviar el código. '
-            'Por favor, intenta nuevamente.'
-        )
     except Exception as e:
         logger.error(f'Error al reenviar código: {str(e)}')
         messages.error(request, 'Ha ocurrido un error. Por favor intenta nuevamente.')
     
     return redirect('usuarios:verificar_email')
 
+@metricas.instrumentar('login')
 def login_view(request):
     """Vista para iniciar sesión."""
     if request.method == 'POST':
@@ -224,12 +180,15 @@ def login_view(request):
                 if not remember:
                     request.session.set_expiry(0)
                 
+                metricas.LOGINS.inc(resultado='exito')
                 messages.success(request, '¡Bienvenido de vuelta!')
                 return redirect('usuarios:dashboard')
             else:
+                metricas.LOGINS.inc(resultado='no_verificada')
                 messages.error(request, 'Tu cuenta no ha sido verificada. Por favor, verifica tu email.')
                 return redirect('usuarios:verificar_email')
         else:
+            metricas.LOGINS.inc(resultado='credenciales_invalidas')
             messages.error(request, 'Email o contraseña incorrectos.')
             return redirect('usuarios:login')
     
@@ -343,7 +302,9 @@ def cancelar_reserva(request, reserva_id):
         return redirect('usuarios:dashboard')
     
     try:
-        reserva.delete()
+        with transaction.atomic():
+            reserva.delete()
+            disponibilidad.sincronizar_asiento(reserva.asiento, reserva.fecha_viaje)
         messages.success(request, 'Reserva cancelada exitosamente.')
     except Exception as e:
         logger.error(f'Error al cancelar reserva: {str(e)}')
@@ -369,37 +330,14 @@ def recuperar_cuenta(request):
             usuario.reset_token_created = timezone.now()
             usuario.save()
             
-            # Enviar email
-            subject = 'Recuperación de cuenta'
-            html_content = render_to_string('usuarios/emails/recuperar_cuenta.html', {
-                'usuario': usuario,
-                'token': token,
-                'domain': request.get_host(),
-            })
-            text_content = strip_tags(html_content)
+            # El email se encola; el comando enviar_correos lo envía fuera de la solicitud
+            emails.enviar_enlace_recuperacion(usuario, email, token, request.get_host())
             
-            try:
-                msg = EmailMultiAlternatives(
-                    subject,
-                    text_content,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [email]
-                )
-                msg.attach_alternative(html_content, "text/html")
-                msg.send()
-                
-                messages.success(
-                    request,
-                    'Te hemos enviado un email con instrucciones para recuperar tu cuenta.'
-                )
-                return redirect('usuarios:login')
-                
-            except SMTPException as e:
-                logger.error(f'Error al enviar email de recuperación: {str(e)}')
-                messages.error(
-                    request,
-                    'No pudimos enviar el email. Por favor, intenta más tarde.'
-                )
+            messages.success(
+                request,
+                'Te hemos enviado un email con instrucciones para recuperar tu cuenta.'
+            )
+            return redirect('usuarios:login')
                 
         except Usuario.DoesNotExist:
             # Por seguridad, no revelamos si el email existe o no